@@ -1,5 +1,9 @@
 import argparse
 import subprocess
+import sys
+
+sys.path.append("../tools")
+from build_checks import CHECK_LEVELS
 
 
 def parse_args(args=None):
@@ -24,6 +28,13 @@ def parse_args(args=None):
         type=str,
         help="downloaded semmed version year followed by two capitalized, alphabetical characters",
     )
+    parser.add_argument(
+        "-k",
+        "--checks",
+        default="fast",
+        choices=CHECK_LEVELS,
+        help="validation level. 'off' skips all checks, 'fast' writes diagnostic counts to ../data/metrics, 'full' also runs the expensive multi-pass assertions",
+    )
 
     return parser.parse_args(args)
 
@@ -38,6 +49,8 @@ def main(args):
             args.semmed_version,
             "--umls_date",
             args.umls_date,
+            "--checks",
+            args.checks,
         ]
     )
     subprocess.run(
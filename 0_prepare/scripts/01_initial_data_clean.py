@@ -12,6 +12,12 @@ import mygene
 
 sys.path.append("../tools")
 import load_umls
+from build_checks import (
+    CHECK_LEVELS,
+    checks_enabled,
+    collect_metrics,
+    write_stage_metrics,
+)
 
 # Set up logging
 logger = logging.getLogger()
@@ -48,6 +54,13 @@ def parse_args(args=None):
         type=str,
         help="downloaded semmed version year followed by two capitalized, alphabetical characters",
     )
+    parser.add_argument(
+        "-k",
+        "--checks",
+        default="fast",
+        choices=CHECK_LEVELS,
+        help="validation level. 'off' skips all checks, 'fast' writes diagnostic counts to ../data/metrics, 'full' also runs the expensive multi-pass assertions",
+    )
 
     return parser.parse_args(args)
 
@@ -117,6 +130,7 @@ def main(args):
         .collect()
     )
 
+    metrics = {"n_rows_raw": sem_df.shape[0]}
     logger.info(f"... Number of Rows in SemMedDB: {sem_df.shape[0]:,}")
     logger.info(f"... Number of Cols in SemMedDB: {sem_df.shape[1]:,}")
 
@@ -147,33 +161,46 @@ def main(args):
     #
     logger.info("Start initial data cleaning")
     logger.info("... Expand synonyms demarcated by pipes")
-    logger.info(
-        f'... {sem_df.filter(pl.col("SUBJECT_CUI").str.contains("|", literal=True)).shape[0]:,} Number of "Subject CUI" lines with pipe in subject'
-    )
-    logger.info(
-        f'... {sem_df.filter(pl.col("OBJECT_CUI").str.contains("|", literal=True)).shape[0]:,} Number of "OBJECT_CUI" lines with pipe in object'
-    )
-    logger.info(
-        "... Checking if SUBJECT and OBJECT CUI and NAME columns are the same length."
-    )
-    # Check if each split for SUBJECT_CUI and SUBJECT_NAME are the same length per line
-    assert (
-        sem_df.with_columns(
-            pl.col("SUBJECT_CUI").str.split("|"), pl.col("SUBJECT_NAME").str.split("|")
+    if checks_enabled(args.checks, "fast"):
+        metrics.update(
+            collect_metrics(
+                sem_df,
+                {
+                    "n_subject_cui_with_pipe": pl.col("SUBJECT_CUI")
+                    .str.contains("|", literal=True)
+                    .sum(),
+                    "n_object_cui_with_pipe": pl.col("OBJECT_CUI")
+                    .str.contains("|", literal=True)
+                    .sum(),
+                },
+            )
         )
-        .filter((pl.col("SUBJECT_CUI").list.len() != pl.col("SUBJECT_NAME").list.len()))
-        .shape[0]
-        == 0
-    ), "There are some SUBJECT_CUI and SUBJECT_NAME are of different lengths"
-    # Check if each split for OBJECT_CUI and OBJECT_NAME are _NOT_ the same length per line
-    assert (
-        sem_df.with_columns(
-            pl.col("OBJECT_CUI").str.split("|"), pl.col("OBJECT_NAME").str.split("|")
+    if checks_enabled(args.checks, "full"):
+        logger.info(
+            "... Checking if SUBJECT and OBJECT CUI and NAME columns are the same length."
         )
-        .filter((pl.col("OBJECT_CUI").list.len() != pl.col("OBJECT_NAME").list.len()))
-        .shape[0]
-        != 0
-    ), "OBJECT_CUI and OBJECT_NAME are _NOT_ different lengths"
+        lengths = collect_metrics(
+            sem_df,
+            {
+                "n_subject_len_mismatch": (
+                    pl.col("SUBJECT_CUI").str.count_matches("|", literal=True)
+                    != pl.col("SUBJECT_NAME").str.count_matches("|", literal=True)
+                ).sum(),
+                "n_object_len_mismatch": (
+                    pl.col("OBJECT_CUI").str.count_matches("|", literal=True)
+                    != pl.col("OBJECT_NAME").str.count_matches("|", literal=True)
+                ).sum(),
+            },
+        )
+        metrics.update(lengths)
+        # Check if each split for SUBJECT_CUI and SUBJECT_NAME are the same length per line
+        assert (
+            lengths["n_subject_len_mismatch"] == 0
+        ), "There are some SUBJECT_CUI and SUBJECT_NAME are of different lengths"
+        # Check if each split for OBJECT_CUI and OBJECT_NAME are _NOT_ the same length per line
+        assert (
+            lengths["n_object_len_mismatch"] != 0
+        ), "OBJECT_CUI and OBJECT_NAME are _NOT_ different lengths"
     logger.info("... Splitting SUBJECT and OBJECT CUI/NAME by pipes.")
     # Use polars to split SUBJECT/OBJECT and their CUI/NAME by pipes, and exclude malformed OBJECT lines
     sem_df = (
@@ -374,17 +401,18 @@ def main(args):
     gc.collect()
 
     logger.info("Applying Fixes to SemMed DataFrame")
+    # counts of rows with subjects/objects that are not CUIs (i.e. Entrez ids)
+    non_cui_exprs = {
+        "n_non_cui_subject": (~pl.col("SUBJECT_CUI").str.starts_with("C")).sum(),
+        "n_non_cui_object": (~pl.col("OBJECT_CUI").str.starts_with("C")).sum(),
+        "n_non_cui_subject_or_object": (
+            ~pl.col("SUBJECT_CUI").str.starts_with("C")
+            | ~pl.col("OBJECT_CUI").str.starts_with("C")
+        ).sum(),
+    }
     # apply the changes
-    logger.info("... before Entrez to CUI mapping")
-    logger.info(
-        f'... number of non-CUI subject rows: {sem_df.filter(~pl.col("SUBJECT_CUI").str.starts_with("C")).shape[0]:,}'
-    )
-    logger.info(
-        f'.... number of non-CUI object rows: {sem_df.filter(~pl.col("OBJECT_CUI").str.starts_with("C")).shape[0]:,}'
-    )
-    logger.info(
-        f'... number of non-CUI subject or object rows: {sem_df.filter(~pl.col("SUBJECT_CUI").str.starts_with("C")|~pl.col("OBJECT_CUI").str.starts_with("C")).shape[0]:,}'
-    )
+    if checks_enabled(args.checks, "fast"):
+        metrics["before_entrez_to_cui"] = collect_metrics(sem_df, non_cui_exprs)
     logger.info("... mapping Entrez to CUI")
     # converts subjects/object from entrez id to cui_ids via e_to_cui dictionary if and only if the cui is not an entrez id
     sem_df2 = pl.concat(
@@ -404,16 +432,8 @@ def main(args):
             ),
         ]
     )
-    logger.info("... after Entrez to CUI Mapping")
-    logger.info(
-        f'... number of non-CUI subject rows: {sem_df2.filter(~pl.col("SUBJECT_CUI").str.starts_with("C")).shape[0]:,}'
-    )
-    logger.info(
-        f'... number of non-CUI object rows: {sem_df2.filter(~pl.col("OBJECT_CUI").str.starts_with("C")).shape[0]:,}'
-    )
-    logger.info(
-        f'... number of non-CUI subject or object rows: {sem_df2.filter(~pl.col("SUBJECT_CUI").str.starts_with("C")|~pl.col("OBJECT_CUI").str.starts_with("C")).shape[0]:,}'
-    )
+    if checks_enabled(args.checks, "fast"):
+        metrics["after_entrez_to_cui"] = collect_metrics(sem_df2, non_cui_exprs)
 
     logger.info(
         f"... seperately export unmapped CUIs from initial cleaned SemMedDB copy to ../data/semmed{args.semmed_version}_no_CUI.parquet"
@@ -485,9 +505,11 @@ def main(args):
     )
 
     # How many unique s-p-o triples before de-depreication?
-    logger.info(
-        f"... {len(sem_df.unique(subset=['SUBJECT_CUI', 'PREDICATE', 'OBJECT_CUI'])):,} Unique S-P-O triples before de-deprecation"
-    )
+    spo_expr = {
+        "n_unique_spo": pl.struct(["SUBJECT_CUI", "PREDICATE", "OBJECT_CUI"]).n_unique()
+    }
+    if checks_enabled(args.checks, "fast"):
+        metrics["before_de_deprecation"] = collect_metrics(sem_df, spo_expr)
     logger.info("... De-deprecating CUIs")
     # Map the depricated values to their new CUIs
     sem_df = sem_df.with_columns(
@@ -504,13 +526,17 @@ def main(args):
     )  # Any removed CUIs should be taken out
 
     # How many unique spo triples after the corrections?
-    logger.info(
-        f"... {len(sem_df.unique(subset=['SUBJECT_CUI', 'PREDICATE', 'OBJECT_CUI'])):,} Unique S-P-O triples after de-deprecation"
-    )
+    if checks_enabled(args.checks, "fast"):
+        metrics["after_de_deprecation"] = collect_metrics(sem_df, spo_expr)
     logger.info(f"... Exporting SemMedDB, de-deprecated")
     sem_df.write_parquet(
         f"../data/semmed{args.semmed_version}_clean_de-deprecate.parquet"
     )
+    if checks_enabled(args.checks, "fast"):
+        metrics["n_rows_clean"] = sem_df.shape[0]
+        metrics_file = write_stage_metrics("01_initial_data_clean", metrics)
+        logger.info(f"... Stage metrics written to {metrics_file}")
+
     logger.info("Complete. 01_initial_data_clean.py has finished running.\n")
 
 
@@ -8,7 +8,6 @@ import sys  # 2a
 import tarfile  # 2b
 import urllib.request  # 2ab
 import xml.etree.ElementTree as ET  # 2bc
-from collections import defaultdict as dd  # 2c
 
 import polars as pl  # 2ab
 import requests  # 2d
@@ -16,7 +15,7 @@ from lxml import etree  # 2b
 from tqdm import tqdm  # 2b
 
 sys.path.append("../tools/")
-from parallel import parallel_process
+from parallel import TaskError, parallel_imap
 
 # Set up logging
 logger = logging.getLogger()
@@ -218,21 +217,19 @@ def main(args):
     logger.info(f"... Number of files to process: {len(files):,}")
     logger.info(f"... Processing")
 
-    results = parallel_process(files, get_id_to_year_map, n_jobs=32, front_num=0)
-    logger.info(f"... Files processed: {len(results):,}")
-
-    # logger.info(f'... Add a year to every entry in the file')
-    adict = dd(int)
-    for r in results:
-        adict[type(r)] += 1
-    id_to_year = {}
-    logger.info(f"... Filter out malformed xml entries from the year dictionary")
-    for r in results:
-        try:
+    # merge each file's year map as it arrives, in file order so later files take precedence
+    id_to_year, failed = {}, []
+    for file, r in zip(
+        files,
+        parallel_imap(files, get_id_to_year_map, n_jobs=32, errors="return"),
+    ):
+        if isinstance(r, TaskError):
+            failed.append(file)
+        else:
             id_to_year.update(r)
-        except:
-            # logger.info(f"... ... Did not update entry in the dictionary: {r}")
-            pass
+    logger.info(f"... Files processed: {len(files) - len(failed):,}")
+    if len(failed) > 0:
+        logger.info(f"... Skipped malformed xml files: {failed}")
 
     logger.info(f"... Number of entries in updated year dict: {len(id_to_year):,}")
     id_to_year_filt = {k: v for k, v, in id_to_year.items() if v is not None}
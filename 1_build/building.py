@@ -1,5 +1,9 @@
 import argparse
 import subprocess
+import sys
+
+sys.path.append("../tools")
+from build_checks import CHECK_LEVELS
 
 
 def parse_args(args=None):
@@ -88,6 +92,35 @@ def parse_args(args=None):
         type=str,
         help="downloaded semmed version year followed by two capitalized, alphabetical characters",
     )
+    parser.add_argument(
+        "-e",
+        "--cutoff",
+        default=0.001,
+        type=float,
+        help="fraction of all edges a relation type must exceed to be retained in the low abundance edge filter. Default is 0.001",
+    )
+    parser.add_argument(
+        "-V",
+        "--variants",
+        default=None,
+        nargs="+",
+        type=str,
+        help="split variants passed to 07, any of 'tt', 'ttv', 'hpo' with '_time' or '_notime', i.e. '-V tt_notime ttv_time'. Overrides the split and time flags",
+    )
+    parser.add_argument(
+        "-s",
+        "--time_store",
+        default=False,
+        action="store_true",
+        help="write a single time-indexed store to base_dir instead of a full network copy for every year",
+    )
+    parser.add_argument(
+        "-k",
+        "--checks",
+        default="fast",
+        choices=CHECK_LEVELS,
+        help="validation level passed to every build script. 'off' skips all checks, 'fast' writes diagnostic counts to ../data/metrics, 'full' also runs the expensive multi-pass assertions",
+    )
 
     return parser.parse_args(args)
 
@@ -141,6 +174,8 @@ def main(args):
         "./scripts/03_Condense_edge_semmantics_polars.py",
         "--semmed_version",
         args.semmed_version,
+        "--checks",
+        args.checks,
     ]
     for k, v in script_3_dict.items():
         if v == 1:
@@ -155,6 +190,10 @@ def main(args):
             "./scripts/04_filter_low_abundance_edges_polars.py",
             "--semmed_version",
             args.semmed_version,
+            "--cutoff",
+            str(args.cutoff),
+            "--checks",
+            args.checks,
         ]
     )
 
@@ -166,21 +205,26 @@ def main(args):
             "./scripts/05_Keep_Six_relevant_metanodes_polars.py",
             "--semmed_version",
             args.semmed_version,
+            "--cutoff",
+            str(args.cutoff),
+            "--checks",
+            args.checks,
         ]
     )
 
     # script 6
-    subprocess.run(
-        [
-            "python",
-            "-u",
-            "./scripts/06_Resolve_Network_Edges_by_Time_polars.py",
-            "--semmed_version",
-            args.semmed_version,
-            "--base_dir",
-            args.base_dir,
-        ]
-    )
+    script_6_ls = [
+        "python",
+        "-u",
+        "./scripts/06_Resolve_Network_Edges_by_Time_polars.py",
+        "--semmed_version",
+        args.semmed_version,
+        "--base_dir",
+        args.base_dir,
+    ]
+    if args.time_store == 1:
+        script_6_ls.append("--time_store")
+    subprocess.run(script_6_ls)
 
     # script 7
     script_7_dict = {
@@ -202,6 +246,8 @@ def main(args):
     for k, v in script_7_dict.items():
         if v == 1:
             script_7_ls.append(f"--{k}")
+    if args.variants is not None:
+        script_7_ls += ["--variants"] + args.variants
 
     subprocess.run(script_7_ls)
 
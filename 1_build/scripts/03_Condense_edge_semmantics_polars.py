@@ -8,6 +8,15 @@ from typing import Union
 import polars as pl
 from tqdm import tqdm
 
+sys.path.append("../tools")
+from build_checks import (
+    CHECK_LEVELS,
+    checks_enabled,
+    collect_metrics,
+    multi_type_node_count,
+    write_stage_metrics,
+)
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -51,6 +60,13 @@ def parse_args(args=None):
         action="store_true",
         help='Converts negative relations to bidirectional relations. i.e. "NEG_ISA" -> "ISA"',
     )
+    parser.add_argument(
+        "-k",
+        "--checks",
+        default="fast",
+        choices=CHECK_LEVELS,
+        help="validation level. 'off' skips all checks, 'fast' writes diagnostic counts to ../data/metrics, 'full' also runs the expensive multi-pass assertions",
+    )
 
     return parser.parse_args(args)
 
@@ -117,12 +133,6 @@ def main(args):
             edge_map["reverse"].to_list(),
         )
 
-        logger.info(
-            f"... Edge count prior to consolidating relation types: {edges.shape[0]:,}"
-        )
-        logger.info(
-            f"... Edge count after consolidating relation types: {edges_consolidated3.shape[0]:,}"
-        )
     else:
         logger.info(
             "... No edge semantics to condense as `--drop_negative_relations` and/or `--convert_negative_relations` are False."
@@ -140,15 +150,29 @@ def main(args):
             .drop("old_r")
         )
 
+    metrics = {
+        "n_edges_before_consolidation": edges.shape[0],
+        "n_edges_after_consolidation": edges_consolidated3.shape[0],
+    }
+
     #### Remove duplicated undirected edges
     logger.info("Removing duplicated undirected edges")
     # check all edge ids in nodes
-    assert (
-        tmp := edges_consolidated3.filter(~pl.col("h_id").is_in(nodes["id"])).shape[0]
-    ) == 0, f"... There are {tmp:,} edges that have head node ids not in nodes"  # no unlabeled head nodes
-    assert (
-        tmp := edges_consolidated3.filter(~pl.col("t_id").is_in(nodes["id"])).shape[0]
-    ) == 0, f"... There are {tmp:,} edges that have tail node ids not in nodes"  # no unlabeled tail nodes
+    if checks_enabled(args.checks, "fast"):
+        id_checks = collect_metrics(
+            edges_consolidated3,
+            {
+                "n_missing_head_ids": (~pl.col("h_id").is_in(nodes["id"])).sum(),
+                "n_missing_tail_ids": (~pl.col("t_id").is_in(nodes["id"])).sum(),
+            },
+        )
+        metrics.update(id_checks)
+        assert (
+            id_checks["n_missing_head_ids"] == 0
+        ), f"... There are {id_checks['n_missing_head_ids']:,} edges that have head node ids not in nodes"  # no unlabeled head nodes
+        assert (
+            id_checks["n_missing_tail_ids"] == 0
+        ), f"... There are {id_checks['n_missing_tail_ids']:,} edges that have tail node ids not in nodes"  # no unlabeled tail nodes
 
     abbrev_dict = create_acronym_dict(edges_consolidated3)
     # remove direction from the dictionary
@@ -173,136 +197,36 @@ def main(args):
     )
     # ensures that the abbreviations are correct because we removed the direction, and reapplied a relation conversion
     # edges = edges.drop("abbrev").rename({"calc_abbrev": "abbrev"})
-    logger.info(f"... checking transformation with some assertions")
-
-    # import pdb
-
-    # pdb.set_trace()
     # # check your transformation
-    assert (
-        sum(edges["calc_abbrev"] != edges["abbrev"]) == 0
-    ), "Some type mappings are incorrect."
+    if checks_enabled(args.checks, "fast"):
+        logger.info(f"... checking transformation with some assertions")
+        metrics["n_incorrect_abbrev"] = (
+            tmp := (edges["calc_abbrev"] != edges["abbrev"]).sum()
+        )
+        assert tmp == 0, "Some type mappings are incorrect."
 
     # check typing for all nodes, and make sure there are no nodes with multiple types
-    assert (
-        pl.concat(
-            [
-                edges[["h_id", "htype"]].rename({"h_id": "id", "htype": "type"}),
-                edges[["t_id", "ttype"]].rename({"t_id": "id", "ttype": "type"}),
-            ]
-        )
-        .unique()
-        .group_by("id")
-        .agg("type")
-        .with_columns(
-            pl.col("type").list.unique(),
-            pl.col("type").list.unique().list.len().alias("count"),
-        )
-        .filter(pl.col("count") > 1)
-    ).shape[0] == 0, "There are nodes with multiple types"
+    if checks_enabled(args.checks, "full"):
+        assert multi_type_node_count(edges) == 0, "There are nodes with multiple types"
 
     #### Undirected edges between two nodes of the same type should only have 1 instance
     logger.info("Remove duplicate edges between nodes of the same type...")
-    # Get the edges that are un-directed, between same type
-    self_ref_df = edges.filter(
-        (pl.col("htype") == pl.col("ttype")) & (~pl.col("abbrev").str.contains(">"))
+    new_edges = dedup_undirected_edges(
+        edges, verify=checks_enabled(args.checks, "full")
     )
 
-    og_self_ref_df = self_ref_df.shape
-    # create the complement of the self_ref_df
-    non_self_ref_df = edges.join(
-        self_ref_df, on=["h_id", "t_id", "sem", "rtype", "abbrev"], how="anti"
-    ).drop("")
-    logger.info(f"... dropping duplicates of non-directional edge types")
-
-    # For self referential edge types without direction, sort the h_id and t_id and drop duplicates
-    # group by h_id,t_id,old_r,abbrev,rev_abbrev,is_neg,sem,rtype,calc_abbrev
-    # aggregate the pmid and recount the number of pmids
-    # 1 min 45s -> 2.3s!
-    self_ref_df = (
-        self_ref_df.explode("pmid")
-        .unique(["pmid", "rtype", "h_id", "t_id"])
-        .with_columns(
-            pl.when(pl.col("h_id") > pl.col("t_id"))
-            .then(pl.col("t_id"))
-            .otherwise(pl.col("h_id"))
-            .alias("h_id"),
-            pl.when(pl.col("t_id") > pl.col("h_id"))
-            .then(pl.col("t_id"))
-            .otherwise(pl.col("h_id"))
-            .alias("t_id"),
-        )
-        .group_by(
-            [
-                "h_id",
-                "t_id",
-                # "old_r",
-                "r",
-                "htype",
-                "ttype",
-                "r_type",
-                "r_dir",
-                "abbrev",
-                "rev_abbrev",
-                "sem",
-                "rtype",
-            ]
-        )
-        .agg("pmid")
-        .with_columns(pl.col("pmid").list.len().alias("n_pmids"))
-    )[
-        [
-            "h_id",
-            "t_id",
-            # "old_r",
-            "pmid",
-            "n_pmids",
-            "r",
-            "htype",
-            "ttype",
-            "r_type",
-            "r_dir",
-            "abbrev",
-            "rev_abbrev",
-            "sem",
-            "rtype",
-        ]
-    ]
-    logger.info(
-        f"... Before De-duplication: {og_self_ref_df[0]:,} Edges between nodes of the same type"
-    )
-    logger.info(
-        f"... After De-duplication: {self_ref_df.shape[0]:,} Edges between nodes of the same type"
-    )
+    # drop duplicates left over in the directed/mixed type edges
+    new_edges = new_edges.unique(["h_id", "t_id", "sem", "rtype", "abbrev"])
 
-    # drop duplicates from non_self_ref_df
-    # merge the self_ref_df and non_self_ref_df
+    metrics["n_edges_before_dedup"] = edges.shape[0]
+    metrics["n_edges_after_dedup"] = new_edges.shape[0]
 
-    new_edges = pl.concat([self_ref_df, non_self_ref_df], how="diagonal").unique(
-        ["h_id", "t_id", "sem", "rtype", "abbrev"]
-    )
-
-    logger.info(f"... {len(edges):,} edges before deduplication")
-    logger.info(f"... {len(new_edges):,} edges after deduplication")
-
-    logger.info(f"... double checks to ensure no nodes with multiple types")
     # check typing for all nodes, and make sure there are no nodes with multiple types
-    assert (
-        pl.concat(
-            [
-                new_edges[["h_id", "htype"]].rename({"h_id": "id", "htype": "type"}),
-                new_edges[["t_id", "ttype"]].rename({"t_id": "id", "ttype": "type"}),
-            ]
-        )
-        .unique()
-        .group_by("id")
-        .agg("type")
-        .with_columns(
-            pl.col("type").list.unique(),
-            pl.col("type").list.unique().list.len().alias("count"),
-        )
-        .filter(pl.col("count") > 1)
-    ).shape[0] == 0, "There are nodes with multiple types"
+    if checks_enabled(args.checks, "full"):
+        logger.info(f"... double checks to ensure no nodes with multiple types")
+        assert (
+            multi_type_node_count(new_edges) == 0
+        ), "There are nodes with multiple types"
 
     logger.info("... relabeling column names")
     # relabel the edge columns in the new_edges
@@ -329,28 +253,24 @@ def main(args):
         ]
     ]
     #### Finish de-duplication and merge any pmids between those duplicated edges
-    # check if any pmids are duplicated by expanding the pmids and grouping by the columns
-    assert (
-        new_edges.shape[0]
-        == new_edges.explode("pmids")
-        .group_by(
-            [
-                "h_id",
-                "t_id",
-                "r",
-                "htype",
-                "ttype",
-                "rtype",
-                "rdir",
-                "abbrev",
-                "rev_abbrev",
-                "sem",
-            ]
-        )
-        .agg("pmids")
-        .with_columns(pl.col("pmids").list.len().alias("n_pmids"))
-        .shape[0]
-    ), "Some pmids are duplicated and you should deduplicate by performing a groupby"
+    # pmids are merged in `dedup_undirected_edges`, so only check that no edge is repeated
+    if checks_enabled(args.checks, "full"):
+        edge_cols = [
+            "h_id",
+            "t_id",
+            "r",
+            "htype",
+            "ttype",
+            "rtype",
+            "rdir",
+            "abbrev",
+            "rev_abbrev",
+            "sem",
+        ]
+        assert (
+            new_edges.shape[0]
+            == new_edges.select(pl.struct(edge_cols).n_unique()).item()
+        ), "Some pmids are duplicated and you should deduplicate by performing a groupby"
 
     #### Export files
 
@@ -366,6 +286,10 @@ def main(args):
         f"../data/nodes_{args.semmed_version}_consolidated_condensed.parquet"
     )
 
+    if checks_enabled(args.checks, "fast"):
+        metrics_file = write_stage_metrics("03_condense_edge_semantics", metrics)
+        logger.info(f"... Stage metrics written to {metrics_file}")
+
     logger.info("Complete processing 03_Condensing_edge_semantics.py\n")
 
 
@@ -439,6 +363,71 @@ def change_edge_type2(
     return edges_swap
 
 
+def dedup_undirected_edges(edges: pl.DataFrame, verify: bool = True) -> pl.DataFrame:
+    """
+    Given edges dataframe, collapse undirected edges between nodes of the same type so (a, r, b) and (b, r, a) become one edge.
+    Node ids are ordered so that h_id <= t_id, and the pmid lists of edges sharing (h_id, t_id, rtype) are merged.
+    Directed edges and edges between nodes of different types are returned untouched.
+
+    :edges:     edges dataframe with 'h_id', 't_id', 'htype', 'ttype', 'abbrev', 'rtype', 'pmid' and 'n_pmids' columns
+    :verify:    check no edge or pmid is counted twice after merging
+    """
+    undirected = (pl.col("htype") == pl.col("ttype")) & (
+        ~pl.col("abbrev").str.contains(">")
+    )
+    keep_cols = [
+        c for c in edges.columns if c not in ["h_id", "t_id", "pmid", "n_pmids"]
+    ]
+
+    self_ref_df = edges.filter(undirected)
+    # complement of self_ref_df; same result as an anti-join on the edge keys without the join
+    non_self_ref_df = edges.filter(~undirected)
+
+    dedup_df = (
+        self_ref_df.lazy()
+        .with_columns(
+            pl.min_horizontal("h_id", "t_id").alias("h_id"),
+            pl.max_horizontal("h_id", "t_id").alias("t_id"),
+        )
+        .group_by(["h_id", "t_id", "rtype"])
+        .agg(
+            pl.col([c for c in keep_cols if c != "rtype"]).first(),
+            pl.col("pmid").flatten().unique(),  # merge pmids without exploding rows
+        )
+        .with_columns(pl.col("pmid").list.len().alias("n_pmids"))
+        .select("h_id", "t_id", *keep_cols, "pmid", "n_pmids")
+        .collect()
+    )
+
+    logger.info(
+        f"... Before De-duplication: {self_ref_df.shape[0]:,} Edges between nodes of the same type"
+    )
+    logger.info(
+        f"... After De-duplication: {dedup_df.shape[0]:,} Edges between nodes of the same type"
+    )
+
+    if verify:
+        logger.info("... checking de-duplicated edges")
+        checks = dedup_df.select(
+            pl.struct(["h_id", "t_id", "rtype"]).n_unique().alias("n_edges"),
+            (pl.col("h_id") > pl.col("t_id")).sum().alias("n_unordered"),
+            (pl.col("pmid").list.len() != pl.col("pmid").list.unique().list.len())
+            .sum()
+            .alias("n_dup_pmids"),
+        ).row(0, named=True)
+        assert (
+            checks["n_edges"] == dedup_df.shape[0]
+        ), f"... There are {dedup_df.shape[0] - checks['n_edges']:,} duplicated edges"
+        assert (
+            checks["n_unordered"] == 0
+        ), f"... There are {checks['n_unordered']:,} edges with h_id > t_id"
+        assert (
+            checks["n_dup_pmids"] == 0
+        ), f"... There are {checks['n_dup_pmids']:,} edges with duplicated pmids"
+
+    return pl.concat([dedup_df, non_self_ref_df], how="diagonal_relaxed")
+
+
 def create_acronym_dict(edges: pl.DataFrame) -> dict:
     """
     Given edges dataframe, extract relations, to create a dictionary of label abbreviations
@@ -1,10 +1,21 @@
 import argparse
+import json
 import logging
+import os
 import sys
+from typing import Dict, Iterable, List, Optional, Tuple
 
-import pandas as pd
 import polars as pl
 
+sys.path.append("../tools")
+from build_checks import (
+    CHECK_LEVELS,
+    checks_enabled,
+    collect_metrics,
+    cutoff_suffix,
+    write_stage_metrics,
+)
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -18,6 +29,113 @@ ch.setFormatter(formatter)
 # add ch to logger
 logger.addHandler(ch)
 
+#### filter overly general nodes
+# These are from the 100 most common nodes, removing things that are too general to be useful
+TOO_GENERAL = [
+    # "Atherosclerosis",
+    "Neoplasm" "Tissues",
+    "Malignant neoplastic disease",
+    "Inflammation",
+    "Wounds and Injuries",
+    "Growth",
+    #  'Brain',
+    #  'Liver',
+    "Apoptosis",
+    "Infectious disease",
+    "Cell Line",
+    "Traumatic injury",
+    "Lesion",
+    #  'DNA',
+    "Antibodies",
+    "Mice",
+    "Water",
+    "Toxic effect",
+    #  'ETIOL',
+    #  'Kidney',
+    #  'Glucose',
+    "receptor",
+    #  'Lung',
+    "Oxidative Stress",
+    #  'TNF gene',
+    #  'Ethanol',
+    "Cytokines",
+    #  'Heart',
+    #  'Obesity',
+    "Surgical Procedures, Operative",
+    #  'CD69 gene',
+    #  'Neurons',
+    "Cell Proliferation",
+    #  'TNF protein, human',
+    #  'Hypertensive disorder',
+    "Reactive Oxygen Species",
+    "Hypersensitivity",
+    "Rats",
+    "Obstruction",
+    #  'Calcium',
+    "Metabolism",
+    #  'Nitric Oxide',
+    "Inflammatory Response",
+    #  'Proto-Oncogene Proteins c-akt',
+    #  'Diabetes',
+    #  'Blood',
+    "Lipopolysaccharides",
+    "Amino Acids",
+    "Base Sequence",
+    #  'Fibrosis',
+    "Cessation of life",
+    "Lipids",
+    #  'Plasma',
+    #  'Pain',
+    "Cytoplasm",
+    #  'Serum',
+    "Child",
+    #  'Interleukin-6',
+    #  'Insulin',
+    #  'Insulin Resistance',
+    "Signal Transduction",
+    #  'Stress',
+    "tumor growth",
+    #  'Breast cancer',
+    "Organ",
+    #  'NF-kappa B',
+    #  'Interleukin-1beta',
+    #  'Phosphotransferases',
+    "Antioxidants",
+    #  'Colorectal Neoplasms',
+    "Ions",
+    #  'RNA, Messenger',
+    "Anti-Bacterial Agents",
+    "Membrane",
+    #  'AKT1 gene',
+    "Cell Transformation, Neoplastic",
+    #  'Genes, p53',
+    #  'hepatocellular carcinoma',
+    #  'Thrombosis',
+    #  'Macrophages',
+    #  'CD69 antigen',
+    #  'IMPACT gene',
+    #  'Fibroblasts',
+    #  'Tissue Adhesions',
+    #  'Phosphorylation',
+    #  'ATP8A2 gene',
+    "Transcription, Genetic",
+    "Women",
+    #  'COVID-19',
+    #  'Hypoxia',
+    "Immunity",
+    "Antigens",
+    "Muscles",
+    "Transcription Factors",
+    "Homologous Gene",
+    #  "Alzheimer's disease",
+    "cytotoxicity",
+    #  'ATP8A2 protein, human',
+    #  'Aging',
+    "Binding Sites",
+    "Cell Death",
+    "MicroRNAs",
+]
+
 
 def parse_args(args=None):
     parser = argparse.ArgumentParser(
@@ -33,6 +151,34 @@ def parse_args(args=None):
         type=str,
         help="version number, a string, for SemMed dump",
     )
+    parser.add_argument(
+        "-c",
+        "--cutoff",
+        default=0.001,
+        type=float,
+        help="fraction of all edges a relation type must exceed to be retained. Default is 0.001",
+    )
+    parser.add_argument(
+        "-g",
+        "--too_general",
+        default=None,
+        type=str,
+        help="optional text file with one node name per line to remove as too general. Defaults to the built-in `TOO_GENERAL` list",
+    )
+    parser.add_argument(
+        "-s",
+        "--sweep",
+        default=None,
+        type=str,
+        help="optional json file of {'cutoffs': [...], 'metanode_sets': {name: [node types to remove]}}. Runs a parameter sweep over the condensed network instead of a single filter, see ../data/filter_sweep.json",
+    )
+    parser.add_argument(
+        "-k",
+        "--checks",
+        default="fast",
+        choices=CHECK_LEVELS,
+        help="validation level. 'off' skips all checks, 'fast' writes diagnostic counts to ../data/metrics, 'full' also runs the expensive multi-pass assertions",
+    )
 
     return parser.parse_args(args)
 
@@ -41,203 +187,371 @@ def main(args):
     logger.info(f"Running 04_filter_low_abundance_edges.py")
     logger.info("... Loading data")
     #### Filter low abundance edges
-    nodes = pl.read_parquet(
+    nodes = pl.scan_parquet(
         f"../data/nodes_{args.semmed_version}_consolidated_condensed.parquet"
     )
-    edges = pl.read_parquet(
+    edges = pl.scan_parquet(
         f"../data/edges_{args.semmed_version}_consolidated_condensed.parquet"
     )
+    too_general = read_too_general(args.too_general)
 
-    comp = len(nodes.filter(pl.col("label") == "Chemicals & Drugs"))
-    dis = len(nodes.filter(pl.col("label") == "Disorders"))
-    logger.info(
-        f"... {comp:,} Compounds x {dis:,} Diseases = {comp*dis:,} Compound-Disease combinations"
-    )
-    # get edge type counts, sorted by count
-    counts = edges["r"].value_counts()
-    logger.info(f"... There are {counts.shape[0]:,} unique edge types")
+    if args.sweep is not None:
+        run_sweep(args, nodes=nodes, edges=edges, too_general=too_general)
+        return
 
-    logger.info("... Filtering low abundance edges")
-    cutoff = 0.001
-    logger.info(f"... Total Number of edges: {len(edges):,}")
     logger.info(
-        f"... Applying a {cutoff:%} cutoff to edges. Only edges greater than {cutoff*len(edges):,} will be retained."
+        f"... Applying a {args.cutoff:%} cutoff to edges and removing {len(too_general):,} overly general nodes"
     )
-    logger.info(
-        f"... Number of edge types with this cutoff: {len((filt_counts:=counts.filter(pl.col('count')>(cutoff*len(edges))))):,}"
+    filt_nodes, filt_edges = filter_low_abundance_edges(
+        nodes=nodes, edges=edges, cutoff=args.cutoff, too_general=too_general
     )
+    # collect both plans together so the shared edge filtering is only run once
+    filt_nodes, filt_edges = pl.collect_all([filt_nodes, filt_edges])
     logger.info(
-        f"... Number of edges that remain with this cutoff: {len(filt_edges:=edges.filter(pl.col('r').is_in(filt_counts['r']))):,}"
+        f"... {filt_nodes.shape[0]:,} Nodes and {filt_edges.shape[0]:,} Edges remain after filtering"
     )
 
-    logger.info("... Get the nodes from the filtered edge dataframe")
-    # get edge_ids from filtered edges
-    edge_ids = set(filt_edges["h_id"].to_list()).union(
-        set(filt_edges["t_id"].to_list())
+    if checks_enabled(args.checks, "fast"):
+        metrics = {"cutoff": args.cutoff}
+        metrics.update(
+            collect_metrics(
+                nodes,
+                {
+                    "n_compounds": (pl.col("label") == "Chemicals & Drugs").sum(),
+                    "n_diseases": (pl.col("label") == "Disorders").sum(),
+                    "n_nodes_before": pl.len(),
+                },
+            )
+        )
+        metrics.update(
+            collect_metrics(
+                edges,
+                {
+                    "n_edges_before": pl.len(),
+                    "n_edge_types_before": pl.col("r").n_unique(),
+                    "n_edges_above_cutoff": (
+                        pl.len().over("r") > args.cutoff * pl.len()
+                    ).sum(),
+                },
+            )
+        )
+        metrics.update(
+            collect_metrics(
+                filt_edges,
+                {
+                    "n_edges_after": pl.len(),
+                    "n_edge_types_after": pl.col("r").n_unique(),
+                },
+            )
+        )
+        metrics["n_nodes_after"] = filt_nodes.shape[0]
+        metrics["edges_with_at_least_n_pmids"] = dict(
+            pmid_histogram(filt_edges.lazy()).collect().iter_rows()
+        )
+
+    if checks_enabled(args.checks, "full"):
+        # every node id should be unique and every edge should point to a retained node
+        assert (
+            filt_nodes["id"].n_unique() == filt_nodes.shape[0]
+        ), "Node ids should be unique"
+        assert (
+            filt_edges.lazy()
+            .select(pl.concat_list("h_id", "t_id").alias("id"))
+            .explode("id")
+            .join(filt_nodes.lazy(), on="id", how="anti")
+            .select(pl.len())
+            .collect()
+            .item()
+            == 0
+        ), "Some edges have node ids not in nodes"
+
+    logger.info("... Saving data")
+    # the cutoff is part of the file names, i.e. '_filtered_001' for 0.001, so 05 must be given the same cutoff
+    filt_edges.write_parquet(
+        f"../data/edges_{args.semmed_version}_consolidated_condensed_filtered_{cutoff_suffix(args.cutoff)}.parquet"
+    )
+    filt_nodes.write_parquet(
+        f"../data/nodes_{args.semmed_version}_consolidated_condensed_filtered_{cutoff_suffix(args.cutoff)}.parquet"
     )
-    logger.info(f"... Number of unique nodes in filtered edges: {len(edge_ids):,}")
 
-    node_ids = set(nodes["id"].unique().to_list())
-    logger.info(f"... Number of unique nodes in nodes: {len(node_ids):,}")
-    not_in_edges = node_ids - edge_ids
-    logger.info(f"... Number of nodes not in edges: {len(not_in_edges):,}")
-    nodes = nodes.filter(pl.col("id").is_in(not_in_edges).not_())
-    assert len(nodes) == len(edge_ids), "Number of nodes and edges should be the same"
-    logger.info(f"... Number of nodes in nodes after filtering: {len(nodes):,}")
+    if checks_enabled(args.checks, "fast"):
+        metrics_file = write_stage_metrics("04_filter_low_abundance_edges", metrics)
+        logger.info(f"... Stage metrics written to {metrics_file}")
 
-    filt_edge_sz = filt_edges.shape[0]
-    filt_edges = filt_edges.filter(pl.col("h_id") != pl.col("t_id"))
+    logger.info("Complete processing 04_filter_low_abundance_edges.py\n")
 
-    logger.info(
-        f"... Number of edges prior to removal of self-referential edges: {filt_edge_sz:,}"
-    )
-    logger.info(
-        f"... Number of edges after removal of self-referential edges: {filt_edges.shape[0]:,}"
-    )
-
-    logger.info("... remove overly general nodes (top most commonly occurring)")
-
-    #### filter overly general nodes
-    # These are from the 100 most common nodes, removing things that are too general to be useful
-    too_general = [
-        # "Atherosclerosis",
-        "Neoplasm" "Tissues",
-        "Malignant neoplastic disease",
-        "Inflammation",
-        "Wounds and Injuries",
-        "Growth",
-        #  'Brain',
-        #  'Liver',
-        "Apoptosis",
-        "Infectious disease",
-        "Cell Line",
-        "Traumatic injury",
-        "Lesion",
-        #  'DNA',
-        "Antibodies",
-        "Mice",
-        "Water",
-        "Toxic effect",
-        #  'ETIOL',
-        #  'Kidney',
-        #  'Glucose',
-        "receptor",
-        #  'Lung',
-        "Oxidative Stress",
-        #  'TNF gene',
-        #  'Ethanol',
-        "Cytokines",
-        #  'Heart',
-        #  'Obesity',
-        "Surgical Procedures, Operative",
-        #  'CD69 gene',
-        #  'Neurons',
-        "Cell Proliferation",
-        #  'TNF protein, human',
-        #  'Hypertensive disorder',
-        "Reactive Oxygen Species",
-        "Hypersensitivity",
-        "Rats",
-        "Obstruction",
-        #  'Calcium',
-        "Metabolism",
-        #  'Nitric Oxide',
-        "Inflammatory Response",
-        #  'Proto-Oncogene Proteins c-akt',
-        #  'Diabetes',
-        #  'Blood',
-        "Lipopolysaccharides",
-        "Amino Acids",
-        "Base Sequence",
-        #  'Fibrosis',
-        "Cessation of life",
-        "Lipids",
-        #  'Plasma',
-        #  'Pain',
-        "Cytoplasm",
-        #  'Serum',
-        "Child",
-        #  'Interleukin-6',
-        #  'Insulin',
-        #  'Insulin Resistance',
-        "Signal Transduction",
-        #  'Stress',
-        "tumor growth",
-        #  'Breast cancer',
-        "Organ",
-        #  'NF-kappa B',
-        #  'Interleukin-1beta',
-        #  'Phosphotransferases',
-        "Antioxidants",
-        #  'Colorectal Neoplasms',
-        "Ions",
-        #  'RNA, Messenger',
-        "Anti-Bacterial Agents",
-        "Membrane",
-        #  'AKT1 gene',
-        "Cell Transformation, Neoplastic",
-        #  'Genes, p53',
-        #  'hepatocellular carcinoma',
-        #  'Thrombosis',
-        #  'Macrophages',
-        #  'CD69 antigen',
-        #  'IMPACT gene',
-        #  'Fibroblasts',
-        #  'Tissue Adhesions',
-        #  'Phosphorylation',
-        #  'ATP8A2 gene',
-        "Transcription, Genetic",
-        "Women",
-        #  'COVID-19',
-        #  'Hypoxia',
-        "Immunity",
-        "Antigens",
-        "Muscles",
-        "Transcription Factors",
-        "Homologous Gene",
-        #  "Alzheimer's disease",
-        "cytotoxicity",
-        #  'ATP8A2 protein, human',
-        #  'Aging',
-        "Binding Sites",
-        "Cell Death",
-        "MicroRNAs",
-    ]
-
-    nodes = nodes.filter(pl.col("name").is_in(too_general).not_())
-    logger.info(
-        f"... {nodes.shape[0]:,} Nodes remain after filtering out nodes that are too general"
+
+def read_too_general(file_name: Optional[str] = None) -> list:
+    """
+    Read a list of overly general node names, one per line. Returns `TOO_GENERAL` if no file is given
+    """
+    if file_name is None:
+        return TOO_GENERAL
+
+    with open(file_name, "r") as f:
+        return [line.strip() for line in f if line.strip() != ""]
+
+
+def filter_low_abundance_edges(
+    nodes: pl.LazyFrame,
+    edges: pl.LazyFrame,
+    cutoff: float = 0.001,
+    too_general: Iterable[str] = TOO_GENERAL,
+) -> Tuple[pl.LazyFrame, pl.LazyFrame]:
+    """
+    Build a lazy plan that filters low abundance relations and prunes nodes.
+    1. keep edges whose relation, 'r', occurs in more than `cutoff` of all edges
+    2. keep nodes that are attached to one of the retained edges
+    3. remove self-referential edges
+    4. remove nodes in `too_general` and any edges attached to them
+
+    :nodes:         lazy nodes dataframe with 'id' and 'name' columns
+    :edges:         lazy edges dataframe with 'h_id', 't_id' and 'r' columns
+    :cutoff:        fraction of all edges a relation type must exceed to be retained
+    :too_general:   node names to remove
+
+    returns a tuple of lazy (nodes, edges)
+    """
+    # window count of each relation against the total number of edges
+    filt_edges = edges.filter(pl.len().over("r") > cutoff * pl.len())
+
+    # nodes attached to at least one retained edge
+    edge_ids = pl.concat(
+        [
+            filt_edges.select(pl.col("h_id").alias("id")),
+            filt_edges.select(pl.col("t_id").alias("id")),
+        ]
+    ).unique()
+    filt_nodes = nodes.join(edge_ids, on="id", how="semi").filter(
+        ~pl.col("name").is_in(list(too_general))
     )
-    prior_to_filtering = filt_edges.shape[0]
 
-    filt_edges = filt_edges.filter(
-        pl.col("h_id").is_in(nodes["id"]), pl.col("t_id").is_in(nodes["id"])
+    # drop self-referential edges and edges attached to removed nodes
+    node_ids = filt_nodes.select("id")
+    filt_edges = (
+        filt_edges.filter(pl.col("h_id") != pl.col("t_id"))
+        .join(node_ids, left_on="h_id", right_on="id", how="semi")
+        .join(node_ids, left_on="t_id", right_on="id", how="semi")
     )
 
+    return filt_nodes, filt_edges
+
+
+def run_sweep(
+    args, nodes: pl.LazyFrame, edges: pl.LazyFrame, too_general: Iterable[str]
+) -> None:
+    """
+    Run a parameter sweep over edge abundance cutoffs and metanode sets, and write the variant masks and summary to ../data/sweep_<semmed_version>
+    """
+    with open(args.sweep, "r") as f:
+        sweep_config = json.load(f)
+
     logger.info(
-        f"... Number of edges prior to filtering out nodes that are too general: {prior_to_filtering:,}"
+        f"... Sweeping {len(sweep_config['cutoffs']):,} cutoffs x {len(sweep_config['metanode_sets']):,} metanode sets"
     )
-    logger.info(
-        f"... Number of edges after filtering out nodes that are too general: {filt_edges.shape[0]:,}"
-    )
-    counts = filt_edges["n_pmids"].value_counts().sort("count", descending=True)
-    x = counts.to_pandas()
-    for i in range(1, 11):
-        logger.info(
-            "... Edges with at least {} unique PMIDs: {:,}".format(
-                i, (x.query("n_pmids >= @i")["count"].sum())
+    indications = pl.scan_parquet("../data/indications_nodemerge.parquet").drop_nulls(
+        "approval_year"
+    )
+    node_masks, edge_masks, summary = sweep_filters(
+        nodes=nodes,
+        edges=edges,
+        indications=indications,
+        cutoffs=sweep_config["cutoffs"],
+        metanode_sets=sweep_config["metanode_sets"],
+        too_general=too_general,
+    )
+
+    out_dir = f"../data/sweep_{args.semmed_version}"
+    os.makedirs(out_dir, exist_ok=True)
+    node_masks.write_parquet(os.path.join(out_dir, "node_masks.parquet"))
+    edge_masks.write_parquet(os.path.join(out_dir, "edge_masks.parquet"))
+    summary.write_csv(os.path.join(out_dir, "summary.csv"))
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        logger.info(f"... Sweep summary:\n{summary}")
+    logger.info(f"... Sweep masks and summary written to {out_dir}")
+    logger.info("Complete processing 04_filter_low_abundance_edges.py\n")
+
+
+def sweep_filters(
+    nodes: pl.LazyFrame,
+    edges: pl.LazyFrame,
+    indications: pl.LazyFrame,
+    cutoffs: List[float],
+    metanode_sets: Dict[str, List[str]],
+    too_general: Iterable[str] = TOO_GENERAL,
+) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    Evaluate every combination of relation abundance cutoff and metanode set over the condensed network in one pass.
+    Equivalent to running `filter_low_abundance_edges` followed by 05_Keep_Six_relevant_metanodes for each variant.
+    Relation counts and each node's most abundant relation are computed once, so every variant reduces to a boolean mask over the shared node and edge rows.
+
+    :nodes:         lazy condensed nodes dataframe with 'id', 'name' and 'label' columns
+    :edges:         lazy condensed edges dataframe with 'h_id', 't_id' and 'r' columns
+    :indications:   lazy indications dataframe with 'compound_semmed_id' and 'disease_semmed_id' columns
+    :cutoffs:       fractions of all edges a relation type must exceed to be retained
+    :metanode_sets: names mapped to the node types (metanodes) to remove
+    :too_general:   node names to remove
+
+    returns a tuple of
+        node_masks  -> node 'id' and one boolean column per variant
+        edge_masks  -> edge 'row_nr' (row position in the condensed edges file) and one boolean column per variant
+        summary     -> number of nodes, edges, relation types and indications per variant
+    """
+    edges = edges.select("h_id", "t_id", "r").with_row_index("row_nr")
+    n_edges = edges.select(pl.len()).collect().item()
+
+    # relation counts, and the count of each node's most abundant relation.
+    # a node is attached to a retained edge for a cutoff if its most abundant relation passes the cutoff
+    rel_counts = edges.group_by("r").agg(pl.len().alias("rel_count"))
+    node_rel_counts = (
+        pl.concat(
+            [
+                edges.select(pl.col("h_id").alias("id"), "r"),
+                edges.select(pl.col("t_id").alias("id"), "r"),
+            ]
+        )
+        .unique()
+        .join(rel_counts, on="r")
+        .group_by("id")
+        .agg(pl.col("rel_count").max().alias("max_rel_count"))
+    )
+    nodes = nodes.select("id", "label", "name").join(
+        node_rel_counts, on="id", how="left"
+    )
+    node_attrs = nodes.select(
+        "id", "label", pl.col("name").is_in(list(too_general)).alias("too_general")
+    )
+    edges = (
+        edges.join(rel_counts, on="r")
+        .join(
+            node_attrs.rename(
+                {"id": "h_id", "label": "h_label", "too_general": "h_general"}
+            ),
+            on="h_id",
+        )
+        .join(
+            node_attrs.rename(
+                {"id": "t_id", "label": "t_label", "too_general": "t_general"}
+            ),
+            on="t_id",
+        )
+    )
+
+    node_exprs, edge_exprs = dict(), dict()
+    for cutoff in cutoffs:
+        for set_name, remove_types in metanode_sets.items():
+            variant = f"cutoff_{cutoff:g}-{set_name}"
+            min_count = cutoff * n_edges
+            node_exprs[variant] = (
+                (pl.col("max_rel_count") > min_count)
+                & ~pl.col("name").is_in(list(too_general))
+                & ~pl.col("label").is_in(remove_types)
+            ).fill_null(False)
+            edge_exprs[variant] = (
+                (pl.col("rel_count") > min_count)
+                & (pl.col("h_id") != pl.col("t_id"))
+                & ~pl.col("h_general")
+                & ~pl.col("t_general")
+                & ~pl.col("h_label").is_in(remove_types)
+                & ~pl.col("t_label").is_in(remove_types)
             )
+
+    node_masks, edge_masks = pl.collect_all(
+        [
+            nodes.select("id", **node_exprs),
+            edges.sort("row_nr").select("row_nr", "r", **edge_exprs),
+        ]
+    )
+
+    # count indications whose compound and disease both remain in each variant
+    ind_masks = (
+        indications.select("compound_semmed_id", "disease_semmed_id")
+        .join(
+            node_masks.lazy(),
+            left_on="compound_semmed_id",
+            right_on="id",
+        )
+        .join(
+            node_masks.lazy(),
+            left_on="disease_semmed_id",
+            right_on="id",
+            suffix="_disease",
         )
+        .select(
+            **{v: (pl.col(v) & pl.col(f"{v}_disease")).sum() for v in node_exprs.keys()}
+        )
+        .collect()
+    )
 
-    logger.info("... Saving data")
-    filt_edges.write_parquet(
-        f"../data/edges_{args.semmed_version}_consolidated_condensed_filtered_001.parquet"
+    summary = pl.DataFrame(
+        [
+            {
+                "variant": variant,
+                "cutoff": cutoff,
+                "metanode_set": set_name,
+                "n_nodes": node_masks[variant].sum(),
+                "n_edges": edge_masks[variant].sum(),
+                "n_relations": edge_masks.filter(pl.col(variant))["r"].n_unique(),
+                "n_indications": ind_masks[variant].item(),
+            }
+            for cutoff in cutoffs
+            for set_name in metanode_sets.keys()
+            for variant in [f"cutoff_{cutoff:g}-{set_name}"]
+        ]
+    )
+
+    return node_masks, edge_masks.drop("r"), summary
+
+
+def load_sweep_variant(
+    variant: str,
+    semmed_version: str = "VER43_R",
+    data_dir: str = "../data",
+) -> Tuple[pl.LazyFrame, pl.LazyFrame]:
+    """
+    Lazily materialize the nodes and edges of a single sweep variant from the condensed network and the sweep masks
+    """
+    sweep_dir = os.path.join(data_dir, f"sweep_{semmed_version}")
+    node_masks = pl.scan_parquet(os.path.join(sweep_dir, "node_masks.parquet"))
+    edge_masks = pl.scan_parquet(os.path.join(sweep_dir, "edge_masks.parquet"))
+
+    nodes = pl.scan_parquet(
+        os.path.join(data_dir, f"nodes_{semmed_version}_consolidated_condensed.parquet")
+    ).join(node_masks.filter(pl.col(variant)).select("id"), on="id", how="semi")
+    edges = (
+        pl.scan_parquet(
+            os.path.join(
+                data_dir, f"edges_{semmed_version}_consolidated_condensed.parquet"
+            )
+        )
+        .with_row_index("row_nr")
+        .join(
+            edge_masks.filter(pl.col(variant)).select("row_nr"), on="row_nr", how="semi"
+        )
+        .drop("row_nr")
     )
-    nodes.write_parquet(
-        f"../data/nodes_{args.semmed_version}_consolidated_condensed_filtered_001.parquet"
+
+    return nodes, edges
+
+
+def pmid_histogram(edges: pl.LazyFrame, max_pmids: int = 10) -> pl.LazyFrame:
+    """
+    Cumulative count of edges with at least `n_pmids` unique PMIDs, for n_pmids from 1 to `max_pmids`
+    """
+    counts = (
+        edges.group_by(pl.col("n_pmids").cast(pl.Int64))
+        .agg(pl.len().alias("count"))
+        .sort("n_pmids", descending=True)
+        .with_columns(pl.col("count").cum_sum().alias("n_edges"))
+        .sort("n_pmids")
     )
 
-    logger.info("Complete processing 04_filter_low_abundance_edges.py\n")
+    return (
+        pl.LazyFrame({"n_pmids": range(1, max_pmids + 1)}, schema={"n_pmids": pl.Int64})
+        .join_asof(counts, on="n_pmids", strategy="forward")
+        .select("n_pmids", pl.col("n_edges").fill_null(0))
+    )
 
 
 if __name__ == "__main__":
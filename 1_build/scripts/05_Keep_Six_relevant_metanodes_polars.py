@@ -4,6 +4,16 @@ import sys
 
 import polars as pl
 
+sys.path.append("../tools")
+from build_checks import (
+    CHECK_LEVELS,
+    checks_enabled,
+    collect_metrics,
+    cutoff_suffix,
+    multi_type_node_count,
+    write_stage_metrics,
+)
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -17,6 +27,16 @@ ch.setFormatter(formatter)
 # add ch to logger
 logger.addHandler(ch)
 
+# Node types that are less-useful and removed from the network
+REMOVE_TYPES = [
+    "Organizations",
+    "Activities & Behaviors",
+    "Concepts & Ideas",
+    "Procedures",
+    "Devices",
+    "Living Beings",
+]
+
 
 def parse_args(args=None):
     parser = argparse.ArgumentParser(
@@ -32,6 +52,28 @@ def parse_args(args=None):
         type=str,
         help="version number, a string, for SemMed dump",
     )
+    parser.add_argument(
+        "-c",
+        "--cutoff",
+        default=0.001,
+        type=float,
+        help="edge abundance cutoff the network was filtered with in 04, used to find its files. Default is 0.001",
+    )
+    parser.add_argument(
+        "-r",
+        "--remove_types",
+        default=REMOVE_TYPES,
+        nargs="*",
+        type=str,
+        help="node types (metanodes) to remove from the network. Defaults to `REMOVE_TYPES`, pass no types ('-r') to keep every node type",
+    )
+    parser.add_argument(
+        "-k",
+        "--checks",
+        default="fast",
+        choices=CHECK_LEVELS,
+        help="validation level. 'off' skips all checks, 'fast' writes diagnostic counts to ../data/metrics, 'full' also runs the expensive multi-pass assertions",
+    )
 
     return parser.parse_args(args)
 
@@ -40,101 +82,72 @@ def main(args):
     logger.info(f"Running 05_Keep_Six_relevant_metanodes.py")
     logger.info(f"... Importing nodes and edges")
     edges = pl.read_parquet(
-        f"../data/edges_{args.semmed_version}_consolidated_condensed_filtered_001.parquet"
+        f"../data/edges_{args.semmed_version}_consolidated_condensed_filtered_{cutoff_suffix(args.cutoff)}.parquet"
     )
     nodes = pl.read_parquet(
-        f"../data/nodes_{args.semmed_version}_consolidated_condensed_filtered_001.parquet"
+        f"../data/nodes_{args.semmed_version}_consolidated_condensed_filtered_{cutoff_suffix(args.cutoff)}.parquet"
     )
-    logger.info(f"... checking all nodes are of only one type")
-    # assertion to check if all nodes have one type only!
-    assert (
-        pl.concat(
-            [
-                edges[["h_id", "htype"]].rename({"h_id": "id", "htype": "type"}),
-                edges[["t_id", "ttype"]].rename({"t_id": "id", "ttype": "type"}),
-            ]
-        )
-        .group_by("id")
-        .agg("type")
-        .with_columns(
-            pl.col("type").list.unique(),
-            pl.col("type").list.unique().list.len().alias("type_count"),
-        )
-        .filter(pl.col("type_count") > 1)
-        .shape[0]
-        == 0
-    ), "Some nodes have multiple types"
-
-    logger.info(f"... checking all node types are the same between edges")
-    # Check if node types are the same between edges and nodes
-    assert (
-        dict(
-            zip(
-                (
-                    e := (
-                        pl.concat(
-                            [
-                                edges[["h_id", "htype"]].rename(
-                                    {"h_id": "id", "htype": "type"}
-                                ),
-                                edges[["t_id", "ttype"]].rename(
-                                    {"t_id": "id", "ttype": "type"}
-                                ),
-                            ]
-                        )
-                        .group_by("id")
-                        .agg("type")
-                        .with_columns(pl.col("type").list.unique().list.first())
-                        .unique()
-                    )
-                )["id"].to_list(),
-                e["type"].to_list(),
+    if checks_enabled(args.checks, "full"):
+        logger.info(f"... checking all nodes are of only one type")
+        # assertion to check if all nodes have one type only!
+        assert multi_type_node_count(edges) == 0, "Some nodes have multiple types"
+
+        logger.info(f"... checking all node types are the same between edges")
+        # Check if node types are the same between edges and nodes
+        # (every edge (id, type) pair is also a node (id, abv_label) pair)
+        assert (
+            pl.concat(
+                [
+                    edges.lazy().select(
+                        pl.col("h_id").alias("id"), pl.col("htype").alias("type")
+                    ),
+                    edges.lazy().select(
+                        pl.col("t_id").alias("id"), pl.col("ttype").alias("type")
+                    ),
+                ]
             )
-        ).items()
-        <= dict(
-            zip(
-                (n := nodes[["id", "abv_label"]].unique())["id"].to_list(),
-                n["abv_label"].to_list(),
+            .unique()
+            .join(
+                nodes.lazy().select(["id", pl.col("abv_label").alias("type")]),
+                on=["id", "type"],
+                how="anti",
             )
-        ).items()
-    ), "Check all edge node labels are in node labels"
+            .select(pl.len())
+            .collect()
+            .item()
+            == 0
+        ), "Check all edge node labels are in node labels"
 
     #### Removing un-needed metanodes
     logger.info("... removing less-useful metanodes")
     # Remove nodes of types that are less-useful
-    logger.info(f"... Nodes prior to removal of less-useful types: {nodes.shape[0]:,}")
-    remove_types = [
-        "Organizations",
-        "Activities & Behaviors",
-        "Concepts & Ideas",
-        "Procedures",
-        "Devices",
-        "Living Beings",
-    ]
-    nodes = nodes.filter(~pl.col("label").is_in(remove_types))
-    logger.info(f"... Nodes after removal of less-useful types: {nodes.shape[0]:,}")
+    metrics = {"n_nodes_before": nodes.shape[0], "n_edges_before": edges.shape[0]}
+    nodes = nodes.filter(~pl.col("label").is_in(args.remove_types))
 
     # Filter edges after removing less-useful types
-
-    logger.info(
-        f"... Edges prior to removal of abstract Node types: {edges.shape[0]:,}"
-    )
     edges = edges.filter(
         pl.col("h_id").is_in(nodes["id"]), pl.col("t_id").is_in(nodes["id"])
     )
-    logger.info(f"... Edges after removal of abstract Node types: {edges.shape[0]:,}\n")
-
-    logger.info(f"Number of unique Node Types: {nodes['label'].n_unique()}")
-    logger.info(
-        f"Node Type                      Count:\n---------------------------------------\
-    \n{nodes['label'].value_counts().sort('count', descending=True)}"
-    )
 
-    logger.info(f"Number of unique Edges Types: {edges['sem'].n_unique()}")
-    logger.info(
-        f"Edge Type                 Count:\n-----------------------------------\
-    \n{edges['sem'].value_counts().sort('count', descending=True)}"
-    )
+    if checks_enabled(args.checks, "fast"):
+        metrics.update(
+            collect_metrics(
+                nodes,
+                {"n_nodes_after": pl.len(), "n_node_types": pl.col("label").n_unique()},
+            )
+        )
+        metrics.update(
+            collect_metrics(
+                edges,
+                {"n_edges_after": pl.len(), "n_edge_types": pl.col("sem").n_unique()},
+            )
+        )
+        metrics["node_type_counts"] = dict(
+            nodes["label"].value_counts().sort("count", descending=True).iter_rows()
+        )
+        metrics["edge_type_counts"] = dict(
+            edges["sem"].value_counts().sort("count", descending=True).iter_rows()
+        )
 
     logger.info(
         f"... Writing output file to ../data/nodes_{args.semmed_version}_cons_6_metanode.parquet and ../data/edges_{args.semmed_version}_cons_6_metanode.parquet\n"
@@ -142,6 +155,10 @@ def main(args):
     nodes.write_parquet(f"../data/nodes_{args.semmed_version}_cons_6_metanodes.parquet")
     edges.write_parquet(f"../data/edges_{args.semmed_version}_cons_6_metanodes.parquet")
 
+    if checks_enabled(args.checks, "fast"):
+        metrics_file = write_stage_metrics("05_keep_six_relevant_metanodes", metrics)
+        logger.info(f"... Stage metrics written to {metrics_file}")
+
     logger.info(f"Complete processing 05_Keep_Six_relevant_metanodes.py\n")
 
 
@@ -4,10 +4,20 @@ import os
 import pickle
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple
 
 import polars as pl
 from tqdm import tqdm
 
+sys.path.append("../tools")
+from time_store import (
+    ROW_INDEX,
+    YEAR_CAT_BREAKS,
+    indication_year_categories,
+    write_time_store,
+)
+
 warnings.filterwarnings("ignore")
 # from hetnet_ml import graph_tools as gt
 import argparse
@@ -26,6 +36,21 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 
 
+# columns that identify an edge in the time-resolved network
+EDGE_COLS = [
+    "h_id",
+    "t_id",
+    "r",
+    "n_pmids",
+    "htype",
+    "ttype",
+    "rtype",
+    "rdir",
+    "abbrev",
+    "sem",
+]
+
+
 def parse_args(args=None):
     parser = argparse.ArgumentParser(
         description=r"""Split dataset by time. 
@@ -48,33 +73,53 @@ def parse_args(args=None):
         type=str,
         help="directory to build the time-based dataset",
     )
+    parser.add_argument(
+        "-s",
+        "--start_year",
+        default=1950,
+        type=int,
+        help="first year to build a network snapshot for. Default is 1950",
+    )
+    parser.add_argument(
+        "-e",
+        "--end_year",
+        default=2023,
+        type=int,
+        help="last year to build a network snapshot for. Default is 2023",
+    )
+    parser.add_argument(
+        "-j",
+        "--n_jobs",
+        default=8,
+        type=int,
+        help="number of threads used to write the yearly snapshots. Default is 8",
+    )
+    parser.add_argument(
+        "-c",
+        "--year_cat_breaks",
+        default=YEAR_CAT_BREAKS,
+        nargs="+",
+        type=int,
+        help="edges of the 'year_cat' buckets of approval year minus network year, in ascending order. Default is '-20 -15 -10 -5 0 5 10 15 20'",
+    )
+    parser.add_argument(
+        "-p",
+        "--keep_pub_years",
+        default=False,
+        action="store_true",
+        help="keep the publication year of every pmid of an edge as 'pub_years'. By default only the earliest, 'first_pub', is kept",
+    )
+    parser.add_argument(
+        "-t",
+        "--time_store",
+        default=False,
+        action="store_true",
+        help="write a single time-indexed store (edges sorted by 'first_pub', nodes with 'first_seen_year') to base_dir instead of a full network copy for every year. Read it with tools/time_store.snapshot(year)",
+    )
 
     return parser.parse_args(args)
 
 
-def get_year_category(diff):
-    if diff > 20:
-        return "20+ After"
-    elif diff >= 15 and diff < 20:
-        return "15-20 After"
-    elif diff >= 10 and diff < 15:
-        return "10-15 After"
-    elif diff >= 5 and diff < 10:
-        return "5-10 After"
-    elif diff >= 0 and diff < 5:
-        return "0-5 After"
-    elif diff >= -5 and diff < 0:
-        return "0-5 Before"
-    elif diff >= -10 and diff < -5:
-        return "5-10 Before"
-    elif diff >= -15 and diff < -10:
-        return "10-15 Before"
-    elif diff >= -20 and diff < -15:
-        return "15-20 Before"
-    elif diff < -20:
-        return "20+ Before"
-
-
 def remove_colons(df: pl.DataFrame) -> pl.DataFrame:
     """
     given a polars dataframe, reassign column names without colons and turn to lower case
@@ -89,122 +134,240 @@ def main(args):
     logger.info("")
     logger.info("Running 06_Resolve_Network_Edges_by_Time")
 
-    #### Build a final ID to year Map
-    logger.info("... Load PMID to year from NLM, PMC, EUR, and EBI")
-    nlm = pickle.load(open("../data/pmid_to_year_NLM.pkl", "rb"))
-    pmc = pickle.load(open("../data/pmid_to_year_PMC.pkl", "rb"))
-    eur = pickle.load(open("../data/pmid_to_year_Eur.pkl", "rb"))
-    ebi = pickle.load(open("../data/pmid_to_year_EBI.pkl", "rb"))
-
-    logger.info("... Reformatting all loaded PMID from str:str to str:ID")
-    # NLM
-    for k, v in tqdm(nlm.items()):
-        nlm[k] = int(v)
-    # EUR
-    rem_index = list()
-    for k, v in tqdm(eur.items()):
-        try:
-            eur[k] = int(v)
-        except:
-            rem_index.append(k)
-
-    for k in rem_index:
-        del eur[k]
-    # EBI
-    for k, v in tqdm(ebi.items()):
-        ebi[k] = int(v.split("-")[0])
-    # PMC
-    # order of importance right to left. (pmc values will replace all others)
-    id_to_year = {**eur, **nlm, **ebi, **pmc}
-    id_to_year = {str(k): str(v) for k, v in id_to_year.items()}
-
     logger.info(f"... Getting nodes file")
-
     nodes = pl.read_parquet(
         source=f"../data/nodes_{args.semmed_version}_cons_6_metanodes.parquet"
     )
-    logger.info(f"... Getting edges file")
-    edges = pl.read_parquet(
-        source="../data/edges_VER43_R_cons_6_metanodes.parquet",
-    )
 
     logger.info(f"... Getting indications file")
     indications = pl.read_parquet(
         source="../data/indications_nodemerge.parquet"
     ).drop_nulls("approval_year")
 
+    #### Build a final ID to year Map
+    logger.info("... Load PMID to year from NLM, PMC, EUR, and EBI")
+    pmid_years = read_pmid_years()
+
     logger.info(f"... adding publication dates to edges")
-    # add years to edges
-    # turn pmids into a list so we can work with it
-    # explode pmids
-    edges = (
-        edges.explode("pmids")  # uncollapse list in dataframe
-        .with_columns(  # turn uncollapsed list from Int to Str, replace via dictionary, and reconvert back to Int
-            pl.col("pmids")
-            .cast(pl.Utf8)
-            .replace(id_to_year)
-            .cast(pl.Int64)
-            .alias("pub_years")
+    edges = add_publication_years(
+        edges=pl.scan_parquet(
+            f"../data/edges_{args.semmed_version}_cons_6_metanodes.parquet"
+        ),
+        pmid_years=pmid_years,
+        keep_pub_years=args.keep_pub_years,
+    ).collect()
+
+    logger.info(f"... computing the first year each node and indication appears")
+    edges, nodes, indications = first_appearance(
+        edges=edges, nodes=nodes, indications=indications
+    )
+
+    years = range(args.start_year, args.end_year + 1)
+    if args.time_store:
+        logger.info(f"... writing time-indexed store to {args.base_dir}")
+        write_time_store(
+            edges=edges,
+            nodes=nodes,
+            indications=indications,
+            years=years,
+            store_dir=args.base_dir,
+            breaks=args.year_cat_breaks,
+        )
+        logger.info("Done running 06_Resolve_Network_Edges_by_Time.py\n")
+        return
+
+    logger.info(f"... computing indication year categories for every year")
+    indications = indication_year_categories(
+        indications=indications, years=years, breaks=args.year_cat_breaks
+    )
+
+    logger.info(f"... writing yearly snapshots with {args.n_jobs} threads")
+    with ThreadPoolExecutor(max_workers=args.n_jobs) as pool:
+        futures = [
+            pool.submit(
+                write_snapshot,
+                edges=edges,
+                nodes=nodes,
+                indications=indications,
+                year=year,
+                out_dir=os.path.join(args.base_dir, str(year)),
+            )
+            for year in years
+        ]
+        for f in (pbar := tqdm(as_completed(futures), total=len(futures))):
+            year, n_nodes, n_edges, n_inds = f.result()
+            pbar.set_description(
+                f"Processed {year} - ({n_nodes:,} Nodes, {n_edges:,} Edges, {n_inds:,} Indications)"
+            )
+
+    logger.info("Done running 06_Resolve_Network_Edges_by_Time.py\n")
+
+
+def read_pmid_years(data_dir: str = "../data") -> pl.LazyFrame:
+    """
+    Returns a lazy table of integer 'pmid' to publication 'year' from the NLM, PMC, EUR, and EBI maps made in 0_prepare.
+    When sources disagree, PMC takes precedence over EBI, then NLM, then EUR. Years that are not numeric are dropped.
+    """
+    # order of importance right to left. (pmc values will replace all others)
+    sources = ["Eur", "NLM", "EBI", "PMC"]
+
+    pmid_years = list()
+    for source in sources:
+        with open(os.path.join(data_dir, f"pmid_to_year_{source}.pkl"), "rb") as f:
+            id_to_year = pickle.load(f)
+
+        pmid_years.append(
+            pl.LazyFrame(
+                {
+                    "pmid": [str(k) for k in id_to_year.keys()],
+                    "year": [str(v) for v in id_to_year.values()],
+                }
+            ).with_columns(
+                pl.col("pmid").cast(pl.Int64, strict=False),
+                # EBI dates are 'YYYY-MM-DD'
+                pl.col("year").str.split("-").list.first().cast(pl.Int64, strict=False),
+            )
+        )
+        del id_to_year
+
+    return (
+        pl.concat(pmid_years)
+        .drop_nulls()
+        .unique(subset="pmid", keep="last", maintain_order=True)
+    )
+
+
+def add_publication_years(
+    edges: pl.LazyFrame, pmid_years: pl.LazyFrame, keep_pub_years: bool = False
+) -> pl.LazyFrame:
+    """
+    Adds the earliest publication year of each edge's pmids as 'first_pub', null if none of its pmids have a year.
+    The year table is first semi-joined to the pmids cited by the edges, then the year of each edge is a `group_by(edge_id).min()`.
+    If `keep_pub_years`, also adds the publication year of every pmid as 'pub_years', in the same order as 'pmids'.
+    """
+    edges = edges.with_row_index("edge_id")
+
+    edge_pmids = edges.select("edge_id", pl.col("pmids").alias("pmid")).explode("pmid")
+    cited_years = pmid_years.join(edge_pmids, on="pmid", how="semi")
+
+    first_pub = (
+        edge_pmids.join(cited_years, on="pmid", how="inner")
+        .group_by("edge_id")
+        .agg(pl.col("year").min().alias("first_pub"))
+    )
+
+    out_cols = EDGE_COLS + ["pmids", "first_pub"]
+    if keep_pub_years:
+        pub_years = (
+            edge_pmids.join(cited_years, on="pmid", how="left")
+            .group_by("edge_id", maintain_order=True)
+            .agg(pl.col("year").alias("pub_years"))
         )
-        .group_by(
+        edges = edges.join(pub_years, on="edge_id", how="left")
+        out_cols = EDGE_COLS + ["pmids", "pub_years", "first_pub"]
+
+    return edges.join(first_pub, on="edge_id", how="left").select(out_cols)
+
+
+def first_appearance(
+    edges: pl.DataFrame, nodes: pl.DataFrame, indications: pl.DataFrame
+) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    Sort edges by their first publication year once, and add the year each node and indication first appears in the network.
+    A node appears with its earliest edge ('first_seen_year') and an indication appears once both its compound and disease exist ('first_seen_year').
+    Every snapshot is then a prefix of the sorted edges, nodes and indications, so no year has to re-scan the full edge table.
+    Edges without a publication year never enter the network and are dropped.
+    Ties are kept in input order, and nodes and indications keep their input row as 'source_row', so snapshots can be
+    written in the same row order as the input tables.
+    """
+    edges = (
+        edges.with_row_index(ROW_INDEX)
+        .drop_nulls("first_pub")
+        .sort(["first_pub", ROW_INDEX])
+        .drop(ROW_INDEX)
+    )
+
+    # earliest edge of each node
+    node_first_seen = (
+        pl.concat(
             [
-                "h_id",
-                "t_id",
-                "r",
-                "n_pmids",
-                "htype",
-                "ttype",
-                "rtype",
-                "rdir",
-                "abbrev",
-                "sem",
+                edges.select(pl.col("h_id").alias("id"), "first_pub"),
+                edges.select(pl.col("t_id").alias("id"), "first_pub"),
             ]
-        )  # regroup the dataframe
-        .agg(["pmids", "pub_years"])
+        )
+        .group_by("id")
+        .agg(pl.col("first_pub").min().alias("first_seen_year"))
+    )
+    nodes = (
+        nodes.with_row_index(ROW_INDEX)
+        .join(node_first_seen, on="id", how="inner")
+        .sort(["first_seen_year", ROW_INDEX])
+    )
+
+    # an indication appears when the later of its compound and disease appears
+    indications = (
+        indications.with_row_index(ROW_INDEX)
+        .join(
+            node_first_seen.rename({"id": "compound_semmed_id"}),
+            on="compound_semmed_id",
+            how="inner",
+        )
+        .join(
+            node_first_seen.rename(
+                {"id": "disease_semmed_id", "first_seen_year": "disease_first_seen"}
+            ),
+            on="disease_semmed_id",
+            how="inner",
+        )
         .with_columns(
-            pl.col("pub_years").list.min().alias("first_pub")
-        )  # get min of pub_years
-    )
-
-    for year in (pbar := tqdm(range(1950, 2024, 1))):
-        # Define the save directory
-        out_dir = os.path.join(args.base_dir, str(year))
-
-        # Make sure the save directory exists, if not, make it
-        try:
-            os.stat(out_dir)
-        except:
-            os.makedirs(out_dir)
-
-        # Filter the edges by year
-        e_filt = edges.filter(pl.col("first_pub") <= year)
-
-        # Keep only nodes that have edges joining them
-        node_ids = set(e_filt["h_id"]).union(set(e_filt["t_id"]))
-        n_filt = nodes.filter(pl.col("id").is_in(list(node_ids)))
-
-        # Keep only indications that have both the compound and disease still existing in the network
-        ind_filt = (
-            indications.filter(
-                pl.col("compound_semmed_id").is_in(list(node_ids)),
-                pl.col("disease_semmed_id").is_in(list(node_ids)),
-            )  # Determine the difference between the current year and approval
-            .with_columns((pl.col("approval_year").cast(int) - year).alias("year_diff"))
-            .with_columns(
-                (pl.col("year_diff")).map_elements(get_year_category).alias("year_cat")
+            pl.max_horizontal("first_seen_year", "disease_first_seen").alias(
+                "first_seen_year"
             )
         )
-        pbar.set_description(
-            f"Processing {year} - ({len(n_filt):,} Nodes, {len(e_filt):,} Edges, {len(ind_filt):,} Indications)"
-        )
-        pbar.refresh()
+        .drop("disease_first_seen")
+        .sort(["first_seen_year", ROW_INDEX])
+    )
 
-        # Save the network, indications, and summary figure
-        n_filt.write_parquet(file=os.path.join(out_dir, "nodes.parquet"))
-        e_filt.write_parquet(file=os.path.join(out_dir, "edges.parquet"))
-        ind_filt.write_parquet(file=os.path.join(out_dir, "indications.parquet"))
+    return edges, nodes, indications
 
-    logger.info("Done running 06_Resolve_Network_Edges_by_Time.py\n")
+
+def write_snapshot(
+    edges: pl.DataFrame,
+    nodes: pl.DataFrame,
+    indications: pl.DataFrame,
+    year: int,
+    out_dir: str,
+) -> Tuple[int, int, int, int]:
+    """
+    Write the nodes, edges and indications that exist on or before `year` to `out_dir`.
+    Expects the edges and nodes returned by `first_appearance`, and indications from `indication_year_categories`,
+    which are all sorted by year, so every snapshot is a slice, with nodes put back in input order.
+    Returns the year and the number of nodes, edges and indications written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Filter the edges by year
+    e_filt = edges.head(edges["first_pub"].search_sorted(year, side="right"))
+
+    # Keep only nodes that have edges joining them, in the order of the nodes file
+    n_filt = nodes.head(
+        nodes["first_seen_year"].search_sorted(year, side="right")
+    ).sort(ROW_INDEX)
+
+    # Keep only indications that have both the compound and disease still existing in the network
+    # (their year_diff and year_cat were computed for all years in `indication_year_categories`)
+    start = indications["year"].search_sorted(year, side="left")
+    end = indications["year"].search_sorted(year, side="right")
+    ind_filt = indications.slice(start, end - start).drop("year", ROW_INDEX)
+
+    # Save the network, indications, and summary figure
+    n_filt.drop("first_seen_year", ROW_INDEX).write_parquet(
+        file=os.path.join(out_dir, "nodes.parquet")
+    )
+    e_filt.write_parquet(file=os.path.join(out_dir, "edges.parquet"))
+    ind_filt.write_parquet(file=os.path.join(out_dir, "indications.parquet"))
+
+    return year, n_filt.shape[0], e_filt.shape[0], ind_filt.shape[0]
 
 
 if __name__ == "__main__":
@@ -1,12 +1,31 @@
+import datetime
+import json
 import logging
+import multiprocessing
 import os
 import pickle
 import sys
+import time
 import warnings
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
 
 import polars as pl
 from tqdm import tqdm
 
+sys.path.append("../tools")
+from binary_triples import (
+    build_vocabulary,
+    encode_triples,
+    has_vocabulary,
+    write_triples,
+    read_vocabulary,
+    vocabulary_fingerprint,
+    write_vocabulary,
+)
+from parallel import parallel_imap
+from time_store import is_time_store, read_year, snapshot_years
+
 warnings.filterwarnings("ignore")
 import argparse
 
@@ -24,6 +43,22 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 
 
+# split variants, as '<split>_<time>', and the files each split writes
+SPLIT_VARIANTS = [
+    f"{split}_{time_txt}"
+    for split in ["tt", "ttv", "hpo"]
+    for time_txt in ["time", "notime"]
+]
+SPLIT_FILES = {
+    "tt": ["train_{}.txt", "test_{}.txt"],
+    "ttv": ["train_ttv_{}.txt", "test_ttv_{}.txt", "valid_ttv_{}.txt"],
+    "hpo": ["hpo_train_{}.txt", "hpo_test_{}.txt", "hpo_valid_{}.txt"],
+}
+
+# rough in-memory size of a year's tables, and the frames derived from them, relative to their parquet size on disk
+PARQUET_EXPANSION = 10
+
+
 def parse_args(args=None):
     parser = argparse.ArgumentParser(
         description=r"""Split dataset by time. 
@@ -74,6 +109,44 @@ def parse_args(args=None):
         type=str,
         help="Year to split the hyperparameter optimization dataset. Default is 1987. Only used if split_hyperparameter_optimization is True.",
     )
+    parser.add_argument(
+        "-Y",
+        "--years",
+        default=None,
+        nargs="+",
+        type=str,
+        help="only split the given years, i.e. '-Y 1987 1988'. Default splits every year in base_dir",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--variants",
+        default=None,
+        nargs="+",
+        choices=SPLIT_VARIANTS,
+        help="split variants to write in one pass, any of 'tt', 'ttv', 'hpo' with '_time' or '_notime', i.e. '-v tt_notime ttv_time hpo_time'. 'hpo' variants are only written for hpo_year. Overrides --split_train_test_valid, --split_hyperparameter_optimization and --include_time",
+    )
+    parser.add_argument(
+        "-r",
+        "--rebuild_vocabulary",
+        default=False,
+        action="store_true",
+        help="rebuild the global vocabulary from the final year even if base_dir has one. It is always built on runs without --years, and when base_dir has none",
+    )
+    parser.add_argument(
+        "-j",
+        "--n_jobs",
+        default=4,
+        type=int,
+        help="number of years to split concurrently, each in its own process. Default is 4",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory_gb",
+        default=None,
+        type=float,
+        help="memory budget in GB. Lowers n_jobs so the estimated memory of the concurrent years fits. Default is no budget",
+    )
 
     return parser.parse_args(args)
 
@@ -85,103 +158,234 @@ def main(args):
         f"--split_hyperparameter_optimization: {args.split_hyperparameter_optimization}"
     )
     logger.info(f"--include_time: {args.include_time}")
-    logger.info(f"changing directory to {args.base_dir}")
-    os.chdir(args.base_dir)
-
+    variants = get_variants(args)
+    logger.info(f"split variants: {variants}")
     logger.info(
         f"... splitting edges dataset up into train/test/validation, where train/test are triples in the 'present/past' and validation is 'future' of a given time point"
     )
 
+    # read snapshots from the time-indexed store if 06 wrote one, otherwise from the per-year directories
+    if is_time_store(args.base_dir):
+        logger.info(f"... reading yearly snapshots from the time-indexed store")
+        year_dirs = [str(year) for year in snapshot_years(args.base_dir)]
+    else:
+        year_dirs = [
+            f
+            for f in os.listdir(args.base_dir)
+            if (f.startswith("19") or f.startswith("20"))
+        ]
+
+    # one vocabulary, from the final year's network, maps the binary triples of every year. Runs limited with
+    # --years, i.e. the single year splits of TimeResolvedKG, reuse it, as other processes may be reading it
+    if (
+        args.years is None
+        or args.rebuild_vocabulary
+        or not has_vocabulary(args.base_dir)
+    ):
+        final_year = max(year_dirs)
+        logger.info(f"... building the global vocabulary from {final_year}")
+        entities, relations = YearSplit(
+            os.path.join(args.base_dir, final_year)
+        ).vocabulary
+        write_vocabulary(args.base_dir, entities=entities, relations=relations)
+    else:
+        logger.info(f"... reusing the global vocabulary in {args.base_dir}")
+        entities, relations = read_vocabulary(args.base_dir)
+    logger.info(
+        f"... {entities.shape[0]:,} entities and {relations.shape[0]:,} relations"
+    )
+
+    if args.years is not None:
+        year_dirs = [f for f in year_dirs if f in args.years]
+
+    n_jobs = get_n_workers(
+        base_dir=args.base_dir,
+        year_dirs=year_dirs,
+        n_jobs=args.n_jobs,
+        memory_gb=args.memory_gb,
+    )
+    logger.info(f"... creating train/test/valid splits with {n_jobs} worker(s)")
+
     # Train/Test/Validation Split, where Train and Test are Present and Past, and Validation is Future
-    for file in (
-        pbar := tqdm(
-            [f for f in os.listdir() if (f.startswith("19") or f.startswith("20"))]
+    results = list(
+        parallel_imap(
+            [
+                {
+                    "file_dir": os.path.join(args.base_dir, file),
+                    "vocab_dir": args.base_dir,
+                    "variants": [
+                        v
+                        for v in variants
+                        if not v.startswith("hpo_") or file == args.hpo_year
+                    ],
+                }
+                for file in year_dirs
+            ],
+            split_year,
+            n_jobs=n_jobs,
+            use_kwargs=True,
         )
-    ):
+    )
 
-        pbar.set_description(f"... creating train/test/valid split - {file}")
+    manifest_file = write_manifest(
+        base_dir=args.base_dir, results=results, n_jobs=n_jobs
+    )
+    logger.info(f"... split manifest written to {manifest_file}")
+    logger.info("Done running 07_Build_data_split.py\n")
 
-        if args.include_time:
-            time_txt = "time"
-        else:
-            time_txt = "notime"
 
-        if args.split_train_test_valid:
+def get_variants(args) -> List[str]:
+    """
+    Returns the split variants to write: `--variants` if given, otherwise the single variant
+    selected by --split_train_test_valid and --include_time, plus 'hpo' with --split_hyperparameter_optimization.
+    """
+    if args.variants is not None:
+        return list(dict.fromkeys(args.variants))
 
-            train, test, valid = make_train_test_valid_set(file, time=args.include_time)
-            train.write_csv(
-                file=os.path.join(file, f"train_ttv_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
-            )
-            test.write_csv(
-                file=os.path.join(file, f"test_ttv_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
-            )
-            valid.write_csv(
-                file=os.path.join(file, f"valid_ttv_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
-            )
-        else:  # create train/test if train/test/valid is false
+    time_txt = "time" if args.include_time else "notime"
+    variants = [f"{'ttv' if args.split_train_test_valid else 'tt'}_{time_txt}"]
+    if args.split_hyperparameter_optimization:
+        variants.append(f"hpo_{time_txt}")
 
-            train, test = make_train_test_set(file, time=args.include_time)
-            train.write_csv(
-                file=os.path.join(file, f"train_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
-            )
-            test.write_csv(
-                file=os.path.join(file, f"test_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
-            )
+    return variants
 
-        if args.split_hyperparameter_optimization and file == args.hpo_year:
 
-            train, test, valid = make_hpo_split(file, time=args.include_time)
-            train.write_csv(
-                file=os.path.join(file, f"hpo_train_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
-            )
-            test.write_csv(
-                file=os.path.join(file, f"hpo_test_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
+def get_n_workers(
+    base_dir: str,
+    year_dirs: List[str],
+    n_jobs: int,
+    memory_gb: Optional[float] = None,
+) -> int:
+    """
+    Returns the number of years to split concurrently: `n_jobs`, reduced so that the estimated
+    memory of that many years stays within `memory_gb`. A year's memory is estimated from the
+    on-disk size of its parquet files (or the whole store) times PARQUET_EXPANSION.
+    """
+    n_jobs = max(1, min(n_jobs, len(year_dirs)))
+    if memory_gb is None:
+        return n_jobs
+
+    if is_time_store(base_dir):
+        year_bytes = sum(
+            os.path.getsize(os.path.join(base_dir, f))
+            for f in ["nodes.parquet", "edges.parquet", "indications.parquet"]
+        )
+    else:
+        year_bytes = max(
+            sum(
+                os.path.getsize(os.path.join(base_dir, year, f))
+                for f in ["nodes.parquet", "edges.parquet", "indications.parquet"]
             )
-            valid.write_csv(
-                file=os.path.join(file, f"hpo_valid_{time_txt}.txt"),
-                separator="\t",
-                include_header=False,
+            for year in year_dirs
+        )
+
+    fits = int(memory_gb * 2**30 // max(1, year_bytes * PARQUET_EXPANSION))
+    return max(1, min(n_jobs, fits))
+
+
+def write_split(df: pl.DataFrame, file: str) -> int:
+    """
+    Atomically writes a split to `file` as a headerless tsv, so readers never see a partially written file.
+    Returns the number of rows written.
+    """
+    tmp_file = f"{file}.tmp"
+    df.write_csv(file=tmp_file, separator="\t", include_header=False)
+    os.replace(tmp_file, file)
+
+    return df.shape[0]
+
+
+def split_year(
+    file_dir: str, variants: List[str], vocab_dir: Optional[str] = None
+) -> Dict[str, object]:
+    """
+    Writes the given split variants of one year to `file_dir` in one pass over the year's data, as tsv and as
+    int32 triples ('.npy') mapped with the vocabulary ('entities.arrow', 'relations.arrow') in `vocab_dir`.
+    Returns the year, the number of rows written to each file, and the seconds it took.
+
+    :file_dir:      directory of the year, i.e. "<base_dir>/1987"
+    :variants:      split variants from SPLIT_VARIANTS, i.e. ["tt_notime", "ttv_time"]
+    :vocab_dir:     directory of the global vocabulary, i.e. "<base_dir>". Defaults to the parent of `file_dir`
+    """
+    start = time.perf_counter()
+    os.makedirs(
+        file_dir, exist_ok=True
+    )  # snapshots in a time store have no directory yet
+    rows = dict()
+
+    # every variant is served from one read of the year's tables, and the time and
+    # notime files of a split are column projections of the same frames
+    split = YearSplit(file_dir)
+    get_split = {
+        "tt": split.train_test,
+        "ttv": split.train_test_valid,
+        "hpo": split.hpo,
+    }
+    # binary triples, mapped with the global vocabulary, are written next to each tsv
+    if vocab_dir is None:
+        vocab_dir = os.path.dirname(os.path.abspath(file_dir))
+    entities, relations = read_vocabulary(vocab_dir)
+    fingerprint = vocabulary_fingerprint(entities, relations)
+    for variant in variants:
+        split_name, time_txt = variant.split("_")
+        splits = get_split[split_name](time=time_txt == "time")
+        for df, name in zip(splits, SPLIT_FILES[split_name]):
+            name = name.format(time_txt)
+            rows[name] = write_split(df, os.path.join(file_dir, name))
+            write_triples(
+                os.path.join(file_dir, name.replace(".txt", ".npy")),
+                encode_triples(df, entities=entities, relations=relations),
+                fingerprint=fingerprint,
             )
 
-    logger.info("Done running 07_Build_data_split.py\n")
+    return {
+        "year": os.path.basename(os.path.normpath(file_dir)),
+        "rows": rows,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def write_manifest(base_dir: str, results: List[Dict[str, object]], n_jobs: int) -> str:
+    """
+    Atomically writes the per-year row counts and timings of a split run to `<base_dir>/split_manifest.json`.
+    Returns the path of the manifest.
+    """
+    manifest_file = os.path.join(base_dir, "split_manifest.json")
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(
+            {
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "n_jobs": n_jobs,
+                "years": {
+                    r["year"]: {"rows": r["rows"], "seconds": r["seconds"]}
+                    for r in sorted(results, key=lambda r: r["year"])
+                },
+            },
+            f,
+            indent=2,
+        )
+    os.replace(tmp_file, manifest_file)
+
+    return manifest_file
 
 
 def read_dataframes(file_dir: str) -> pl.DataFrame:
-    # check if files exist
-    for file in [
-        (nodes_loc := os.path.join(file_dir, "nodes.parquet")),
-        (edges_loc := os.path.join(file_dir, "edges.parquet")),
-        (indic_loc := os.path.join(file_dir, "indications.parquet")),
-    ]:
-        assert os.path.exists(file) == True, f"{file} not in given file directory"
-
-    # read files
-    nodes = pl.read_parquet(source=nodes_loc)
-    edges = pl.read_parquet(source=edges_loc)
-    indications = pl.read_parquet(
-        source=indic_loc,
-        columns=[
-            "compound_semmed_id",
-            "disease_semmed_id",
-            "approval_date",
-            "approval_year",
-            "year_diff",
-            "year_cat",
-        ],
+    # read the year's per-year files, or its snapshot from a time-indexed store
+    nodes, edges, indications = read_year(file_dir)
+    nodes, edges, indications = pl.collect_all(
+        [
+            nodes,
+            edges,
+            indications.select(
+                "compound_semmed_id",
+                "disease_semmed_id",
+                "approval_date",
+                "approval_year",
+                "year_diff",
+                "year_cat",
+            ),
+        ]
     )
 
     return nodes, edges, indications
@@ -227,45 +431,188 @@ def create_acronym_dict(edges: pl.DataFrame) -> dict:
     return rel_dict
 
 
-def get_indication_types(file_dir: str) -> pl.DataFrame:
+class YearSplit(object):
     """
-    Inidication file does not have relations with metatype information, and not all are Drugs->Diseases.
-    This function adds a column to the indication dataframe with typed relations
+    Per-year split context. Loads the nodes, edges and indications of one year once, and serves every split
+    of that year (train/test, train/test/valid and hyperparameter optimization, with or without time) from them.
+    Derived frames, i.e. the abbreviation dictionary, the typed indication relations and each split, are computed on
+    first use and cached. Splits are computed with a 'year' column and projected for the 'notime' variants.
+
+    Parameters
+    ----------
+    :param: file_dir (str):     directory of the year, i.e. "<base_dir>/1987"
+
+    Example
+    ------------
+    split = YearSplit("../data/time_networks-6_metanode/1987")
+    train, test = split.train_test(time=False)
+    train, test, valid = split.hpo(time=True)
     """
-    # imports files
-    nodes, edges, indications = read_dataframes(file_dir)
-
-    # get node types added to edge file
-    edges = get_node_types(nodes=nodes, edges=edges)
-
-    # build a dictionary from the nodes file if it doesn't exist, otherwise import mappings
-    dir_loc = os.path.join(file_dir, "./abbv_dict.pkl")
-    if os.path.exists(dir_loc) == False:
-        abbv_dict = create_acronym_dict(edges)
-        with open(dir_loc, "wb") as f:
-            pickle.dump(abbv_dict, f)
-    else:
-        with open(dir_loc, "rb") as f:
-            abbv_dict = pickle.load(f)
 
-    abbv_dict["INDICATION"] = "i"
+    def __init__(self, file_dir: str):
+        self.file_dir = file_dir
+        self.nodes, self.edges, self.indications = read_dataframes(file_dir)
+
+    @cached_property
+    def abbv_dict(self) -> dict:
+        """
+        Dictionary of node type and relation abbreviations. Read from the year's 'abbv_dict.pkl' if it exists,
+        otherwise built from the edges and saved there.
+        """
+        dir_loc = os.path.join(self.file_dir, "./abbv_dict.pkl")
+        if os.path.exists(dir_loc) == False:
+            edges = get_node_types(nodes=self.nodes, edges=self.edges)
+            abbv_dict = create_acronym_dict(edges)
+            # snapshots in a time store have no year directory yet
+            os.makedirs(self.file_dir, exist_ok=True)
+            with open(dir_loc, "wb") as f:
+                pickle.dump(abbv_dict, f)
+        else:
+            with open(dir_loc, "rb") as f:
+                abbv_dict = pickle.load(f)
 
-    # create relation, 'r'
-    indications = indications.rename(
-        {"compound_semmed_id": "h_id", "disease_semmed_id": "t_id"}
-    )
-    indications = get_node_types(nodes=nodes, edges=indications)
-
-    indications = indications.with_columns(
-        r=pl.struct(["htype", "ttype"]).map_elements(
-            lambda x: "INDICATION_"
-            + abbv_dict[x["htype"]]
-            + abbv_dict["INDICATION"]
-            + abbv_dict[x["ttype"]]
+        abbv_dict["INDICATION"] = "i"
+
+        return abbv_dict
+
+    @cached_property
+    def typed_indications(self) -> pl.DataFrame:
+        """
+        Inidication file does not have relations with metatype information, and not all are Drugs->Diseases.
+        Indications with node types and a typed relation 'r', i.e. 'INDICATION_CDiDO'.
+        """
+        indications = self.indications.rename(
+            {"compound_semmed_id": "h_id", "disease_semmed_id": "t_id"}
+        )
+        indications = get_node_types(nodes=self.nodes, edges=indications)
+
+        return indications.with_columns(
+            r=pl.concat_str(
+                [
+                    pl.lit("INDICATION_"),
+                    pl.col("htype").replace(self.abbv_dict),
+                    pl.lit(self.abbv_dict["INDICATION"]),
+                    pl.col("ttype").replace(self.abbv_dict),
+                ]
+            )
         )
-    )
 
-    return nodes, edges, indications
+    @cached_property
+    def vocabulary(self) -> Tuple[pl.DataFrame, pl.DataFrame]:
+        """
+        Entity and relation vocabulary of the year's network. Entities are the year's nodes, and relations the edge
+        and typed indication relations. Networks are cumulative, so the final year's vocabulary covers every year.
+        """
+        entities = build_vocabulary(self.nodes["id"])
+        relations = build_vocabulary(
+            pl.concat([self.edges["r"], self.typed_indications["r"]])
+        )
+
+        return entities, relations
+
+    @cached_property
+    def triples(self) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+        """
+        Edge triples, and indication triples on/before and after the year, each with a 'year' string column.
+        """
+        # remove weird edge types
+        indications = self.typed_indications.filter(
+            pl.col("r") != "INDICATION_CDiCD"
+        ).rename({"approval_year": "year"})
+
+        edges = self.edges[["h_id", "r", "t_id", "first_pub"]]
+        edges = edges.rename({"first_pub": "year"}).with_columns(
+            pl.col("year").cast(str)
+        )
+        indications_past = indications.filter(pl.col("year_diff") <= 0)[
+            ["h_id", "r", "t_id", "year"]
+        ].with_columns(pl.col("year").cast(str))
+        indications_future = indications.filter(pl.col("year_diff") > 0)[
+            ["h_id", "r", "t_id", "year"]
+        ].with_columns(pl.col("year").cast(str))
+
+        return edges, indications_past, indications_future
+
+    @cached_property
+    def _train_test(self) -> Tuple[pl.DataFrame, pl.DataFrame]:
+        edges, indications_past, indications_future = self.triples
+        train = edges.vstack(indications_past)
+
+        return train, indications_future
+
+    @cached_property
+    def _train_test_valid(self) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+        edges, indications_train_test, indications_validation = self.triples
+
+        # split indications_train_test to 80% train, 20% test
+        indications_train = indications_train_test.sample(
+            fraction=0.8, with_replacement=False, seed=12345
+        )
+        indications_test = indications_train_test.join(
+            indications_train, on=["h_id", "r", "t_id", "year"], how="anti"
+        )
+        train = edges.vstack(indications_train)
+
+        return train, indications_test, indications_validation
+
+    @cached_property
+    def _hpo(self) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+        train, _ = self._train_test
+
+        # get training indications only
+        train_ind = train.filter(
+            pl.col("r").is_in(["INDICATION_CDiDO", "INDICATION_CDiPS"])
+        )
+        # remove training indications from train
+        train_no_ind = train.join(train_ind, on=["h_id", "r", "t_id"], how="anti")
+
+        # split train_ind into train and eval
+        hpo_train = train_ind.sample(fraction=0.8, seed=12345)
+        hpo_test = train_ind.join(
+            hpo_train, on=["h_id", "r", "t_id"], how="anti"
+        ).sample(fraction=0.5, seed=67890)
+
+        # get remaining eval and assign to validation
+        hpo_valid = train_ind.join(
+            hpo_train, on=["h_id", "r", "t_id"], how="anti"
+        ).join(hpo_test, on=["h_id", "r", "t_id"], how="anti")
+
+        # put non-indications together with 80% indication split
+        hpo_train = train_no_ind.vstack(hpo_train)
+
+        return hpo_train, hpo_test, hpo_valid
+
+    @staticmethod
+    def project(
+        splits: Tuple[pl.DataFrame, ...], time: bool = True
+    ) -> Tuple[pl.DataFrame, ...]:
+        """
+        Removes the 'year' column from every split if `time` is False
+        """
+        if time == False:
+            return tuple(df[["h_id", "r", "t_id"]] for df in splits)
+
+        return splits
+
+    def train_test(self, time: bool = True) -> Tuple[pl.DataFrame, pl.DataFrame]:
+        """
+        Training set comes from edges and indications prior-to or on the year. Testing set comes from indications after the year.
+        """
+        return self.project(self._train_test, time)
+
+    def train_test_valid(
+        self, time: bool = True
+    ) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+        """
+        Training and testing sets (80/20) come from indications prior-to or on the year, and the validation set from indications after the year.
+        """
+        return self.project(self._train_test_valid, time)
+
+    def hpo(self, time: bool = True) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+        """
+        Train/test/valid split for hyperparameter optimization, from the training indications of the train/test split.
+        """
+        return self.project(self._hpo, time)
 
 
 def make_train_test_set(file_dir: str, time: bool = True) -> pl.DataFrame:
@@ -275,39 +622,7 @@ def make_train_test_set(file_dir: str, time: bool = True) -> pl.DataFrame:
     set comes from edges prior-to the file time. Testing set comes from edges after
     the file time. No 80/10/10 split.
     """
-
-    # read in nodes, edges, indications and append node types to edge
-    nodes, edges, _ = read_dataframes(file_dir)
-    edges = get_node_types(nodes=nodes, edges=edges)
-
-    # process to get indications file and remove weird edge types
-    _, _, indications = get_indication_types(file_dir)
-    indications = indications.filter(pl.col("r") != "INDICATION_CDiCD")
-
-    edges = edges[["h_id", "r", "t_id", "first_pub"]]
-    indications_train = indications.filter(pl.col("year_diff") <= 0)[
-        ["h_id", "r", "t_id", "approval_year"]
-    ]
-    indications_test = indications.filter(pl.col("year_diff") > 0)[
-        ["h_id", "r", "t_id", "approval_year"]
-    ]
-
-    # rename columns from x to year
-    edges = edges.rename({"first_pub": "year"}).with_columns(pl.col("year").cast(str))
-    indications_train = indications_train.rename(
-        {"approval_year": "year"}
-    ).with_columns(pl.col("year").cast(str))
-    indications_test = indications_test.rename({"approval_year": "year"}).with_columns(
-        pl.col("year").cast(str)
-    )
-
-    train = edges.vstack(indications_train)
-
-    if time == False:
-        train = train[["h_id", "r", "t_id"]]
-        indications_test = indications_test[["h_id", "r", "t_id"]]
-
-    return train, indications_test
+    return YearSplit(file_dir).train_test(time)
 
 
 def make_train_test_valid_set(file_dir: str, time: bool = True) -> pl.DataFrame:
@@ -318,45 +633,7 @@ def make_train_test_valid_set(file_dir: str, time: bool = True) -> pl.DataFrame:
 
     :file_dir:               - a directory to the file of nodes, edges, and indications.csv. i.e "./1950"
     """
-
-    # read in nodes, edges, indications and append node type to edge
-    nodes, edges, _ = read_dataframes(file_dir)
-    edges = get_node_types(nodes=nodes, edges=edges)
-
-    # process the indication file and remove weird edge types
-    _, _, indications = get_indication_types(file_dir)
-    indications = indications.filter(
-        pl.col("r") != "INDICATION_CDiCD"
-    )  # ~ means inverse is_in
-    indications = indications.rename({"approval_year": "year"})
-
-    edges = edges[["h_id", "r", "t_id", "first_pub"]]
-    indications_train_test = indications.filter(pl.col("year_diff") <= 0)[
-        ["h_id", "r", "t_id", "year"]
-    ].with_columns(pl.col("year").cast(str))
-    indications_validation = indications.filter(pl.col("year_diff") > 0)[
-        ["h_id", "r", "t_id", "year"]
-    ].with_columns(pl.col("year").cast(str))
-
-    # rename columns from 'x' to year
-    edges = edges.rename({"first_pub": "year"}).with_columns(pl.col("year").cast(str))
-
-    # split indications_train_test to 80% train, 20% test
-    indications_train = indications_train_test.sample(
-        fraction=0.8, with_replacement=False, seed=12345
-    )
-    indications_test = indications_train_test.join(
-        indications_train, on=["h_id", "r", "t_id", "year"], how="anti"
-    )
-
-    train = edges.vstack(indications_train)
-
-    if time == False:
-        train = train[["h_id", "r", "t_id"]]
-        indications_test = indications_test[["h_id", "r", "t_id"]]
-        indications_validation = indications_validation[["h_id", "r", "t_id"]]
-
-    return train, indications_test, indications_validation
+    return YearSplit(file_dir).train_test_valid(time)
 
 
 # make a hyper parameter optimization dataset by splitting up the train set into a HPO test/valid.
@@ -365,32 +642,10 @@ def make_hpo_split(file_dir: str, time: bool = True) -> pl.DataFrame:
     """
     Create a train/test/valid dataset for hyperparameter optimizations.
     """
-    # import relevant files
-    train, test = make_train_test_set(file_dir, time)
-
-    # get training indications only
-    train_ind = train.filter(
-        pl.col("r").is_in(["INDICATION_CDiDO", "INDICATION_CDiPS"])
-    )
-    # remove training indications from train
-    train_no_ind = train.join(train_ind, on=["h_id", "r", "t_id"], how="anti")
-
-    # split train_ind into train and eval
-    hpo_train = train_ind.sample(fraction=0.8, seed=12345)
-    hpo_test = train_ind.join(hpo_train, on=["h_id", "r", "t_id"], how="anti").sample(
-        fraction=0.5, seed=67890
-    )
-
-    # get remaining eval and assign to validation
-    hpo_valid = train_ind.join(hpo_train, on=["h_id", "r", "t_id"], how="anti").join(
-        hpo_test, on=["h_id", "r", "t_id"], how="anti"
-    )
-
-    # put non-indications together with 80% indication split
-    hpo_train = train_no_ind.vstack(hpo_train)
-
-    return hpo_train, hpo_test, hpo_valid
+    return YearSplit(file_dir).hpo(time)
 
 
 if __name__ == "__main__":
+    # the parent reads the final year with polars before starting the pool, and polars' thread pool is not fork-safe
+    multiprocessing.set_start_method("spawn")
     main(parse_args())
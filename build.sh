@@ -40,6 +40,8 @@ Help()
     "   --split_hpo, -o         optional, split the dataset for hyperparameter optimization; defaults to unflagged"
     "   --split_ttv, -t         optional, split the dataset for training, testing, and validation; defaults to unflagged"
     "   --hpo_year, -y          optional, year to split the dataset for hyperparameter optimization; defaults to 1987"
+    "   --time_store, -s        optional, write a single time-indexed store instead of a network copy for every year; defaults to unflagged"
+    "   --checks, -k            optional, validation level {off,fast,full}; 'fast' writes stage metrics, 'full' also runs expensive assertions; defaults to 'fast'"
     ""
     "NOTE:"
     "This code base is in development and has no guarantees. Use at your own risk."
@@ -51,8 +53,8 @@ Help()
 # assign vars with short or long form flags
 #
 TEMP=$(getopt \
-    --options a:b:c::d:D:i:h::H:n::o::p:P:t::u:v:x::y: \
-    --long apikey:,base_dir:,convert_neg::,dc_date:,umls_date:,include_direction:,help::,host:,drop_neg::,split_hpo::,port:,pass:,split_ttv::,user:,semmed_ver:,include_time::,hpo_year:\
+    --options a:b:c::d:D:i:h::H:k:n::o::p:P:s::t::u:v:x::y: \
+    --long apikey:,base_dir:,convert_neg::,dc_date:,umls_date:,include_direction:,help::,host:,checks:,drop_neg::,split_hpo::,port:,pass:,split_ttv::,time_store::,user:,semmed_ver:,include_time::,hpo_year:\
     --name 'build' -- "$@"
     )
     
@@ -73,7 +75,9 @@ INCLUDE_DIRECTION=0
 HPO=0
 TTV=0
 TIME=0
+TIME_STORE=0
 HPO_YEAR=0
+CHECKS=
 eval set --"$TEMP"
 while true; do
     case "$1" in
@@ -139,10 +143,18 @@ while true; do
             TIME=1;
             echo "TIME:     $TIME";
             shift 2;;
+        -s| --time_store)
+            TIME_STORE=1;
+            echo "TIME_STORE: $TIME_STORE";
+            shift 2;;
         -y| --hpo_year)
             HPO_YEAR="$2";
             echo "HPO_YEAR: $HPO_YEAR";
             shift 2;;
+        -k| --checks)
+            CHECKS="$2";
+            echo "CHECKS:   $CHECKS";
+            shift 2;;
         -- ) shift; break ;; # allows you to  break loop once all options exhausted
         *) echo "ERROR: Invalid Option"; Help; exit 1;;
     esac
@@ -171,6 +183,7 @@ if [ -z "${DC_DATE}" ]; then DC_DATE="11012023";fi # old version "20220822"
 if [ -z "${UMLS_DATE}" ]; then UMLS_DATE="2023AA";fi
 if [ -z "${SEM_VER}" ]; then SEM_VER="VER43_R";fi
 if [ -z "${HPO_YEAR}" ]; then HPO_YEAR=1987;fi
+if [ -z "${CHECKS}" ]; then CHECKS="fast";fi
 
 #
 # Setup virtual environment. If it already exists, skip
@@ -194,7 +207,7 @@ bash download_requirements.sh --host $HOST --port $PORT --user $USER --pass $PAS
 # Pre-processing
 echo "Preparing SEMMED Heterogenous Network"
 echo "... loading conda environment (mini_semmed)"
-mamba run -n mini_semmed2 --no-capture-output python preprocessing.py --semmed_version $SEM_VER --umls_date $UMLS_DATE
+mamba run -n mini_semmed2 --no-capture-output python preprocessing.py --semmed_version $SEM_VER --umls_date $UMLS_DATE --checks $CHECKS
 # conda run -n mini_semmed python ./scripts/01_initial_data_clean.py --semmed_version $SEM_VER
 # conda run -n mini_semmed python ./scripts/02_id_to_publication_year.py --semmed_version $SEM_VER
 # conda run -n mini_semmed python ./scripts/03_umls_cui_to_mesh_descriptorID.py --semmed_version $SEM_VER  --umls_date $UMLS_DATE
@@ -252,13 +265,19 @@ else
     TTV=""
 fi
 
+# check flags for writing a single time-indexed store instead of yearly network copies
+if [[ $TIME_STORE -eq 1 ]]; then
+    TIME_STORE="--time_store"
+else
+    TIME_STORE=""
+fi
 
 #
 # run rest of the pipeline. Please check flags to make sure version drugcentral and semmed downloaded matches
 # 
 mamba run -n mini_semmed2 --no-capture-output python building.py \
 --semmed_version $SEM_VER $DROP_NEGATIVE_EDGES $CONVERT_NEG $INCLUDE_DIRECTION \
-$TIME $HPO $TTV --base_dir $BASE_DIR --dc_date $DC_DATE --hpo_year $HPO_YEAR --umls_date $UMLS_DATE
+$TIME $HPO $TTV $TIME_STORE --base_dir $BASE_DIR --dc_date $DC_DATE --hpo_year $HPO_YEAR --umls_date $UMLS_DATE --checks $CHECKS
 # conda run -n mini_semmed python ./scripts/01_build_hetnet_polars.py --semmed_version $SEM_VER $DROP_NEGATIVE_EDGES $CONVERT_NEG $INCLUDE_DIRECTION
 # conda run -n mini_semmed python ./scripts/02_Merge_Nodes_via_ID_xrefs_polars.py --dc_date $DC_DATE --semmed_version $SEM_VER
 # conda run -n mini_semmed python ./scripts/03_Condense_edge_semmantics_polars.py --semmed_version $SEM_VER
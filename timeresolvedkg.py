@@ -1,6 +1,10 @@
 import logging
+import os
 import pathlib
 import subprocess
+import sys
+import threading
+from collections import OrderedDict
 from typing import (
     Any,
     ClassVar,
@@ -18,12 +22,16 @@ from typing import (
 
 import click
 import git
+import numpy as np
+import polars as pl
+import torch
 from docdata import (  # functions written by cthoyt to convert docstring to a dictionary
     get_docdata,
     parse_docdata,
 )
 from more_click import verbose_option
 from pykeen.datasets import PathDataset
+from pykeen.triples import TriplesFactory
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -34,6 +42,68 @@ logger.addHandler(console)
 
 __all__ = ["TimeResolvedKG"]
 
+# memory cap of the process-level dataset cache, in bytes of mapped triples. Set to 0 to disable the cache
+DATASET_CACHE_MAX_BYTES = int(
+    os.environ.get("TRKG_DATASET_CACHE_MAX_BYTES", 4 * 1024**3)
+)
+
+
+class DatasetCache(object):
+    """
+    Process-level LRU cache of the loaded triples factories of a TimeResolvedKG split, keyed by
+    (cache_root, base_dir, year, split_ttv, include_time). Factories are shared by every dataset of the same split
+    in the process, and must be treated as read-only. The least recently used splits are evicted once the cached
+    mapped triples exceed `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = DATASET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the mapped triples held by the cache."""
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    @staticmethod
+    def factory_nbytes(*factories: Optional[TriplesFactory]) -> int:
+        """Bytes of the mapped triples of `factories`."""
+        return sum(
+            f.mapped_triples.element_size() * f.mapped_triples.nelement()
+            for f in factories
+            if f is not None
+        )
+
+    def get(self, key: Tuple) -> Optional[Tuple[TriplesFactory, ...]]:
+        """The cached factories of `key`, marked as most recently used, or None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: Tuple, factories: Tuple[Optional[TriplesFactory], ...]) -> None:
+        """Cache the factories of `key`, evicting the least recently used splits to stay within `max_bytes`."""
+        nbytes = self.factory_nbytes(*factories)
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._entries[key] = (factories, nbytes)
+            self._entries.move_to_end(key)
+            while self.nbytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.info(f"Evicted {evicted} from the dataset cache.")
+
+    def clear(self) -> None:
+        """Remove every cached split."""
+        with self._lock:
+            self._entries.clear()
+
+
+DATASET_CACHE = DatasetCache()
+
 
 @parse_docdata
 class TimeResolvedKG(PathDataset):
@@ -59,6 +129,11 @@ class TimeResolvedKG(PathDataset):
     - drop_negative_edges   whether to drop negative edges from the dataset, {0,1}
     - convert_neg           whether to turn negative edges into neutral edges {0,1}
     - include_direction     whether to include directional edges in the dataset, {0,1}
+    - time_store            whether to build a single time-indexed store instead of a network copy for every year, {0,1}. Splits for a year are then created from the store the first time that year is loaded
+
+    Triples are loaded from a binary cache next to the split tsvs: int32 mapped triples ('.npy') and an entity and relation vocabulary ('entities.arrow', 'relations.arrow'), so the tsvs are not parsed and no label to id maps are rebuilt. The split stage writes the cache with a global vocabulary (built from the final year's network) next to the year directories, so an id in the cache means the same entity or relation in every year. If a split has no cache, it is written from the tsvs on first load. Each '.npy' has a '.vocab' file with the fingerprint of the vocabulary it was mapped with, and is re-mapped from the tsv if that is not the vocabulary it would be read with. Each year's triples factories only know the entities and relations of that year's training triples, with ids in label order as when they were built from the tsvs, so models of a year are neither trained on nor ranked against entities that only appear in later years. Test and validation triples with other entities or relations are dropped.
+
+    Loaded splits are kept in a process-level LRU cache (`DATASET_CACHE`), so repeated instantiations of the same split share one set of triples factories, which must not be modified. The cache is capped at `TRKG_DATASET_CACHE_MAX_BYTES` bytes of mapped triples (default 4 GiB).
     """
 
     def __init__(
@@ -126,6 +201,176 @@ class TimeResolvedKG(PathDataset):
         """The paths where the extracted files can be found."""
         return self.cache_root.joinpath(relative_file_path)
 
+    def _store_path(self) -> pathlib.Path:
+        """The path of the time-indexed store written with the `time_store` option."""
+        return self.cache_root.joinpath(self._relative_path.parent)
+
+    @property
+    def _binary_triples(self):
+        """
+        `tools/binary_triples.py` of the dataset repository in `cache_root`, the module the split stage writes and reads
+        the binary triples with, so the cache is always written and checked the same way.
+        """
+        tools_dir = str(self.cache_root.joinpath("tools"))
+        if tools_dir not in sys.path:
+            sys.path.append(tools_dir)
+        import binary_triples
+
+        return binary_triples
+
+    def _vocabulary_dir(self) -> Optional[pathlib.Path]:
+        """
+        The directory of the vocabulary the binary triples are mapped with: the global vocabulary written by the split
+        stage next to the year directories, otherwise the year's own vocabulary written by `_write_cache`.
+        """
+        for path in [self._store_path(), self._get_paths(self._relative_path)]:
+            if self._binary_triples.has_vocabulary(str(path)):
+                return path
+        return None
+
+    def _labels(self, vocab_dir: pathlib.Path) -> Tuple[np.ndarray, np.ndarray]:
+        """The entity and relation labels of the vocabulary in `vocab_dir`, indexed by id."""
+        return tuple(
+            vocab.sort("id")["label"].to_numpy()
+            for vocab in self._binary_triples.read_vocabulary(str(vocab_dir))
+        )
+
+    def _is_cached(self, vocab_dir: Optional[pathlib.Path]) -> bool:
+        """
+        Whether every split has binary triples mapped with the vocabulary in `vocab_dir`, as recorded in the '.vocab' file
+        next to them. Triples mapped with another vocabulary, i.e. a year's own before the global one was written, are not.
+        """
+        if vocab_dir is None:
+            return False
+        bt = self._binary_triples
+        fingerprint = bt.vocabulary_fingerprint(*bt.read_vocabulary(str(vocab_dir)))
+        return all(
+            path.with_suffix(".npy").is_file()
+            and bt.triples_fingerprint(str(path.with_suffix(".npy"))) == fingerprint
+            for path in self._check_paths
+        )
+
+    def _write_cache(self) -> None:
+        """
+        Write the binary cache of the split: int32 (h, r, t[, year]) triples ('.npy') next to each tsv, mapped with the
+        global vocabulary, and the fingerprint of that vocabulary ('.vocab'). Without a global vocabulary, the year's
+        vocabulary is built from the labels of its splits and written to the year directory first.
+        """
+        bt = self._binary_triples
+        splits = {
+            path: pl.read_csv(
+                path,
+                separator="\t",
+                has_header=False,
+                quote_char=None,
+                infer_schema_length=0,
+            )
+            for path in self._check_paths
+        }
+        splits = {
+            path: df.rename(dict(zip(df.columns, ["h_id", "r", "t_id", "year"])))
+            for path, df in splits.items()
+        }
+
+        vocab_dir = self._vocabulary_dir()
+        if vocab_dir is None:
+            vocab_dir = self._get_paths(self._relative_path)
+            bt.write_vocabulary(
+                str(vocab_dir),
+                entities=bt.build_vocabulary(
+                    pl.concat(
+                        [df[c] for df in splits.values() for c in ["h_id", "t_id"]]
+                    )
+                ),
+                relations=bt.build_vocabulary(
+                    pl.concat([df["r"] for df in splits.values()])
+                ),
+            )
+
+        entities, relations = bt.read_vocabulary(str(vocab_dir))
+        fingerprint = bt.vocabulary_fingerprint(entities, relations)
+        for path, df in splits.items():
+            bt.write_triples(
+                str(path.with_suffix(".npy")),
+                bt.encode_triples(df, entities=entities, relations=relations),
+                fingerprint=fingerprint,
+            )
+
+    def _mapped_triples(self, path: pathlib.Path) -> np.ndarray:
+        """The int32 (h, r, t) triples of the split tsv at `path`, memory-mapped from its binary cache."""
+        return self._binary_triples.load_triples(str(path.with_suffix(".npy")))[:, :3]
+
+    @staticmethod
+    def _id_lookup(ids: np.ndarray, size: int) -> np.ndarray:
+        """Lookup of every vocabulary id to its position in the sorted `ids`, or -1 if it is not one of them."""
+        lookup = np.full(size, -1, dtype=np.int64)
+        lookup[ids] = np.arange(ids.shape[0])
+        return lookup
+
+    def _factory(
+        self,
+        path: pathlib.Path,
+        entity_lookup: np.ndarray,
+        relation_lookup: np.ndarray,
+    ) -> TriplesFactory:
+        """
+        Build a triples factory of the split tsv at `path` with the year's training ids, without parsing the tsv.
+        Triples with entities or relations not seen in training are dropped. This is not zero-copy: pykeen needs int64
+        ids, so the memory-mapped int32 triples are read once into a new int64 array of the year's ids, and copied again
+        only if triples are dropped.
+        """
+        triples = self._mapped_triples(path)
+        mapped = np.empty((triples.shape[0], 3), dtype=np.int64)
+        for col, lookup in enumerate([entity_lookup, relation_lookup, entity_lookup]):
+            np.take(lookup, triples[:, col], out=mapped[:, col])
+        known = (mapped >= 0).all(axis=1)
+        if not known.all():
+            mapped = mapped[known]
+
+        return TriplesFactory(
+            mapped_triples=torch.from_numpy(mapped),
+            entity_to_id=self._entity_to_id,
+            relation_to_id=self._relation_to_id,
+            create_inverse_triples=self._create_inverse_triples,
+            metadata={"path": path},
+        )
+
+    def _split_from_store(self) -> None:
+        """
+        Create the train/test(/valid) split of `self.year` from the snapshot of that year in the time-indexed store,
+        instead of rebuilding the whole dataset.
+        """
+        split_flags = {
+            "split_ttv": "--split_train_test_valid",
+            "include_time": "--include_time",
+            "split_hpo": "--split_hyperparameter_optimization",
+        }
+        to_call = [
+            "python",
+            "./scripts/07_Build_data_split.py",
+            "--base_dir",
+            self.base_dir,
+            "--years",
+            self.year,
+            "--hpo_year",
+            str(self.dataset_kwargs.get("hpo_year", "1987")),
+        ]
+        to_call += [
+            flag for k, flag in split_flags.items() if self.dataset_kwargs.get(k, 0)
+        ]
+
+        logger.info(f"Splitting with {to_call}.")
+        result = subprocess.run(
+            to_call,
+            cwd=self.cache_root.joinpath("1_build"),
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Splitting {self.year} from the time-indexed store failed with exit code {result.returncode}:\n{result.stderr}"
+            )
+
     def _extract(self, git_file: pathlib.Path) -> None:
         """Extract from the downloaded file."""
 
@@ -162,11 +407,32 @@ class TimeResolvedKG(PathDataset):
                 f"Repository already exists at {self.cache_root}. Skipping download."
             )
 
+    def _cache_key(self) -> Tuple[str, str, str, str, str]:
+        """Key of this split in the process-level dataset cache."""
+        return (
+            str(self.cache_root),
+            self.base_dir,
+            self.year,
+            self.train_test_valid,
+            self.include_time,
+        )
+
     # docstr-coverage: inherited
     def _load(self) -> None:  # noqa: D102
+        cached = DATASET_CACHE.get(self._cache_key())
+        if cached is not None:
+            logger.info(f"Using the cached {self.year} split.")
+            self._training, self._testing, self._validation = cached
+            return
+
         all_unpacked = all(path.is_file() for path in self._check_paths)
         logger.info(f"Checking if all files are unpacked: {all_unpacked}.")
 
+        if not all_unpacked and self._store_path().joinpath("store.json").is_file():
+            logger.info(f"Creating the {self.year} split from the time-indexed store.")
+            self._split_from_store()
+            all_unpacked = all(path.is_file() for path in self._check_paths)
+
         if not all_unpacked:
             logger.info(f"Download and extract the dataset from {self.url}.")
             git_file = self._get_git()
@@ -175,7 +441,44 @@ class TimeResolvedKG(PathDataset):
 
         logger.info(f"Loading dataset from {self._relative_path}.")
 
-        super()._load()
+        if not self._is_cached(self._vocabulary_dir()):
+            logger.info("Writing the binary triples cache next to the tsvs.")
+            self._write_cache()
+
+        # the year only knows the entities and relations of its training triples, with ids in label order as when
+        # the factories were built from the tsvs, so models of a year are not given entities of later years
+        entity_labels, relation_labels = self._labels(self._vocabulary_dir())
+        training = self._mapped_triples(self.training_path)
+        entity_ids = np.unique(training[:, [0, 2]])
+        relation_ids = np.unique(training[:, 1])
+        self._entity_to_id = dict(
+            zip(entity_labels[entity_ids].tolist(), range(entity_ids.shape[0]))
+        )
+        self._relation_to_id = dict(
+            zip(relation_labels[relation_ids].tolist(), range(relation_ids.shape[0]))
+        )
+        lookups = dict(
+            entity_lookup=self._id_lookup(entity_ids, entity_labels.shape[0]),
+            relation_lookup=self._id_lookup(relation_ids, relation_labels.shape[0]),
+        )
+
+        self._training = self._factory(self.training_path, **lookups)
+        self._testing = self._factory(self.testing_path, **lookups)
+        self._validation = (
+            None
+            if self.validation_path is None
+            else self._factory(self.validation_path, **lookups)
+        )
+
+        DATASET_CACHE.put(
+            self._cache_key(), (self._training, self._testing, self._validation)
+        )
+
+    # docstr-coverage: inherited
+    def _load_validation(self) -> None:  # noqa: D102
+        # validation is loaded, or taken from the dataset cache, together with training and testing
+        if not self._loaded:
+            self._load()
 
 
 @click.command()
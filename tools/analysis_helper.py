@@ -1,10 +1,12 @@
 import math
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 from typing import (
     Any,
     ClassVar,
     Dict,
     Iterable,
+    Iterator,
     List,
     Mapping,
     Optional,
@@ -26,6 +28,7 @@ import pykeen.models
 import seaborn as sns
 import torch
 from pykeen.predict import predict_all, predict_target
+from time_store import YEAR_CAT_BREAKS, is_time_store, read_year, year_category
 
 ### Helper functions for analysing pykeen outputs
 
@@ -33,10 +36,14 @@ from pykeen.predict import predict_all, predict_target
 #
 # load_pykeen_triples() ->      Imports PyKEEN triples factory based on build parameter and year subset.
 # predict_on() ->               Extracts predictions for 'test' or 'valid' sets given a pykeen model
-# get_answers() ->              Calculates a n-hot encoded list for the answers of a given query (head/tail)
+# score_batches() ->            Scores batches of queries against all entities, one model call per batch
+# rank_answers() ->             Returns the filtered rank of every answer from the scores
+# get_answers() ->              Returns the answer entity ids of each query (head/tail)
 # get_rank() ->                 Returns the filtered rank
+# get_flat_ranks() ->           Returns all filtered ranks as a flat array with query offsets
 # get_mrr() ->                  Returns the MRR score
 # get_hits_at_k() ->            Returns the number of hits at k
+# metrics() ->                  Returns MR, MRR and hits at k overall, per relation and per year bucket
 # extract_answers_from_rank() -> Extracts answers from rank dataframe
 # extract_relative_year() ->    Extracts relative year from indications
 #
@@ -44,6 +51,70 @@ from pykeen.predict import predict_all, predict_target
 # load_pykeen_dataset() ->      Imports PyKEEN dataset TRKG based on build parameter and year subset.
 # get_rank_from_position() ->   Gets positions of all hits and returns as an array. Accounts for ties, rank starts at 1.
 # get_true_index() ->           Gets the index of all hits and returns as as an array.
+#
+# bootstrap functions
+# bootstrap_means() ->          Returns bootstrap resampled means of measures, resampling queries
+# bootstrap_ci() ->             Returns the mean and percentile bootstrap confidence interval of measures
+
+
+# columns identifying a query, the unit resampled by the bootstrap
+QUERY_COLS = ["checkpoint", "group", "query_label", "query"]
+
+
+def bootstrap_means(
+    sums: np.ndarray,
+    counts: np.ndarray,
+    n_boot: int = 1000,
+    seed: Optional[Union[int, np.random.SeedSequence]] = None,
+    chunk_size: int = 2**22,
+) -> np.ndarray:
+    """
+    Bootstraps the mean of a measure over answers by resampling queries with replacement.
+    Resamples are drawn as (resamples, queries) index matrices of at most `chunk_size` elements at a time, so memory
+    stays bounded for any `n_boot`. Returns an (n_boot, n_measures) array of resampled means.
+
+    :sums:          (n_queries, n_measures) sums of each measure over the answers of each query
+    :counts:        (n_queries,) number of answers of each query
+    :n_boot:        number of resamples
+    :seed:          seed of the random generator
+    :chunk_size:    maximum number of elements of an index matrix
+
+    Example
+    ------------
+    bootstrap_means(np.array([[1.0], [0.5], [0.0]]), np.array([1, 2, 1]), n_boot=1000).shape -> (1000, 1)
+    """
+    rng = np.random.default_rng(seed)
+    n_queries = counts.shape[0]
+    rows = max(1, chunk_size // n_queries)
+
+    means = np.empty((n_boot, sums.shape[1]), dtype=np.float64)
+    for start in range(0, n_boot, rows):
+        idx = rng.integers(0, n_queries, size=(min(rows, n_boot - start), n_queries))
+        means[start : start + idx.shape[0]] = (
+            sums[idx].sum(axis=1) / counts[idx].sum(axis=1)[:, None]
+        )
+
+    return means
+
+
+def bootstrap_ci(
+    sums: np.ndarray,
+    counts: np.ndarray,
+    n_boot: int = 1000,
+    ci: float = 0.95,
+    seed: Optional[Union[int, np.random.SeedSequence]] = None,
+    chunk_size: int = 2**22,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the mean of each measure over all answers and the lower and upper bounds of its percentile bootstrap
+    confidence interval at level `ci`. See `bootstrap_means` for the parameters.
+    """
+    means = bootstrap_means(
+        sums, counts, n_boot=n_boot, seed=seed, chunk_size=chunk_size
+    )
+    lower, upper = np.quantile(means, [(1 - ci) / 2, (1 + ci) / 2], axis=0)
+
+    return sums.sum(axis=0) / counts.sum(), lower, upper
 
 
 class AnalysisHelper(object):
@@ -58,6 +129,8 @@ class AnalysisHelper(object):
     :group: (str)                   evaluate on 'test' or 'valid'?
     :qa: (str)                      short for query_answer; predict on 'head', 'tail', or 'both'?
     :cuda: (bool)                   use gpu or cpu?
+    :batch_size: (int)              number of queries scored per model call
+    :top_k: (int)                   number of highest scoring entity labels to keep for each query, for display
     """
 
     def __init__(
@@ -70,6 +143,8 @@ class AnalysisHelper(object):
         group: Optional[str] = "test",  # {'test','valid'},
         qa: Optional[str] = "both",  # {'both','head','tail'}
         cuda: Optional[bool] = False,
+        batch_size: Optional[int] = 256,
+        top_k: Optional[int] = None,
     ):
         self.build_dataset_kwargs = build_dataset_kwargs
         self.year = year
@@ -80,6 +155,8 @@ class AnalysisHelper(object):
         self.group = group
         self.query_answer = qa
         self.pykeen_model = pykeen_model
+        self.batch_size = batch_size
+        self.top_k = top_k
         # self.model_kwargs = model_kwargs
         self.chkpt_dir = pykeen.constants.PYKEEN_CHECKPOINTS.joinpath(chkpt_file)
 
@@ -93,11 +170,10 @@ class AnalysisHelper(object):
 
         # check if group is valid
         if self.group != None:
-            assert self.query_answer in [
+            assert self.group in [
                 "test",
                 "valid",
-                "both",
-            ], "query_answer must be one of ['test','valid','both']"
+            ], "group must be one of ['test','valid']"
 
         # load train/test/valid if ttv is true otherwise just train/test
         if self.build_dataset_kwargs.get("split_ttv", 0) != 0:
@@ -129,13 +205,7 @@ class AnalysisHelper(object):
                 self.pykeen_model.load_state_dict(self.chkpt["model_state_dict"])
                 self.df = self.predict_on(pykeen_model=self.pykeen_model)
 
-            self.df = (
-                self.get_answers()
-            )  # returns a list of [1,0] where 1 denotes answer index
-            self.df = (
-                self.get_rank()
-            )  # returns a list of filtered ranks for each answer
-
+            # predict_on returns the answers and filtered ranks of each query
             self.answer_df = (
                 self.extract_answers_from_rank()
             )  # returns expanded list of only answers
@@ -143,12 +213,19 @@ class AnalysisHelper(object):
                 self.extract_relative_year()
             )  # returns year for rexpanded list of only answers
 
-            self.mr = self.get_mr()
-            self.mrr = self.get_mrr()
-            self.hits_1 = self.get_hits_at_k(k=1)
-            self.hits_3 = self.get_hits_at_k(k=3)
-            self.hits_10 = self.get_hits_at_k(k=10)
-            self.hits_100 = self.get_hits_at_k(k=100)
+            # ranks of all answers, stored once as a flat array with query offsets
+            self.ranks, self.query_offsets = self.get_flat_ranks()
+            self.metrics_df = self.metrics(ks=[1, 3, 10, 100])
+
+            overall = self.metrics_df.filter(pl.col("group") == "all").row(
+                0, named=True
+            )
+            self.mr = overall["mr"]
+            self.mrr = overall["mrr"]
+            self.hits_1 = overall["hits_at_1"]
+            self.hits_3 = overall["hits_at_3"]
+            self.hits_10 = overall["hits_at_10"]
+            self.hits_100 = overall["hits_at_100"]
 
     @staticmethod
     def load_pykeen_dataset(
@@ -198,254 +275,209 @@ class AnalysisHelper(object):
         query_answer: Optional[str] = "both",  # {both,tail,head}
     ) -> pl.DataFrame:
         """
-        Takes a PyKEEN model and testing path to generate all compound indications on test set.
+        Takes a PyKEEN model and scores all compound indications on the test set.
         group can be 'test' or 'valid' splits depending on the group to be assessed
         query_answer can be 'both', 'tail', 'head'. 'both' returns both head and tail predictions, 'tail' returns only tail predictions, 'head' returns only head predictions
+
+        Queries are scored in batches of `self.batch_size` and the filtered rank of each answer is taken from the scores
+        directly. Returns one row per query with its answers and their filtered ranks, and with `self.top_k` the labels
+        of the highest scoring entities as 'answer_label'.
         """
         query_answer = self.query_answer
         group = self.group
 
-        # setup train, test, valid if there is a validation set available
-        if self.build_dataset_kwargs.get("split_ttv", 0) != 0:
-            train, _, _ = self.load_pykeen_triples()
-        else:
+        if self.build_dataset_kwargs.get("split_ttv", 0) == 0:
             assert (
                 group == "test"
             ), "No validation set found, in `self.build_dataset_kwargs` please use test group"
-            train, _ = self.load_pykeen_triples()
 
-        # import test or valid triples depending on 'group'
-        predict_path = (
-            self.dataset.testing_path
-            if group == "test"
-            else self.dataset.validation_path
+        entity_labels = np.array(
+            [self.train.entity_id_to_label[i] for i in range(self.train.num_entities)]
+        )
+        relation_labels = np.array(
+            [label for _, label in sorted(self.train.relation_id_to_label.items())]
         )
 
-        # DataFrame for predictions
-        predict_df = pd.read_csv(predict_path, sep="\t", names=["h", "r", "t"])
-
-        # build a dictionary for each condition
-        query_answer_dict = {
-            "head": dict(zip(predict_df["t"], predict_df["r"])),
-            "tail": dict(zip(predict_df["h"], predict_df["r"])),
-        }
-
-        if query_answer == "head" or query_answer == "both":
-            h_res_ls = list()
-            for disease, relation in query_answer_dict["head"].items():
-                pred = pykeen.predict.predict_target(
-                    model=pykeen_model,
-                    tail=disease,
-                    relation=relation,
-                    triples_factory=train,
-                )
-                # .add_membership_columns(
-                #     testing=test,
-                #     validation=(
-                #         valid
-                #         if self.build_dataset_kwargs.get("split_ttv", 0) != 0
-                #         else None
-                #     ),
-                # )  # check if tail predictions are in 'predict_triple' (correct answer)
-                pred = pl.DataFrame(pred.df)
-                pred = pred.with_columns(t=pl.lit(disease))
-                h_res_ls.append(pred)
-            df_h = pl.concat(h_res_ls)
-
-        if query_answer == "tail" or query_answer == "both":
-            t_res_ls = list()
-            for compound, relation in query_answer_dict["tail"].items():
-                pred = pykeen.predict.predict_target(
-                    model=pykeen_model,
-                    head=compound,
-                    relation=relation,
-                    triples_factory=train,
-                )
-                # .add_membership_columns(
-                #     testing=test,
-                #     validation=(
-                #         valid
-                #         if self.build_dataset_kwargs.get("split_ttv", 0) != 0
-                #         else None
-                #     ),
-                # )  # check if tail predictions are in 'predict_triple' (correct answer)
-                pred = pl.DataFrame(pred.df)
-                pred = pred.with_columns(h=pl.lit(compound))
-                t_res_ls.append(pred)
-            df_t = pl.concat(t_res_ls)
-
-        if query_answer == "head":
-            df_h = (
-                df_h.with_columns(query=pl.lit("head"))
-                .rename({"t": "query_label", "head_label": "answer_label"})
-                .drop("head_id")
-                .group_by(["query_label", "query"], maintain_order=True)
-                .agg(
-                    [
-                        "answer_label",
-                    ]
-                )
-            )
-
-            return df_h
-
-        elif query_answer == "tail":
-            df_t = (
-                df_t.with_columns(query=pl.lit("tail"))
-                .rename({"h": "query_label", "tail_label": "answer_label"})
-                .drop("tail_id")
-                .group_by(["query_label", "query"], maintain_order=True)
-                .agg(
-                    [
-                        "answer_label",
-                    ]
-                )
+        sides = ["head", "tail"] if query_answer == "both" else [query_answer]
+        res_ls = list()
+        for side in sides:
+            queries = self.get_answers(query=side)
+            query_ids = queries["query_id"].to_numpy()
+
+            query_index, answer_ids, answer_ranks, top_ids = self.rank_answers(
+                pykeen_model=pykeen_model,
+                queries=queries.select(
+                    ["r", "query_id"] if side == "head" else ["query_id", "r"]
+                ).to_numpy(),
+                answers=queries["answers"],
+                target=side,
+                batch_size=self.batch_size,
+                top_k=self.top_k,
             )
 
-            return df_t
-
-        else:
-            df_h = (
-                df_h.with_columns(query=pl.lit("head"))
-                .rename({"t": "query_label", "head_label": "answer_label"})
-                .drop("head_id")
-            )
-            df_t = (
-                df_t.with_columns(query=pl.lit("tail"))
-                .rename({"h": "query_label", "tail_label": "answer_label"})
-                .drop("tail_id")
-            )
             df = (
-                pl.concat([df_h, df_t])
-                .group_by(["query_label", "query"], maintain_order=True)
-                .agg(
-                    [
-                        "answer_label",
-                    ]
+                pl.DataFrame(
+                    {
+                        "query_label": entity_labels[query_ids[query_index]],
+                        "relation": relation_labels[
+                            queries["r"].to_numpy()[query_index]
+                        ],
+                        "answers": entity_labels[answer_ids],
+                        "answer_filt_rank": answer_ranks,
+                    }
                 )
+                .with_columns(query=pl.lit(side))
+                .group_by(["query_label", "query", "relation"], maintain_order=True)
+                .agg(["answers", "answer_filt_rank"])
             )
+            # every query has answers, so rows are in the same order as `queries`
+            if top_ids is not None:
+                df = df.with_columns(
+                    pl.Series("answer_label", entity_labels[top_ids].tolist())
+                )
+            res_ls.append(df)
 
-            return df
+        return pl.concat(res_ls)
 
-    def get_answers(self) -> pl.DataFrame:
+    @staticmethod
+    def score_batches(
+        pykeen_model: pykeen.models.base.Model,
+        queries: np.ndarray,
+        target: str,
+        batch_size: int = 256,
+    ) -> Iterator[Tuple[int, torch.FloatTensor]]:
         """
-        calculate a n-hot encoded list for the answers of a given query
+        Scores batches of queries against every entity, with one model call per batch.
+        Yields the index of the first query of each batch and its (batch, num_entities) score matrix.
+
+        :pykeen_model:  pykeen model to score with
+        :queries:       (n, 2) array of (r, t) ids for 'head' targets or (h, r) ids for 'tail' targets
+        :target:        'head' or 'tail'
+        :batch_size:    number of queries scored per model call
         """
-        df = self.df
-        # expand dataframe and separate by query for head or query for tail
-        df = df.explode(["answer_label"])
+        pykeen_model.eval()
+        queries = torch.as_tensor(queries, dtype=torch.long)
+
+        with torch.inference_mode():
+            for start in range(0, queries.shape[0], batch_size):
+                batch = queries[start : start + batch_size].to(pykeen_model.device)
+                if target == "head":
+                    scores = pykeen_model.predict_h(batch)
+                else:
+                    scores = pykeen_model.predict_t(batch)
+                yield start, scores.cpu()
+
+    @classmethod
+    def rank_answers(
+        cls,
+        pykeen_model: pykeen.models.base.Model,
+        queries: np.ndarray,
+        answers: pl.Series,
+        target: str,
+        batch_size: int = 256,
+        top_k: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Returns the filtered rank of every answer of every query, as flat arrays of query index, answer id and rank,
+        ordered by query and rank. The filtered rank of an answer is 1 + the number of entities scoring higher than it,
+        not counting the other answers of the same query. Only the scores of the answers are kept between batches, so
+        memory grows with the number of answers instead of queries x entities.
+        With `top_k`, also returns the ids of the `top_k` highest scoring entities of each query, for display.
 
-        # get answers dataframe depending on self.
-        if self.build_dataset_kwargs.get("split_ttv", 0) != 0:
-            # swap test and valid if models_swap is True
-            if self.train_models_swap:
-                test_answers = pl.read_csv(
-                    self.valid_dir, separator="\t", new_columns=["h", "r", "t"]
-                )
-                valid_answers = pl.read_csv(
-                    self.test_dir, separator="\t", new_columns=["h", "r", "t"]
-                )
-            else:
-                test_answers = pl.read_csv(
-                    self.test_dir, separator="\t", new_columns=["h", "r", "t"]
-                )
-                valid_answers = pl.read_csv(
-                    self.valid_dir, separator="\t", new_columns=["h", "r", "t"]
-                )
-        else:
-            test_answers = pl.read_csv(
-                self.test_dir, separator="\t", new_columns=["h", "r", "t"]
-            )
+        :queries:       (n, 2) array of query ids, see `score_batches`
+        :answers:       list column of the answer entity ids of each query
+        :top_k:         number of highest scoring entities to keep for each query
 
-        # get answers for head and tail by merging with test_answers/valid_answers
-        if self.query_answer == "head" or self.query_answer == "both":
-            df_h = df.filter(pl.col("query") == "head")
-            df_h = (
-                df_h.join(
-                    test_answers,
-                    left_on=["query_label", "answer_label"],
-                    right_on=["t", "h"],
-                    how="left",
-                )
-                .with_columns(
-                    pl.when(pl.col("r").is_null())
-                    .then(0)
-                    .otherwise(1)
-                    .alias("in_testing")
-                )
-                .drop("r")
+        Example
+        ------------
+        scores = [0.9, 0.1, 0.8, 0.5, 0.7], answers = [2, 4] -> answer 2 has rank 2, answer 4 has rank 2 (2 is filtered)
+        """
+        n_answers = answers.list.len().to_numpy().astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(n_answers)])
+        answer_ids = answers.explode().to_numpy()
+        query_index = np.repeat(np.arange(queries.shape[0]), n_answers)
+        within_query = np.arange(answer_ids.shape[0]) - offsets[query_index]
+
+        answer_scores = np.empty(answer_ids.shape[0], dtype=np.float64)
+        n_higher = np.empty(answer_ids.shape[0], dtype=np.int64)
+        top_ids = list()
+        for start, scores in cls.score_batches(
+            pykeen_model, queries, target=target, batch_size=batch_size
+        ):
+            stop = start + scores.shape[0]
+            lo, hi = offsets[start], offsets[stop]
+            rows = torch.as_tensor(query_index[lo:hi] - start)
+            cols = torch.as_tensor(within_query[lo:hi])
+            batch_scores = scores[rows, torch.as_tensor(answer_ids[lo:hi])]
+
+            # count the entities scoring higher than each answer with a binary search over the sorted scores
+            padded = torch.full(
+                (scores.shape[0], int(n_answers[start:stop].max())),
+                float("inf"),
+                dtype=scores.dtype,
             )
-            if self.valid_dir != None:
-                # add validation column
-                df_h = (
-                    df_h.join(
-                        valid_answers,
-                        left_on=["query_label", "answer_label"],
-                        right_on=["t", "h"],
-                        how="left",
-                    )
-                    .with_columns(
-                        pl.when(pl.col("r").is_null())
-                        .then(0)
-                        .otherwise(1)
-                        .alias("in_validation")
-                    )
-                    .drop("r")
-                )
+            padded[rows, cols] = batch_scores
+            n_at_most = torch.searchsorted(
+                scores.sort(dim=1).values, padded, right=True
+            )
+            n_higher[lo:hi] = (scores.shape[1] - n_at_most[rows, cols]).numpy()
+            answer_scores[lo:hi] = batch_scores.numpy()
 
-        if self.query_answer == "tail" or self.query_answer == "both":
-            df_t = df.filter(pl.col("query") == "tail")
-            df_t = (
-                df_t.join(
-                    test_answers,
-                    left_on=["query_label", "answer_label"],
-                    right_on=["h", "t"],
-                    how="left",
-                )
-                .with_columns(
-                    pl.when(pl.col("r").is_null())
-                    .then(0)
-                    .otherwise(1)
-                    .alias("in_testing")
+            if top_k is not None:
+                top_ids.append(
+                    torch.topk(scores, k=min(top_k, scores.shape[1]), dim=1)
+                    .indices.numpy()
                 )
-                .drop("r")
+
+        # answers of the same query that score higher are filtered from the count
+        ranks = (
+            pl.DataFrame(
+                {
+                    "query_index": query_index,
+                    "answer_id": answer_ids,
+                    "score": answer_scores,
+                    "n_higher": n_higher,
+                }
             )
-            if self.valid_dir != None:
-                # add validation column
-                df_t = (
-                    df_t.join(
-                        valid_answers,
-                        left_on=["query_label", "answer_label"],
-                        right_on=["h", "t"],
-                        how="left",
-                    )
-                    .with_columns(
-                        pl.when(pl.col("r").is_null())
-                        .then(0)
-                        .otherwise(1)
-                        .alias("in_validation")
-                    )
-                    .drop("r")
+            .with_columns(
+                (
+                    pl.col("n_higher")
+                    - pl.col("score").rank("min", descending=True).over("query_index")
+                    + 2
                 )
-        if self.query_answer == "head":
-            df_h = df_h.group_by(["query_label", "query"], maintain_order=True).agg(
-                ["answer_label", "in_testing", "in_validation"]
+                .cast(pl.Int64)
+                .alias("answer_filt_rank")
             )
+            .sort(["query_index", "answer_filt_rank"])
+        )
 
-            return df_h
-        elif self.query_answer == "tail":
-            df_t = df_t.group_by(["query_label", "query"], maintain_order=True).agg(
-                ["answer_label", "in_testing", "in_validation"]
-            )
+        return (
+            ranks["query_index"].to_numpy(),
+            ranks["answer_id"].to_numpy(),
+            ranks["answer_filt_rank"].to_numpy(),
+            np.concatenate(top_ids) if top_k is not None else None,
+        )
 
-            return df_t
-        else:
-            df = pl.concat([df_h, df_t])
-            df = df.group_by(["query_label", "query"], maintain_order=True).agg(
-                ["answer_label", "in_testing", "in_validation"]
-            )
+    def get_answers(self, query: str = "tail") -> pl.DataFrame:
+        """
+        Returns the answers of each query on the test or valid set as entity ids, one row per query.
+        Head queries are (?, r, t) for each disease and tail queries are (h, r, ?) for each compound. The answers of a
+        query are all compounds of the disease (or diseases of the compound), and its relation is the last one seen.
 
-            return df
+        :query:     'head' or 'tail'
+        """
+        predict_df = pl.DataFrame(
+            (self.test if self.group == "test" else self.valid).mapped_triples.numpy(),
+            schema=["h", "r", "t"],
+            orient="row",
+        )
+        query_col, answer_col = ("t", "h") if query == "head" else ("h", "t")
+
+        return (
+            predict_df.group_by(query_col, maintain_order=True)
+            .agg(pl.col("r").last(), pl.col(answer_col).alias("answers"))
+            .rename({query_col: "query_id"})
+        )
 
     @staticmethod
     def get_rank_from_position(x: List[int]) -> np.array:
@@ -478,43 +510,37 @@ class AnalysisHelper(object):
         self,
     ) -> pl.DataFrame:
         """
-        Takes a dataframe of PyKEEN model predictions and returns dataframe with list of  rank vals
+        Takes a dataframe of PyKEEN model predictions and returns dataframe with list of  rank vals.
+        Filtered ranks are computed from the scores by `predict_on`, see `rank_answers`.
         """
 
         assert (
             type(self.df) == pl.DataFrame
         ), "No dataframe found, please run self.predict_on() first"
 
-        res_col = "in_testing" if self.group == "test" else "in_validation"
-        drop_col = "in_validation" if self.group == "test" else "in_testing"
-        if res_col not in self.df.columns:
-            results_df = self.get_answers()
-            df = results_df.unique(["query_label", "query"])
-        else:
-            df = self.df
-
-        df = df.with_columns(
-            pl.col(res_col)
-            .map_elements(lambda x: self.get_rank_from_position(x))
-            .alias("answer_filt_rank")
-        ).drop(drop_col)
+        return self.df
 
-        return df
-
-    def get_mr(self)->float:
+    def get_flat_ranks(self) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Given a pykeen returned dataframe, get the MR from known ranks
+        Returns the filtered ranks of all answers as one flat float64 array, and the offsets of each query's ranks in it.
+        The ranks of query i are ranks[offsets[i]:offsets[i + 1]].
         """
-        assert(
+        assert (
             type(self.df) == pl.DataFrame
         ), "No dataframe found, please run `self.predict_on()` first"
-        results_df = self.df
-        if "answer_filt_rank" not in results_df.columns:
-            results_df = self.get_rank()
 
-        results_df = results_df.explode('answer_filt_rank')
-        mr = results_df["answer_filt_rank"].mean()
-        return mr
+        ranks = self.df["answer_filt_rank"]
+        offsets = np.concatenate(
+            [[0], np.cumsum(ranks.list.len().to_numpy().astype(np.int64))]
+        )
+
+        return ranks.explode().cast(pl.Float64).to_numpy(), offsets
+
+    def get_mr(self) -> float:
+        """
+        Given a pykeen returned dataframe, get the MR from known ranks
+        """
+        return self.ranks.mean()
 
     def get_mrr(
         self,
@@ -522,49 +548,73 @@ class AnalysisHelper(object):
         """
         Given a pykeen returned dataframe, get the MRR from known ranks
         """
-        assert (
-            type(self.df) == pl.DataFrame
-        ), "No dataframe found, please run `self.predict_on()` first"
-
-        results_df = self.df
-
-        if "answer_filt_rank" not in results_df.columns:
-            results_df = self.get_rank()
-
-        all_ranks = [
-            float(j) for i in results_df["answer_filt_rank"].to_list() for j in i
-        ]  # np.reciprocal requires floats, using ints leads to unexpected behavior
-        all_rr = np.reciprocal(all_ranks)
-        mrr = np.mean(all_rr)
-
-        return mrr
+        return np.reciprocal(self.ranks).mean()
 
     def get_hits_at_k(self, k: int = 10) -> float:
         """
         Given a pykeen returned dataframe, get the hits at k from known trues
         * default k value is 10
         """
-        assert (
-            type(self.df) == pl.DataFrame
-        ), "No dataframe found, please run self.predict_on() first"
+        return (self.ranks <= k).mean()
 
-        results_df = self.df
+    def metrics(
+        self,
+        ks: List[int] = [1, 3, 10, 100],
+        breaks: List[int] = YEAR_CAT_BREAKS,
+    ) -> pl.DataFrame:
+        """
+        Returns the number of answers, MR, MRR and hits at each k in `ks`, over all answers and broken down per relation
+        and per year bucket ('year_cat' of approval year minus network year, bucketed by `breaks`).
+        All metrics of every breakdown are computed in one grouped aggregation over the flat ranks.
+        Each row is labelled by its breakdown, 'group' ('all', 'relation' or 'year_cat'), and the breakdown's 'value'.
 
-        if "answer_filt_rank" not in results_df.columns:
-            results_df = self.get_rank()
+        Example
+        ------------
+        helper.metrics(ks=[1, 10]).filter(pl.col("group") == "all")
+        -> group | value | n | mr | mrr | hits_at_1 | hits_at_10
+        """
+        exprs = [
+            pl.len().alias("n"),
+            pl.col("rank").mean().alias("mr"),
+            pl.col("rank").pow(-1).mean().alias("mrr"),
+        ] + [(pl.col("rank") <= k).mean().alias(f"hits_at_{k}") for k in ks]
 
-        all_ranks = [
-            float(j) for i in results_df["answer_filt_rank"].to_list() for j in i
+        answers = pl.DataFrame(
+            {
+                "rank": self.ranks,
+                "relation": np.repeat(
+                    self.df["relation"].to_numpy(), np.diff(self.query_offsets)
+                ),
+            }
+        ).lazy()
+        frames = [
+            answers.select(exprs).with_columns(
+                group=pl.lit("all"), value=pl.lit("all")
+            ),
+            answers.group_by("relation")
+            .agg(exprs)
+            .rename({"relation": "value"})
+            .sort("value")
+            .with_columns(group=pl.lit("relation")),
         ]
-        k_array = np.full(np.array(all_ranks).shape, k, dtype=float)
-        hitsk = np.mean(
-            np.less_equal(
-                all_ranks,
-                k_array,
+        # year buckets need the relative year of each answer, see extract_relative_year
+        if "year_diff" in getattr(self, "answer_df", pl.DataFrame()).columns:
+            frames.append(
+                self.answer_df.lazy()
+                .select(
+                    pl.col("answer_filt_rank").cast(pl.Float64).alias("rank"),
+                    year_category("year_diff", breaks).alias("year_cat"),
+                )
+                .group_by("year_cat")
+                .agg(exprs)
+                .rename({"year_cat": "value"})
+                .sort("value")
+                .with_columns(group=pl.lit("year_cat"))
             )
-        )
 
-        return hitsk
+        return pl.concat(pl.collect_all(frames), how="diagonal").select(
+            ["group", "value", "n", "mr", "mrr"] + [f"hits_at_{k}" for k in ks]
+        )
 
     def extract_answers_from_rank(self) -> pl.DataFrame:
         """
@@ -576,22 +626,8 @@ class AnalysisHelper(object):
 
         results_df = self.df
 
-        group = "in_testing" if self.group == "test" else "in_validation"
-
-        results_df = results_df.with_columns(
-            pl.col(group)
-            .map_elements(lambda x: self.get_true_index(x))
-            .alias("known_trues")
-        )
-
-        # get dataframe of query and answer labels
-        results_df = (
-            results_df.explode(["answer_filt_rank", "known_trues"])
-            .with_columns(
-                pl.col("answer_label").list.get(pl.col("known_trues")).alias("answers")
-            )
-            .drop(group)
-        )
+        # get dataframe of query and answer labels, one row per answer
+        results_df = results_df.explode(["answers", "answer_filt_rank"])
 
         return results_df
 
@@ -602,14 +638,17 @@ class AnalysisHelper(object):
         # get results from self.extract_answers_from_rank
         results_df = self.answer_df
 
-        # get local directory to import indications
-        ind_dir = pathlib.Path(self.dataset.training_path).parent.joinpath(
-            "indications.parquet"
-        )
-        ind = pl.read_parquet(
-            ind_dir,
-            columns=["compound_semmed_id", "disease_semmed_id", "year_diff"],
-        ).rename({"compound_semmed_id": "h", "disease_semmed_id": "t"})
+        # get local directory to import indications. Year directories of a time-indexed store only hold the
+        # splits, so the year's indications are read from the store's snapshot instead
+        year_dir = pathlib.Path(self.dataset.training_path).parent
+        ind_cols = ["compound_semmed_id", "disease_semmed_id", "year_diff"]
+        if is_time_store(str(year_dir.parent)):
+            ind = read_year(str(year_dir))[2].select(ind_cols).collect()
+        else:
+            ind = pl.read_parquet(
+                year_dir.joinpath("indications.parquet"), columns=ind_cols
+            )
+        ind = ind.rename({"compound_semmed_id": "h", "disease_semmed_id": "t"})
 
         # merge indications with results_df
         if self.query_answer == "both" or self.query_answer == "head":  # (?, r, t)
@@ -637,7 +676,7 @@ class AnalysisHelper(object):
 class AnalysisPlotter(object):
     """
     Plotting class for PyKEEN time based visualization using rolling averages
-    :answer_df:       list of dataframes or single dataframe
+    :answer_df:       list of dataframes or single dataframe. A single dataframe with an 'algo' column, i.e. from `eval_runner.run_evaluations`, is split per algorithm
     :algo_name_ls:         list of algorithm names or single algorithm name
     :window_size:     Window to calculate moving average. Each 'year' is the center of the window size, thus window_size should be an odd number
     :measure:         column name to get rolling average of
@@ -664,24 +703,43 @@ class AnalysisPlotter(object):
         self.year_max = year_max
         self.save_dir = save_dir
 
-        # check if answer_df is a list of dataframes
+        # label every answer with its algorithm, so rolling averages of all algorithms are calculated in one pass
         if type(answer_df) == list:
             assert len(answer_df) == len(
                 self.algo_ls
             ), "Length of dataframes and algo names do not match."
 
-            self.rolling_avg_df = self.add_algo_label_to_concat_df(
-                [self.get_rolling_averages(df) for df in self.answer_df],
+            # keep the query columns all dataframes share, for `get_bootstrap_ci`
+            query_cols = [
+                c for c in QUERY_COLS if all(c in df.columns for df in self.answer_df)
+            ]
+            algo_df = self.add_algo_label_to_concat_df(
+                [
+                    df.select(
+                        pl.col("year_diff").cast(pl.Int64),
+                        pl.col(self.measure).cast(pl.Float64),
+                        *query_cols,
+                    )
+                    for df in self.answer_df
+                ],
                 [algo for algo in self.algo_ls],
             )
 
-            self.rolling_avg_df = self.melt_rolling_averages(self.rolling_avg_df)
+        # results of `eval_runner.run_evaluations` already carry an 'algo' column
+        elif "algo" in answer_df.columns:
+            self.algo_ls = (
+                [algo_name_ls] if type(algo_name_ls) == str else list(algo_name_ls)
+            )
+            algo_df = pl.concat(
+                [answer_df.filter(pl.col("algo") == algo) for algo in self.algo_ls]
+            )
 
         else:
-            self.rolling_avg_df = self.get_rolling_averages(
-                self.answer_df, self.algo_ls
-            )
-            self.rolling_avg_df = self.melt_rolling_averages(self.rolling_avg_df)
+            algo_df = answer_df.with_columns(pl.lit(self.algo_ls).alias("algo"))
+
+        self.algo_df = algo_df
+        self.rolling_avg_df = self.get_rolling_averages(algo_df)
+        self.rolling_avg_df = self.melt_rolling_averages(self.rolling_avg_df)
 
         self.rolling_avg_plot = self.plot_rolling_averages()
 
@@ -704,6 +762,21 @@ class AnalysisPlotter(object):
         df = pl.concat(new_df_ls)
         return df
 
+    @staticmethod
+    def add_rank_measures(
+        df: pl.DataFrame, ks: List[int] = [1, 3, 10], rank_col: str = "answer_filt_rank"
+    ) -> pl.DataFrame:
+        """
+        Adds the reciprocal rank and hits at each k of every answer, whose means are the MRR and hits at k
+        """
+        return df.with_columns(
+            (1 / pl.col(rank_col)).alias("reciprocal_rank"),
+            *[
+                (pl.col(rank_col) <= k).cast(pl.Float64).alias(f"hits_at_{k}")
+                for k in ks
+            ],
+        )
+
     @staticmethod
     def calculate_standard_error(
         df,
@@ -719,9 +792,13 @@ class AnalysisPlotter(object):
         self,
         df: pl.DataFrame,
         df_name: Optional[str] = None,
+        measures: Optional[List[str]] = None,
     ):
         """
-        Calculate the rolling average of a column in a dataframe based on the year_diff column
+        Calculate the rolling average of columns in a dataframe based on the year_diff column.
+        The count, sum and sum of squares of each measure are aggregated once per year_diff, clipped to [year_min, year_max],
+        and then summed over a centred rolling window of the year axis. If the dataframe has an `algo` column, rolling
+        averages are calculated per algorithm in the same pass.
 
         Parameters
         ----------
@@ -730,46 +807,99 @@ class AnalysisPlotter(object):
         :year_min:        any value mapped to a smaller year than `min year` gets mapped to the `min_year`
         :year_max:        any value mapped to a larger year than `max_year` gets mapped to the `max_year`
         :df_name:         name to add to the `algo` column
+        :measures:        column names to get rolling averages of. Defaults to `measure`
         """
         window_size = self.window_size
-        col_name = self.measure
+        measures = [self.measure] if measures is None else measures
         year_min = self.year_min
         year_max = self.year_max
 
         # checks on parameters
         assert (
-            window_size % 2 == 1 & window_size > 0
+            window_size % 2 == 1 and window_size > 0
         ), f"`window_size`, {window_size}, is not a positive and odd value."
         assert (
             year_min < year_max
         ), f"`year_min`, {year_min}, should be less than `year_max`, {year_max}."
 
-        plus_minus_yr = window_size // 2
+        group_cols = ["algo"] if "algo" in df.columns else []
 
-        rolling_map = dict()
-        error_map = dict()
-        # query the dataframe and calculate the average value
-        for yr in range(year_min, year_max + 1):
-            # build year range
-            yr_range = range(yr - plus_minus_yr, yr + plus_minus_yr + 1)
+        def per_group(expr: pl.Expr) -> pl.Expr:
+            return expr.over(group_cols) if len(group_cols) > 0 else expr
 
-            if year_min in yr_range:
-                sub_df = df.filter(pl.col("year_diff") <= max(yr_range))
-            elif year_max in yr_range:
-                sub_df = df.filter(pl.col("year_diff") >= min(yr_range))
-            else:
-                sub_df = df.filter(pl.col("year_diff").is_in(yr_range))
+        # count, sum and sum of squares of each measure per clipped year
+        stats = (
+            df.lazy()
+            .filter(pl.col("year_diff").is_not_null())
+            .group_by(
+                group_cols
+                + [pl.col("year_diff").clip(year_min, year_max).cast(pl.Int64).alias("year")]
+            )
+            .agg(
+                [
+                    agg
+                    for m in measures
+                    for agg in [
+                        pl.col(m).count().cast(pl.Float64).alias(f"n_{m}"),
+                        pl.col(m).cast(pl.Float64).sum().alias(f"sum_{m}"),
+                        pl.col(m).cast(pl.Float64).pow(2).sum().alias(f"sumsq_{m}"),
+                    ]
+                ]
+            )
+        )
 
-            if sub_df[col_name].count() > 0:
-                rolling_map.update({yr: sub_df[col_name].mean()})
-                error_map.update({yr: self.calculate_standard_error(sub_df, col_name)})
+        # a row for every year of every algorithm, so the rolling window spans years instead of rows
+        years = pl.LazyFrame(
+            {"year": list(range(year_min, year_max + 1))}, schema={"year": pl.Int64}
+        )
+        if len(group_cols) > 0:
+            years = (
+                df.lazy()
+                .select(group_cols)
+                .unique(maintain_order=True)
+                .join(years, how="cross")
+            )
 
-        new_df = pl.DataFrame(
-            {
-                "year": rolling_map.keys(),
-                f"average_{col_name}": rolling_map.values(),
-                f"stderr_{col_name}": error_map.values(),
-            }
+        sums = [f"{s}_{m}" for m in measures for s in ["n", "sum", "sumsq"]]
+        new_df = (
+            years.join(stats, on=group_cols + ["year"], how="left")
+            .with_columns(
+                per_group(
+                    pl.col(col)
+                    .fill_null(0)
+                    .rolling_sum(window_size, center=True, min_periods=1)
+                )
+                for col in sums
+            )
+            .with_columns(
+                [
+                    expr
+                    for m in measures
+                    for expr in [
+                        (pl.col(f"sum_{m}") / pl.col(f"n_{m}")).alias(f"average_{m}"),
+                        # standard error of the mean from the sample variance
+                        pl.when(pl.col(f"n_{m}") > 1)
+                        .then(
+                            (
+                                (
+                                    pl.col(f"sumsq_{m}")
+                                    - pl.col(f"sum_{m}").pow(2) / pl.col(f"n_{m}")
+                                ).clip(lower_bound=0)
+                                / (pl.col(f"n_{m}") - 1)
+                                / pl.col(f"n_{m}")
+                            ).sqrt()
+                        )
+                        .alias(f"stderr_{m}"),
+                    ]
+                ]
+            )
+            .filter(pl.any_horizontal(pl.col(f"n_{m}") > 0 for m in measures))
+            .select(
+                ["year"]
+                + [f"{s}_{m}" for m in measures for s in ["average", "stderr"]]
+                + group_cols
+            )
+            .collect()
         )
 
         # adds dataframe name to the given column
@@ -778,6 +908,135 @@ class AnalysisPlotter(object):
 
         return new_df
 
+    def get_bootstrap_ci(
+        self,
+        df: Optional[pl.DataFrame] = None,
+        measures: Optional[List[str]] = None,
+        ks: List[int] = [1, 3, 10],
+        n_boot: int = 1000,
+        ci: float = 0.95,
+        query_cols: Optional[List[str]] = None,
+        chunk_size: int = 2**22,
+        n_jobs: int = 1,
+        seed: int = 0,
+    ) -> pl.DataFrame:
+        """
+        Calculate bootstrap confidence intervals of the rolling averages, by resampling the queries in each year's window.
+        Windows are the same as in `get_rolling_averages`, so the bands can be plotted alongside the rolling average
+        with `plot_bootstrap_ci`. By default the intervals are of MRR and hits at `ks`, from 'answer_filt_rank'.
+        Returns one row per algorithm, year and measure with the 'estimate' and its 'lower' and 'upper' bounds.
+
+        Parameters
+        ----------
+        :df:              answers with year_diff, the measures and the query columns. Defaults to the plotted answers
+        :measures:        column names to get confidence intervals of. Defaults to 'reciprocal_rank' and 'hits_at_k'
+        :ks:              k of the default hits at k measures
+        :n_boot:          number of resamples
+        :ci:              confidence level
+        :query_cols:      columns identifying a query. Defaults to those of QUERY_COLS in `df`
+        :chunk_size:      maximum number of elements of each resample index matrix
+        :n_jobs:          number of processes to bootstrap windows in. 1 runs in this process
+        :seed:            seed of the resamples, results do not depend on `n_jobs`
+        """
+        df = self.algo_df if df is None else df
+        if measures is None:
+            df = self.add_rank_measures(df, ks)
+            measures = ["reciprocal_rank"] + [f"hits_at_{k}" for k in ks]
+        if query_cols is None:
+            query_cols = [c for c in QUERY_COLS if c in df.columns]
+        assert len(query_cols) > 0, "No columns identifying a query found in `df`"
+
+        group_cols = ["algo"] if "algo" in df.columns else []
+        plus_minus_yr = self.window_size // 2
+
+        # sum and count of each query's answers in every window that contains their year
+        windows = pl.LazyFrame(
+            {"offset": list(range(-plus_minus_yr, plus_minus_yr + 1))},
+            schema={"offset": pl.Int64},
+        )
+        units = (
+            df.lazy()
+            .drop_nulls(["year_diff"] + measures)
+            .with_columns(
+                pl.col("year_diff").clip(self.year_min, self.year_max).cast(pl.Int64)
+            )
+            .join(windows, how="cross")
+            .with_columns((pl.col("year_diff") - pl.col("offset")).alias("center_year"))
+            .filter(pl.col("center_year").is_between(self.year_min, self.year_max))
+            .group_by(group_cols + ["center_year"] + query_cols)
+            .agg(
+                [pl.len().alias("n")]
+                + [pl.col(m).cast(pl.Float64).sum() for m in measures]
+            )
+            .sort(group_cols + ["center_year"] + query_cols)
+            .collect()
+        )
+
+        parts = units.partition_by(group_cols + ["center_year"], maintain_order=True)
+        seeds = np.random.SeedSequence(seed).spawn(len(parts))
+        tasks = [
+            (
+                part.select(measures).to_numpy(),
+                part["n"].to_numpy(),
+                n_boot,
+                ci,
+                s,
+                chunk_size,
+            )
+            for part, s in zip(parts, seeds)
+        ]
+
+        if n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                res = list(pool.map(bootstrap_ci, *zip(*tasks)))
+        else:
+            res = [bootstrap_ci(*task) for task in tasks]
+
+        return pl.DataFrame(
+            [
+                {
+                    **{c: part[c][0] for c in group_cols},
+                    "year": part["center_year"][0],
+                    "measure": m,
+                    "estimate": estimate[i],
+                    "lower": lower[i],
+                    "upper": upper[i],
+                }
+                for part, (estimate, lower, upper) in zip(parts, res)
+                for i, m in enumerate(measures)
+            ]
+        )
+
+    def plot_bootstrap_ci(
+        self,
+        ci_df: pl.DataFrame,
+        measure: Optional[str] = None,
+        ax: Optional[matplotlib.axes.Axes] = None,
+        alpha: float = 0.2,
+    ):
+        """
+        Shade the bootstrap confidence band of each algorithm from `get_bootstrap_ci`, by default on the rolling average plot
+        """
+        measure = self.measure if measure is None else measure
+        ax = self.rolling_avg_plot[1] if ax is None else ax
+        algo_ls = [self.algo_ls] if type(self.algo_ls) == str else self.algo_ls
+
+        # same colors as the algorithms' lines
+        for color, algo in zip(sns.color_palette(n_colors=len(algo_ls)), algo_ls):
+            band = ci_df.filter(
+                (pl.col("measure") == measure) & (pl.col("algo") == algo)
+            ).sort("year")
+            ax.fill_between(
+                band["year"].to_numpy(),
+                band["lower"].to_numpy(),
+                band["upper"].to_numpy(),
+                color=color,
+                alpha=alpha,
+                linewidth=0,
+            )
+
+        return ax
+
     def melt_rolling_averages(self, df: pl.DataFrame) -> pl.DataFrame:
         """
         add dataframe error to the mean value and melt the dataframe so when plotting we get nice error lines
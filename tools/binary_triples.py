@@ -0,0 +1,187 @@
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import polars as pl
+
+### Binary, pre-indexed triples
+#
+# Next to each split tsv (i.e. 'train_ttv_time.txt') the split stage writes an int32 array of the
+# same triples (i.e. 'train_ttv_time.npy'), with one row per triple and columns (h, r, t[, year]).
+# Labels are mapped to ids with one global entity and relation vocabulary, built from the final year's
+# network and shared by every year, stored as Arrow IPC files in the base directory:
+#
+#   entities.arrow      'label' -> 'id', sorted by label
+#   relations.arrow     'label' -> 'id', sorted by label
+#
+# An id therefore means the same entity or relation in every year.
+#
+# Next to each array, a '.vocab' file (i.e. 'train_ttv_time.vocab') records the fingerprint of the vocabulary
+# it was mapped with. Readers only use an array whose fingerprint matches the vocabulary they decode it with,
+# so arrays mapped with an older or a year-local vocabulary are never decoded with the wrong labels.
+#
+# Arrays are loaded with `np.load(mmap_mode="r")`, so reading a year's triples does not parse or copy them.
+
+VOCAB_FILES = {"entities": "entities.arrow", "relations": "relations.arrow"}
+
+
+def build_vocabulary(labels: pl.Series) -> pl.DataFrame:
+    """
+    Returns a vocabulary of the unique `labels`, with int32 ids assigned in sorted label order
+    """
+    return (
+        labels.unique()
+        .drop_nulls()
+        .sort()
+        .to_frame("label")
+        .with_row_index("id")
+        .select("label", pl.col("id").cast(pl.Int32))
+    )
+
+
+def write_vocabulary(
+    vocab_dir: str, entities: pl.DataFrame, relations: pl.DataFrame
+) -> Dict[str, str]:
+    """
+    Atomically writes the entity and relation vocabularies to `vocab_dir`. Returns the paths of the written files.
+    """
+    os.makedirs(vocab_dir, exist_ok=True)
+    paths = {k: os.path.join(vocab_dir, f) for k, f in VOCAB_FILES.items()}
+
+    for vocab, name in [(entities, "entities"), (relations, "relations")]:
+        tmp_file = f"{paths[name]}.tmp"
+        vocab.write_ipc(tmp_file)
+        os.replace(tmp_file, paths[name])
+
+    return paths
+
+
+def read_vocabulary(vocab_dir: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Returns the entity and relation vocabularies written to `vocab_dir` by `write_vocabulary`
+    """
+    return tuple(
+        pl.read_ipc(os.path.join(vocab_dir, VOCAB_FILES[name]), memory_map=True)
+        for name in ["entities", "relations"]
+    )
+
+
+def vocabulary_fingerprint(entities: pl.DataFrame, relations: pl.DataFrame) -> str:
+    """
+    Returns a fingerprint of the entity and relation vocabularies: the sha1 of their labels in id order
+    """
+    sha = hashlib.sha1()
+    for vocab in [entities, relations]:
+        sha.update("\n".join(vocab.sort("id")["label"].to_list()).encode("utf-8"))
+        sha.update(b"\0")
+
+    return sha.hexdigest()
+
+
+def triples_fingerprint(file: str) -> Optional[str]:
+    """
+    Returns the fingerprint of the vocabulary the triples in `file` ('.npy') were mapped with, or None if it was not recorded
+    """
+    vocab_file = f"{os.path.splitext(file)[0]}.vocab"
+    if not os.path.exists(vocab_file):
+        return None
+    with open(vocab_file) as f:
+        return f.read().strip()
+
+
+def has_vocabulary(vocab_dir: str) -> bool:
+    """
+    Returns True if `vocab_dir` contains an entity and relation vocabulary
+    """
+    return all(os.path.exists(os.path.join(vocab_dir, f)) for f in VOCAB_FILES.values())
+
+
+def encode_triples(
+    df: pl.DataFrame, entities: pl.DataFrame, relations: pl.DataFrame
+) -> np.ndarray:
+    """
+    Maps the labelled triples in `df` to an int32 array of (h, r, t[, year]), in the same row order.
+    `df` has the columns of a split, 'h_id', 'r', 't_id' and optionally 'year'.
+    Every label must be in the vocabularies.
+    """
+    ent_ids = dict(zip(entities["label"], entities["id"]))
+    rel_ids = dict(zip(relations["label"], relations["id"]))
+
+    cols = [
+        pl.col("h_id").replace(ent_ids, default=None, return_dtype=pl.Int32),
+        pl.col("r").replace(rel_ids, default=None, return_dtype=pl.Int32),
+        pl.col("t_id").replace(ent_ids, default=None, return_dtype=pl.Int32),
+    ]
+    if "year" in df.columns:
+        cols.append(pl.col("year").cast(pl.Int32))
+
+    mapped = df.select(cols)
+    assert (
+        mapped.null_count().sum_horizontal().item() == 0
+    ), "some triples have labels that are not in the vocabulary"
+
+    return mapped.to_numpy().astype(np.int32, copy=False)
+
+
+def write_triples(
+    file: str, triples: np.ndarray, fingerprint: Optional[str] = None
+) -> int:
+    """
+    Atomically writes an array of triples to `file` ('.npy'), and the `fingerprint` of the vocabulary it was mapped with
+    next to it ('.vocab'). Returns the number of triples written.
+    """
+    # drop the old fingerprint first, so an interrupted write never pairs new triples with it
+    vocab_file = f"{os.path.splitext(file)[0]}.vocab"
+    if os.path.exists(vocab_file):
+        os.remove(vocab_file)
+
+    tmp_file = f"{file}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.save(f, np.ascontiguousarray(triples, dtype=np.int32))
+    os.replace(tmp_file, file)
+
+    if fingerprint is not None:
+        with open(f"{vocab_file}.tmp", "w") as f:
+            f.write(fingerprint)
+        os.replace(f"{vocab_file}.tmp", vocab_file)
+
+    return triples.shape[0]
+
+
+def load_triples(file: str, mmap: bool = True) -> np.ndarray:
+    """
+    Returns the int32 (h, r, t[, year]) array written by `write_triples`. With `mmap`, the array is
+    memory-mapped read-only instead of read into memory.
+    """
+    return np.load(file, mmap_mode="r" if mmap else None)
+
+
+def decode_triples(
+    triples: np.ndarray,
+    entities: pl.DataFrame,
+    relations: pl.DataFrame,
+    headers: Optional[List[str]] = None,
+) -> pl.DataFrame:
+    """
+    Maps an int32 array of (h, r, t[, year]) back to labelled triples.
+
+    :triples:       array from `load_triples`
+    :entities:      entity vocabulary
+    :relations:     relation vocabulary
+    :headers:       column names. Defaults to ["h", "r", "t"] or ["h", "r", "t", "year"]
+    """
+    if headers is None:
+        headers = ["h", "r", "t", "year"][: triples.shape[1]]
+
+    ent_labels = entities.sort("id")["label"]
+    rel_labels = relations.sort("id")["label"]
+    cols = [
+        ent_labels.gather(triples[:, 0]),
+        rel_labels.gather(triples[:, 1]),
+        ent_labels.gather(triples[:, 2]),
+    ]
+    if triples.shape[1] == 4:
+        cols.append(pl.Series(triples[:, 3]).cast(pl.Int64))
+
+    return pl.DataFrame({name: col for name, col in zip(headers, cols)})
@@ -0,0 +1,197 @@
+import os
+import sys
+import tempfile
+import uuid
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+import polars as pl
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+### Shared read-only inputs of parallel workers
+#
+# Arguments of `parallel_imap`/`ProcessPoolExecutor` tasks are pickled for every task, so large lookups
+# (the PMID to year table, a vocabulary, an indication matrix) would be copied into every worker.
+# Instead, publish them once in the parent and pass the small, picklable handle to the tasks:
+#
+#   numpy arrays            -> copied once into `multiprocessing.shared_memory`, attached by name
+#   polars / arrow tables   -> written once as an uncompressed Arrow IPC file, memory-mapped on attach
+#
+# IPC files go to /dev/shm when it exists, so both kinds live in memory and are never copied per worker.
+# `attach` is zero-copy and cached per process, so a worker maps each input once however many tasks it runs.
+#
+# Example
+# ------------
+# with Broadcast() as bc:
+#     years = bc.publish(pmid_to_year_df)
+#     for r in parallel_imap([{"shard": s, "years": years} for s in shards], map_shard, use_kwargs=True):
+#         ...
+#
+# def map_shard(shard, years):
+#     years = attach(years)
+
+# handles already attached in this process, by name
+_ATTACHED: Dict[str, Tuple[Any, Any]] = dict()
+
+
+class SharedArray(object):
+    """
+    Picklable handle of a numpy array published to shared memory by `Broadcast.publish`
+    """
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: str) -> None:
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def __repr__(self) -> str:
+        return (
+            f"SharedArray(name={self.name!r}, shape={self.shape}, dtype={self.dtype!r})"
+        )
+
+
+class SharedTable(object):
+    """
+    Picklable handle of a polars DataFrame or arrow Table published as an Arrow IPC file by `Broadcast.publish`
+    """
+
+    def __init__(self, name: str, path: str, kind: str = "polars") -> None:
+        self.name = name
+        self.path = path
+        self.kind = kind
+
+    def __repr__(self) -> str:
+        return (
+            f"SharedTable(name={self.name!r}, path={self.path!r}, kind={self.kind!r})"
+        )
+
+
+def _open_shared_memory(name: str) -> shared_memory.SharedMemory:
+    # attaching must not register the block with this process' resource tracker, which would
+    # unlink it when a worker exits. Only python >= 3.13 can opt out, older versions share the parent's tracker.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def attach(
+    handle: Union[SharedArray, SharedTable],
+) -> Union[np.ndarray, pl.DataFrame, "pa.Table"]:
+    """
+    Returns a zero-copy, read-only view of a published input. Views are cached per process,
+    so calling `attach` in every task is cheap.
+    """
+    if handle.name in _ATTACHED:
+        return _ATTACHED[handle.name][1]
+
+    if isinstance(handle, SharedArray):
+        shm = _open_shared_memory(handle.name)
+        value = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+        value.flags.writeable = False
+    elif handle.kind == "arrow":
+        shm = pa.memory_map(handle.path, "r")
+        value = pa.ipc.open_file(shm).read_all()
+    else:
+        shm = None
+        value = pl.read_ipc(handle.path, memory_map=True)
+
+    # keep the shared memory block or file mapping open as long as the view is used
+    _ATTACHED[handle.name] = (shm, value)
+
+    return value
+
+
+def detach(handle: Union[SharedArray, SharedTable]) -> None:
+    """
+    Drops this process' cached view of a published input. Views of it must no longer be used.
+    """
+    shm, _ = _ATTACHED.pop(handle.name, (None, None))
+    if shm is not None:
+        shm.close()
+
+
+class Broadcast(object):
+    """
+    Publishes large read-only inputs once for parallel workers, and removes them on `close` or when leaving a `with` block.
+
+    :ipc_dir:   directory of the Arrow IPC files of published tables. Defaults to /dev/shm if it exists, otherwise the temp directory
+    """
+
+    def __init__(self, ipc_dir: Optional[str] = None) -> None:
+        if ipc_dir is None:
+            ipc_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.ipc_dir = ipc_dir
+        self.handles = dict()
+        self._blocks = dict()
+
+    def __enter__(self) -> "Broadcast":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def publish(
+        self,
+        value: Union[np.ndarray, pl.DataFrame, "pa.Table"],
+        name: Optional[str] = None,
+    ) -> Union[SharedArray, SharedTable]:
+        """
+        Publishes a numpy array, polars DataFrame or arrow Table and returns its handle, to pass to workers and `attach`.
+        Later changes to `value` are not seen by the workers.
+
+        :value:     input to share
+        :name:      name of the shared memory block or IPC file. Defaults to a unique name
+        """
+        name = f"trkg_{uuid.uuid4().hex[:16]}" if name is None else name
+        assert name not in self.handles, f"{name} is already published"
+
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            shm = shared_memory.SharedMemory(
+                name=name, create=True, size=max(value.nbytes, 1)
+            )
+            np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+            self._blocks[name] = shm
+            handle = SharedArray(name=name, shape=value.shape, dtype=value.dtype.str)
+
+        elif isinstance(value, pl.DataFrame) or (
+            pa is not None and isinstance(value, pa.Table)
+        ):
+            path = os.path.join(self.ipc_dir, f"{name}.arrow")
+            tmp_file = f"{path}.tmp"
+            if isinstance(value, pl.DataFrame):
+                value.write_ipc(tmp_file, compression="uncompressed")
+                kind = "polars"
+            else:
+                with pa.OSFile(tmp_file, "wb") as sink:
+                    with pa.ipc.new_file(sink, value.schema) as writer:
+                        writer.write_table(value)
+                kind = "arrow"
+            os.replace(tmp_file, path)
+            handle = SharedTable(name=name, path=path, kind=kind)
+
+        else:
+            raise TypeError(f"Cannot publish {type(value)}")
+
+        self.handles[name] = handle
+
+        return handle
+
+    def close(self) -> None:
+        """
+        Removes every published input. Workers must be done with them.
+        """
+        for name, handle in self.handles.items():
+            detach(handle)
+            if isinstance(handle, SharedArray):
+                shm = self._blocks.pop(name)
+                shm.close()
+                shm.unlink()
+            elif os.path.exists(handle.path):
+                os.remove(handle.path)
+        self.handles = dict()
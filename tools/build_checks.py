@@ -0,0 +1,111 @@
+import datetime
+import json
+import os
+from decimal import Decimal
+from typing import Dict, Optional
+
+import polars as pl
+
+### Validation levels and stage metrics shared by the prepare/build scripts
+#
+# 'off'  -> skip diagnostic counts and invariant checks
+# 'fast' -> compute diagnostic counts in one fused select and write them as stage metrics
+# 'full' -> also run the expensive multi-pass invariants (node typing, dict subset checks, etc.)
+
+CHECK_LEVELS = ["off", "fast", "full"]
+
+
+def checks_enabled(level: str, required: str) -> bool:
+    """
+    Returns True if the selected validation `level` is at least the `required` level
+
+    Example
+    ------------
+    checks_enabled("fast", "full") -> False
+    checks_enabled("full", "fast") -> True
+    """
+    assert level in CHECK_LEVELS, f"level must be one of {CHECK_LEVELS}"
+    assert required in CHECK_LEVELS, f"required must be one of {CHECK_LEVELS}"
+
+    return CHECK_LEVELS.index(level) >= CHECK_LEVELS.index(required)
+
+
+def collect_metrics(
+    df: pl.DataFrame, exprs: Dict[str, pl.Expr]
+) -> Dict[str, Optional[float]]:
+    """
+    Computes all diagnostic aggregates in `exprs` in a single fused `select` over `df`.
+    Each expression must reduce to a single value.
+
+    Example
+    ------------
+    collect_metrics(edges, {"n_edges": pl.len(), "n_self_ref": (pl.col("h_id") == pl.col("t_id")).sum()})
+    -> {"n_edges": 100, "n_self_ref": 3}
+    """
+    return df.lazy().select(**exprs).collect().row(0, named=True)
+
+
+def multi_type_node_count(
+    edges: pl.DataFrame,
+    h_type: str = "htype",
+    t_type: str = "ttype",
+) -> int:
+    """
+    Returns the number of nodes in edges that are labeled with more than one node type
+    """
+    return (
+        pl.concat(
+            [
+                edges.lazy().select(
+                    pl.col("h_id").alias("id"), pl.col(h_type).alias("type")
+                ),
+                edges.lazy().select(
+                    pl.col("t_id").alias("id"), pl.col(t_type).alias("type")
+                ),
+            ]
+        )
+        .group_by("id")
+        .agg(pl.col("type").n_unique())
+        .select((pl.col("type") > 1).sum())
+        .collect()
+        .item()
+    )
+
+
+def write_stage_metrics(
+    stage: str,
+    metrics: Dict[str, object],
+    metrics_dir: str = "../data/metrics",
+) -> str:
+    """
+    Writes a dictionary of stage metrics to `<metrics_dir>/<stage>.json`. Metrics from a previous
+    run of the same stage are overwritten. Returns the path of the written file.
+    """
+    os.makedirs(metrics_dir, exist_ok=True)
+    out_file = os.path.join(metrics_dir, f"{stage}.json")
+
+    with open(out_file, "w") as f:
+        json.dump(
+            {
+                "stage": stage,
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "metrics": metrics,
+            },
+            f,
+            indent=2,
+            default=str,
+        )
+
+    return out_file
+
+
+def cutoff_suffix(cutoff: float) -> str:
+    """
+    Returns the file name suffix of the networks filtered with an edge abundance `cutoff`, its decimal digits
+
+    Example
+    ------------
+    cutoff_suffix(0.001) -> "001"
+    cutoff_suffix(0.0005) -> "0005"
+    """
+    return format(Decimal(str(cutoff)), "f").removeprefix("0.")
@@ -1,13 +1,25 @@
 import os
 import pathlib
 from collections import ChainMap
+from functools import cached_property
 from typing import List, Optional, Tuple
 
+import numpy as np
 import polars as pl
 import pykeen
+import scipy.sparse
 from pykeen.datasets.timeresolvedkg import TimeResolvedKG as trkg
 from pykeen.pipeline import pipeline
 from pykeen.predict import predict_all
+from binary_triples import (
+    decode_triples,
+    has_vocabulary,
+    load_triples,
+    read_vocabulary,
+    triples_fingerprint,
+    vocabulary_fingerprint,
+)
+from time_store import is_time_store, read_year, snapshot_years
 
 
 class TimeDrugRepo(object):
@@ -44,11 +56,14 @@ class TimeDrugRepo(object):
         **kwargs,
     ):
         self.data_dir = data_dir
-        self.years = [  # automatically should throw an error if an item in the directory cannot be converted to an integer
-            int(i)
-            for i in os.listdir(self.data_dir)
-            if os.path.isdir(os.path.join(self.data_dir, i))
-        ]
+        if is_time_store(self.data_dir):
+            self.years = snapshot_years(self.data_dir)
+        else:
+            self.years = [  # automatically should throw an error if an item in the directory cannot be converted to an integer
+                int(i)
+                for i in os.listdir(self.data_dir)
+                if os.path.isdir(os.path.join(self.data_dir, i))
+            ]
 
         self.models_to_run = models_to_run
         self.strategy = strategy
@@ -71,9 +86,11 @@ class TimeDrugRepo(object):
             self.use_testing_data = False
             self.run_model(**kwargs)
 
-    def read_df(self, year: int, filename: str) -> pl.DataFrame:
+    def read_df(
+        self, year: int, filename: str, relations: Optional[List[str]] = None
+    ) -> pl.DataFrame:
         """
-        Get a dataframe for a given year and name
+        Get a dataframe for a given year and name, optionally only the triples of `relations`
         """
         assert filename in [
             "train",
@@ -95,7 +112,29 @@ class TimeDrugRepo(object):
 
         # new file path
         new_file_dir = pathlib.Path(file_dir, str(year), f"{filename}{ttv}{time}.txt")
-        df = pl.read_csv(new_file_dir, separator="\t", new_columns=headers)
+
+        # use the binary triples written next to the tsv, if they were mapped with the global vocabulary
+        npy_file = new_file_dir.with_suffix(".npy")
+        if npy_file.exists() and has_vocabulary(file_dir):
+            entities, relation_vocab = read_vocabulary(file_dir)
+            if triples_fingerprint(str(npy_file)) == vocabulary_fingerprint(
+                entities, relation_vocab
+            ):
+                triples = load_triples(npy_file)
+                if relations is not None:
+                    rel_ids = relation_vocab.filter(pl.col("label").is_in(relations))[
+                        "id"
+                    ]
+                    triples = triples[np.isin(triples[:, 1], rel_ids.to_numpy())]
+                return decode_triples(
+                    triples, entities, relation_vocab, headers=headers
+                )
+
+        df = pl.read_csv(
+            new_file_dir, separator="\t", has_header=False, new_columns=headers
+        )
+        if relations is not None:
+            df = df.filter(pl.col("r").is_in(relations))
         return df
 
     def get_indication_count(self, year: int) -> Tuple[int, int, Optional[int]]:
@@ -158,14 +197,16 @@ class TimeDrugRepo(object):
 
         return df
 
-    def get_all_indications_df(self, filename: str) -> pl.DataFrame:
+    def get_all_indications_df(
+        self, filename: str, years: Optional[List[int]] = None
+    ) -> pl.DataFrame:
         """
-        Iterates through all years in the dataset and returns a dataframe with all indications
+        Iterates through all years in the dataset, or `years`, and returns a dataframe with all indications
         """
-        years = self.years
+        years = self.years[:-3] if years is None else years
         all_indications = list()
 
-        for year in years[:-3]:
+        for year in years:
             df = self.read_df(year=year, filename=filename)
             df = df.with_columns(ds_year=pl.lit(year))
             all_indications.append(df)
@@ -173,6 +214,20 @@ class TimeDrugRepo(object):
         all_indications_df = pl.concat(all_indications)
         return all_indications_df
 
+    @cached_property
+    def valid_ind_df(self) -> pl.DataFrame:
+        """
+        Valid indications of all years, read on first use
+        """
+        return self.get_all_valid_indications_df()
+
+    @cached_property
+    def test_ind_df(self) -> pl.DataFrame:
+        """
+        Test indications of all years, read on first use
+        """
+        return self.get_all_test_indications_df()
+
     def get_all_valid_indications_df(self) -> pl.DataFrame:
         """
         Iterates through all years in the dataset and returns a dataframe with all valid indications
@@ -185,91 +240,135 @@ class TimeDrugRepo(object):
         """
         return self.get_all_indications_df(filename="test")
 
-    def recommend(self) -> Tuple[List[int], int, pl.DataFrame]:
+    def get_indication_matrix(self) -> None:
         """
-        Recommend the subset of years to train on based on `self.models_to_run`
-        """
-        self.valid_ind_df = self.get_all_valid_indications_df()
-        self.test_ind_df = self.get_all_test_indications_df()
-        self.ind_counts_df = self.get_indication_counts_df()
+        Reads every year's train, test and valid triples once, and builds the year x indication incidence matrices
+        the recommendation runs on. Sets:
 
-        ind_counts_df = self.ind_counts_df
+        self.ind_counts_df:     unique INDICATION_CDiDO triples of each year in train, test and valid
+        self.ind_years:         years of the matrix rows, in ascending order
+        self.ind_matrices:      {"test": ..., "valid": ...} sparse matrices of the number of triples of each
+                                (h, t) pair (columns) in each year (rows)
+        """
+        ttv = self.build_dataset_kwargs.get("split_ttv", False) != False
+        filenames = ["train", "test", "valid"] if ttv else ["train", "test"]
 
-        ind_counts_df = ind_counts_df.with_columns(
-            test_valid=pl.col("test_indications") + pl.col("valid_indications")
-        ).sort("test_valid", descending=True)
+        # don't include 2022 and 2023 for years
+        self.ind_years = sorted(self.years[:-3])
+
+        counts, pairs = {f: list() for f in filenames}, {f: list() for f in filenames}
+        for year in self.ind_years:
+            for filename in filenames:
+                # training triples are only needed for their indication counts
+                df = self.read_df(
+                    year=year,
+                    filename=filename,
+                    relations=["INDICATION_CDiDO"] if filename == "train" else None,
+                )
+                counts[filename].append(
+                    df.filter(pl.col("r") == "INDICATION_CDiDO").unique().shape[0]
+                )
+                if filename != "train":
+                    pairs[filename].append(
+                        df.select("h", "t").with_columns(row=pl.lit(year))
+                    )
 
-        recommended_years = list()
-        recommended_years.append(ind_counts_df["year"].gather(0).item())
+        self.ind_counts_df = pl.DataFrame(
+            {"year": self.ind_years}
+            | {f"{filename}_indications": counts[filename] for filename in filenames}
+        )
 
-        while len(recommended_years) < self.models_to_run:
-            # get already recommended year triples to maximize the ones that haven't been recommended
-            already_recommended_valid_triples = self.valid_ind_df.filter(
-                pl.col("ds_year").is_in(recommended_years)
+        self.ind_matrices = dict()
+        for filename in filenames[1:]:
+            df = pl.concat(pairs[filename])
+            # number each year and each (h, t) pair
+            df = df.with_columns(
+                pl.col("row").replace(
+                    {year: i for i, year in enumerate(self.ind_years)},
+                    return_dtype=pl.Int64,
+                ),
+                pl.struct("h", "t").rank("dense").cast(pl.Int64).alias("col") - 1,
             )
-
-            # get the year with the most test+valid indications, sans the ones already recommended
-
-            valid_df_sans_recommended = (
-                self.valid_ind_df.join(
-                    already_recommended_valid_triples, on=["h", "t"], how="left"
-                )
-                .filter(pl.col("r_right").is_null())
-                .group_by("ds_year")
-                .agg(pl.count("h").alias("count"))
-                .sort("count", descending=True)
+            df = df.group_by("row", "col").agg(pl.len().alias("n"))
+            self.ind_matrices[filename] = scipy.sparse.csr_matrix(
+                (df["n"].to_numpy(), (df["row"].to_numpy(), df["col"].to_numpy())),
+                shape=(
+                    len(self.ind_years),
+                    df["col"].max() + 1 if df.shape[0] > 0 else 0,
+                ),
             )
-            if self.strategy == "max_test_valid":
-                # get already recommended test year triple
-                already_recommended_test_triples = self.test_ind_df.filter(
-                    pl.col("ds_year").is_in(recommended_years)
-                )
-                test_df_sans_recommended = (
-                    self.test_ind_df.join(
-                        already_recommended_test_triples, on=["h", "t"], how="left"
-                    )
-                    .filter(pl.col("r_right").is_null())
-                    .group_by("ds_year")
-                    .agg(pl.count("h").alias("count"))
-                )
 
-                # get the year with the most test+valid indications, sans the ones already recommended
-                combined_df_sans_recommended = (
-                    valid_df_sans_recommended.join(
-                        test_df_sans_recommended, on=["ds_year"], how="outer"
-                    )
-                    .with_columns(
-                        pl.col("count").fill_null(strategy="zero"),
-                        pl.col("count_right").fill_null(strategy="zero"),
-                    )
-                    .with_columns(
-                        (pl.col("count") + pl.col("count_right")).alias(
-                            "combined_count"
-                        )
-                    )
-                    .sort("combined_count", descending=True)
-                )
+    @staticmethod
+    def greedy_max_coverage(
+        matrices: List[scipy.sparse.csr_matrix], first: int, n: int
+    ) -> List[int]:
+        """
+        Greedily picks `n` rows, starting with `first`, each adding the most entries of not yet covered columns,
+        summed over `matrices`. Gains are updated incrementally, only for the columns each pick newly covers.
+        Ties go to the lowest row. Returns the picked rows.
 
-                rec_year = combined_df_sans_recommended["ds_year"].gather(0).item()
+        :matrices:  sparse row x column matrices of non-negative counts, with the same rows
+        :first:     first row to pick
+        :n:         number of rows to pick
+        """
+        n_rows = matrices[0].shape[0]
+        gains = np.zeros(n_rows, dtype=np.int64)
+        for m in matrices:
+            gains += np.asarray(m.sum(axis=1), dtype=np.int64).ravel()
+
+        covered = [np.zeros(m.shape[1], dtype=bool) for m in matrices]
+        by_column = [m.tocsc() for m in matrices]
+        picked = np.zeros(n_rows, dtype=bool)
+
+        rows = list()
+        row = first
+        while True:
+            rows.append(row)
+            picked[row] = True
+
+            # cover the row's columns, and remove them from the gains of every row they are in
+            for m, m_csc, cov in zip(matrices, by_column, covered):
+                cols = m.indices[m.indptr[row] : m.indptr[row + 1]]
+                cols = cols[~cov[cols]]
+                cov[cols] = True
+                gains -= np.asarray(m_csc[:, cols].sum(axis=1), dtype=np.int64).ravel()
+
+            if len(rows) >= n or picked.all():
+                return rows
+            row = int(np.argmax(np.where(picked, -1, gains)))
+
+    def recommend(self) -> List[int]:
+        """
+        Recommend the subset of years to train on based on `self.models_to_run`.
+        The first year has the most test+valid indications, and each next year the most valid (or test+valid)
+        indications whose compound-disease pair is not in an already recommended year.
+        """
+        self.get_indication_matrix()
 
-            else:
-                rec_year = valid_df_sans_recommended["ds_year"].gather(0).item()
+        ind_counts_df = self.ind_counts_df.with_columns(
+            test_valid=pl.sum_horizontal(pl.col("^(test|valid)_indications$"))
+        )
+        first = int(ind_counts_df["test_valid"].arg_max())
 
-            recommended_years.append(rec_year)
+        matrices = [self.ind_matrices["valid"]]
+        if self.strategy == "max_test_valid":
+            matrices.append(self.ind_matrices["test"])
+
+        rows = self.greedy_max_coverage(matrices, first=first, n=self.models_to_run)
 
-        return recommended_years
+        return [self.ind_years[row] for row in rows]
 
     def recommend_compound_disease_pair(self) -> pl.DataFrame:
         """
         Takes a recommended list of years and returns a dataframe of the compound-disease pairs for each year.
         Can use this to check if the recommendations are IID.
         """
-        valid_inds_df = self.valid_ind_df.filter(
-            pl.col("ds_year").is_in(self.recommended_years)
+        valid_inds_df = self.get_all_indications_df(
+            filename="valid", years=self.recommended_years
         )
         if self.strategy == "max_test_valid":
-            test_inds_df = self.test_ind_df.filter(
-                pl.col("ds_year").is_in(self.recommended_years)
+            test_inds_df = self.get_all_indications_df(
+                filename="test", years=self.recommended_years
             )
         else:
             test_inds_df = None
@@ -452,27 +551,21 @@ def get_indication_types(file_dir: str) -> pl.DataFrame:
 
 
 def read_dataframes(file_dir: str) -> pl.DataFrame:
-    # check if files exist
-    for file in [
-        (nodes_loc := os.path.join(file_dir, "nodes.parquet")),
-        (edges_loc := os.path.join(file_dir, "edges.parquet")),
-        (indic_loc := os.path.join(file_dir, "indications.parquet")),
-    ]:
-        assert os.path.exists(file) == True, f"{file} not in given file directory"
-
-    # read files
-    nodes = pl.read_parquet(source=nodes_loc)
-    edges = pl.read_parquet(source=edges_loc)
-    indications = pl.read_parquet(
-        source=indic_loc,
-        columns=[
-            "compound_semmed_id",
-            "disease_semmed_id",
-            "approval_date",
-            "approval_year",
-            "year_diff",
-            "year_cat",
-        ],
+    # read the year's per-year files, or its snapshot from a time-indexed store
+    nodes, edges, indications = read_year(file_dir)
+    nodes, edges, indications = pl.collect_all(
+        [
+            nodes,
+            edges,
+            indications.select(
+                "compound_semmed_id",
+                "disease_semmed_id",
+                "approval_date",
+                "approval_year",
+                "year_diff",
+                "year_cat",
+            ),
+        ]
     )
 
     return nodes, edges, indications
@@ -0,0 +1,187 @@
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import polars as pl
+import pykeen.datasets.timeresolvedkg as trkg
+import pykeen.models
+import torch
+import torch.multiprocessing
+from analysis_helper import AnalysisHelper
+
+### Evaluation of many checkpoints over many years
+#
+# Each entry of the evaluation grid is a dictionary describing one (model class, checkpoint, year, group, qa):
+#
+#   {"model": pykeen.models.TransE,          model class, or its name i.e. "TransE"
+#    "model_kwargs": {"embedding_dim": 230}, kwargs the checkpoint's model was built with
+#    "checkpoint": "TransE_neg_1964.pt",     checkpoint file in the pykeen checkpoint directory
+#    "year": "1964",
+#    "group": "test",                        {'test','valid'}
+#    "qa": "both",                           {'both','head','tail'}
+#    "name": "TransE"}                       algorithm label, defaults to the model class name
+#
+# Every year's dataset is loaded once in the parent process. Its mapped triples are moved to shared memory and
+# handed to a pool of CPU workers, which seed their dataset cache with them, so workers evaluate on the same
+# read-only triples instead of loading their own copy.
+
+logger = logging.getLogger(__name__)
+
+RESULT_COLUMNS = [
+    "algo",
+    "checkpoint",
+    "year",
+    "group",
+    "query_label",
+    "query",
+    "relation",
+    "answers",
+    "answer_filt_rank",
+    "year_diff",
+]
+
+
+def _init_worker(
+    datasets: Dict[Tuple, Tuple[Optional["TriplesFactory"], ...]], n_threads: int
+) -> None:
+    """
+    Seeds the worker's dataset cache with the shared factories of a year, and limits torch's threads per worker
+    """
+    torch.set_num_threads(n_threads)
+    for key, factories in datasets.items():
+        trkg.DATASET_CACHE.put(key, factories)
+
+
+def evaluate_checkpoint(
+    task: Mapping[str, Any],
+    build_dataset_kwargs: Mapping[str, Any],
+    train_models_swap: bool = False,
+    batch_size: int = 256,
+) -> pl.DataFrame:
+    """
+    Evaluates one grid entry on the cpu and returns the filtered rank and `year_diff` of every answer,
+    labelled with the algorithm, checkpoint, year and group.
+
+    :task:                  grid entry, see the top of this module
+    :build_dataset_kwargs:  parameters supplied to build the knowledge graph
+    :train_models_swap:     whether the checkpoint was trained with test and valid swapped
+    :batch_size:            number of queries scored per model call
+    """
+    model_cls = task["model"]
+    if isinstance(model_cls, str):
+        model_cls = pykeen.models.model_resolver.lookup(model_cls)
+
+    dataset = AnalysisHelper.load_pykeen_dataset(
+        build_dataset_kwargs=build_dataset_kwargs, year=task["year"]
+    )
+    model = model_cls(triples_factory=dataset.training, **task.get("model_kwargs", {}))
+
+    helper = AnalysisHelper(
+        build_dataset_kwargs=build_dataset_kwargs,
+        year=task["year"],
+        train_models_swap=train_models_swap,
+        pykeen_model=model,
+        chkpt_file=task["checkpoint"],
+        group=task.get("group", "test"),
+        qa=task.get("qa", "both"),
+        cuda=False,
+        batch_size=batch_size,
+    )
+
+    return helper.answer_df.with_columns(
+        algo=pl.lit(task.get("name", model_cls.__name__)),
+        checkpoint=pl.lit(task["checkpoint"]),
+        year=pl.lit(str(task["year"])),
+        group=pl.lit(task.get("group", "test")),
+    ).select(RESULT_COLUMNS)
+
+
+def run_evaluations(
+    grid: List[Mapping[str, Any]],
+    build_dataset_kwargs: Mapping[str, Any],
+    out_file: str,
+    n_jobs: int = 4,
+    batch_size: int = 256,
+    train_models_swap: bool = False,
+) -> pl.DataFrame:
+    """
+    Evaluates every entry of `grid` with a pool of `n_jobs` CPU workers per year and writes the combined per-answer
+    ranks to `out_file` (parquet). Each year's dataset is loaded once and shared read-only with the workers.
+    Returns the combined results, in grid order. The results have an 'algo' column and can be passed directly
+    to `AnalysisPlotter`.
+
+    :grid:                  list of grid entries, see the top of this module
+    :build_dataset_kwargs:  parameters supplied to build the knowledge graph
+    :out_file:              parquet file to write the combined results to
+    :n_jobs:                number of worker processes
+    :batch_size:            number of queries scored per model call
+    :train_models_swap:     whether the checkpoints were trained with test and valid swapped
+
+    Example
+    ------------
+    grid = [
+        {"model": "TransE", "model_kwargs": {"embedding_dim": 230}, "checkpoint": f"TransE_{y}.pt", "year": y}
+        for y in ["1964", "1987"]
+    ]
+    results = run_evaluations(grid, {"split_ttv": True}, "../data/eval/results.parquet")
+    AnalysisPlotter(answer_df=results, algo_name_ls=results["algo"].unique().to_list())
+    """
+    tasks_by_year = defaultdict(list)
+    for i, task in enumerate(grid):
+        tasks_by_year[str(task["year"])].append((i, task))
+
+    # spawned workers receive shared-memory tensors by handle through torch's pickler
+    ctx = torch.multiprocessing.get_context("spawn")
+    n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+
+    results, errors = [None] * len(grid), list()
+    for year, tasks in tasks_by_year.items():
+        logger.info(f"... evaluating {len(tasks)} checkpoint(s) on {year}")
+
+        # load the year's dataset once and move its triples to shared memory
+        dataset = AnalysisHelper.load_pykeen_dataset(
+            build_dataset_kwargs=build_dataset_kwargs, year=year
+        )
+        factories = (dataset.training, dataset.testing, dataset.validation)
+        for factory in factories:
+            if factory is not None:
+                factory.mapped_triples.share_memory_()
+
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(tasks)),
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=({dataset._cache_key(): factories}, n_threads),
+        ) as pool:
+            futures = {
+                i: pool.submit(
+                    evaluate_checkpoint,
+                    task=task,
+                    build_dataset_kwargs=build_dataset_kwargs,
+                    train_models_swap=train_models_swap,
+                    batch_size=batch_size,
+                )
+                for i, task in tasks
+            }
+            for i, future in futures.items():
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    errors.append((grid[i], e))
+
+    if len(errors) > 0:
+        for task, e in errors:
+            logger.info(f"... failed to evaluate {task}: {e!r}")
+        raise errors[0][1]
+
+    results = pl.concat(results)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+    tmp_file = f"{out_file}.tmp"
+    results.write_parquet(tmp_file)
+    os.replace(tmp_file, out_file)
+    logger.info(f"... {results.shape[0]:,} ranked answers written to {out_file}")
+
+    return results
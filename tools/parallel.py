@@ -1,5 +1,33 @@
+import os
+import pickle
+import traceback as tb
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+
+### Parallel map
+#
+# `parallel_imap` is a streaming, bounded-memory successor of `parallel_process`:
+#
+#   - elements are submitted in chunks of `chunk_size`, with at most `max_in_flight` chunks
+#     submitted but not yet yielded, so neither futures nor results pile up in the parent
+#   - results are yielded as an iterator, in input order or as they complete
+#   - a `sink` runs in the worker on each result, i.e. to write it to disk, and only what it
+#     returns (i.e. the path) is sent back to the parent
+#   - failed elements are retried `retries` times, and then raised or returned as a `TaskError`
+#   - mode="thread" runs the elements in threads, for I/O-bound functions
+#
+# Large read-only inputs shared by every element should be published with `broadcast.Broadcast`
+# and passed as handles, instead of being pickled with every task.
+
 
 def parallel_process(array, function, n_jobs=16, use_kwargs=False, front_num=3, verbose=True):
     """
@@ -58,3 +86,176 @@ def parallel_process(array, function, n_jobs=16, use_kwargs=False, front_num=3,
         except Exception as e:
             out.append(e)
     return front + out
+
+
+class TaskError(Exception):
+    """
+    Error of an element of `parallel_imap` that failed every attempt.
+    Carries the formatted traceback from the worker, so it can be raised or logged in the parent.
+
+    :index:         position of the element in the input
+    :error:         repr of the last exception
+    :traceback:     formatted traceback of the last exception
+    :attempts:      number of attempts made
+    """
+
+    def __init__(self, index: int, error: str, traceback: str = "", attempts: int = 1):
+        super().__init__(index, error, traceback, attempts)
+        self.index = index
+        self.error = error
+        self.traceback = traceback
+        self.attempts = attempts
+
+    def __str__(self) -> str:
+        return f"element {self.index} failed after {self.attempts} attempt(s): {self.error}\n{self.traceback}"
+
+
+class PickleSink(object):
+    """
+    Sink of `parallel_imap` that pickles each result to `<out_dir>/<prefix><index>.pkl` in the worker
+    and returns the path of the written file
+    """
+
+    def __init__(self, out_dir: str, prefix: str = "") -> None:
+        self.out_dir = out_dir
+        self.prefix = prefix
+
+    def __call__(self, index: int, result: Any) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        out_file = os.path.join(self.out_dir, f"{self.prefix}{index}.pkl")
+        tmp_file = f"{out_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, out_file)
+
+        return out_file
+
+
+def _run_chunk(
+    function: Callable,
+    chunk: List[Tuple[int, Any]],
+    use_kwargs: bool = False,
+    sink: Optional[Callable[[int, Any], Any]] = None,
+    retries: int = 0,
+) -> List[Tuple[int, Any]]:
+    """
+    Applies `function` to every (index, element) of `chunk`, retrying failures `retries` times.
+    Returns (index, result) pairs, where the result of an element that failed every attempt is a `TaskError`.
+    """
+    out = list()
+    for i, a in chunk:
+        for attempt in range(1, retries + 2):
+            try:
+                result = function(**a) if use_kwargs else function(a)
+                if sink is not None:
+                    result = sink(i, result)
+                break
+            except Exception as e:
+                result = TaskError(
+                    index=i, error=repr(e), traceback=tb.format_exc(), attempts=attempt
+                )
+        out.append((i, result))
+
+    return out
+
+
+def parallel_imap(
+    array: Iterable,
+    function: Callable,
+    n_jobs: int = 16,
+    use_kwargs: bool = False,
+    ordered: bool = True,
+    chunk_size: int = 1,
+    max_in_flight: Optional[int] = None,
+    sink: Optional[Callable[[int, Any], Any]] = None,
+    retries: int = 0,
+    errors: str = "raise",
+    mode: str = "process",
+    verbose: bool = True,
+) -> Iterator:
+    """
+    Streaming parallel map. Yields function(array[0]), function(array[1]), ... as they are ready.
+
+    :array:           elements to apply `function` to. Any iterable, it is consumed lazily
+    :function:        function to apply, must be picklable in process mode
+    :n_jobs:          number of workers. With 1, elements are run in this process, which is useful for debugging
+    :use_kwargs:      whether the elements are dictionaries of keyword arguments to `function`
+    :ordered:         yield results in input order. Otherwise yield (index, result) pairs as they complete
+    :chunk_size:      number of elements per task submitted to a worker
+    :max_in_flight:   maximum number of chunks submitted but not yet yielded. Defaults to 2 * n_jobs
+    :sink:            function(index, result) run in the worker on each result, whose return value is yielded instead
+    :retries:         number of times a failed element is retried
+    :errors:          'raise' to raise the `TaskError` of the first element that failed every attempt,
+                      'return' to yield it in place of its result
+    :mode:            'process' or 'thread'
+    :verbose:         whether to show a progress bar
+
+    Example
+    ------------
+    for path in parallel_imap(files, parse_file, n_jobs=32, ordered=False, sink=PickleSink("../data/tmp")):
+        ...
+    """
+    assert errors in ["raise", "return"], "errors must be 'raise' or 'return'"
+    assert mode in ["process", "thread"], "mode must be 'process' or 'thread'"
+    max_in_flight = 2 * n_jobs if max_in_flight is None else max_in_flight
+
+    total = len(array) if hasattr(array, "__len__") else None
+    elements = enumerate(array)
+    chunks = iter(lambda: list(islice(elements, chunk_size)), [])
+
+    def results(chunk_results: List[Tuple[int, Any]]) -> Iterator:
+        for i, result in chunk_results:
+            if isinstance(result, TaskError) and errors == "raise":
+                raise result
+            yield result if ordered else (i, result)
+
+    with tqdm(total=total, unit="it", leave=True, disable=not verbose) as pbar:
+        # run in this process, one chunk at a time
+        if n_jobs == 1:
+            for chunk in chunks:
+                chunk_results = _run_chunk(function, chunk, use_kwargs, sink, retries)
+                pbar.update(len(chunk_results))
+                yield from results(chunk_results)
+            return
+
+        executor = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+        with executor(max_workers=n_jobs) as pool:
+            pending, done = dict(), dict()
+            next_chunk, n_submitted = 0, 0
+
+            try:
+                while True:
+                    # keep at most `max_in_flight` chunks submitted but not yet yielded
+                    while n_submitted - next_chunk < max_in_flight:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                        future = pool.submit(
+                            _run_chunk, function, chunk, use_kwargs, sink, retries
+                        )
+                        pending[future] = n_submitted
+                        n_submitted += 1
+
+                    if len(pending) == 0:
+                        break
+
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        chunk_id = pending.pop(future)
+                        chunk_results = future.result()
+                        pbar.update(len(chunk_results))
+
+                        if ordered:
+                            done[chunk_id] = chunk_results
+                        else:
+                            next_chunk += 1
+                            yield from results(chunk_results)
+
+                    # yield completed chunks in input order
+                    while next_chunk in done:
+                        yield from results(done.pop(next_chunk))
+                        next_chunk += 1
+            finally:
+                # stop chunks that have not started, i.e. when the consumer stops early or on errors
+                for future in pending:
+                    future.cancel()
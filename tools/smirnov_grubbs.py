@@ -2,18 +2,27 @@
 """
 Smirnov-Grubbs test for outlier detection.
 
+Each group is sorted once and the mean and sum of squared deviations of its
+remaining values are updated as extreme values are removed, so every
+iteration is O(1) per group. Critical values are looked up in a table computed once for all
+sample sizes, and all groups are tested together, one removal per group and
+iteration.
+
 """
 
 import numpy as np
 from scipy import stats
-from math import sqrt
-from collections import defaultdict
 
 try:
     import pandas as pd
 except ImportError:
     pd = None
 
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
 __all__ = ['test',
            'two_sided_test',
            'two_sided_test_indices',
@@ -27,7 +36,8 @@ __all__ = ['test',
            'TwoSidedGrubbsTest',
            'MinValueGrubbsTest',
            'MaxValueGrubbsTest',
-           'OutputType']
+           'OutputType',
+           'grouped_test']
 
 
 DEFAULT_ALPHA = 0.95
@@ -54,28 +64,9 @@ class GrubbsTest(object):
         else:
             raise TypeError('Unsupported data format')
 
-    def _delete_item(self, data, index):
-        if pd is not None and isinstance(data, pd.Series):
-            return data.drop(index)
-        elif isinstance(data, np.ndarray):
-            return np.delete(data, index)
-        else:
-            raise TypeError('Unsupported data format')
-
-    def _get_indices(self, values):
-        last_seen = defaultdict(lambda: 0)
-        data = list(self.original_data)
-        indices = list()
-        for value in values:
-            start = last_seen[value]
-            index = data.index(value, start)
-            indices.append(index)
-            last_seen[value] = index + 1
-        return indices
-
-    def _get_g_test(self, data, alpha):
-        """Compute a significant value score following these steps, being alpha
-        the requested significance level:
+    def _critical_values(self, n_max, alpha):
+        """Compute the G_test score of every sample size up to n_max following
+        these steps, being alpha the requested significance level:
 
         1. Find the upper critical value of the t-distribution with n-2
            degrees of freedom and a significance level of alpha/2n
@@ -84,27 +75,113 @@ class GrubbsTest(object):
         2. Use this t value to find the score with the following formula:
            ((n-1) / sqrt(n)) * (sqrt(t**2 / (n-2 + t**2)))
 
-        :param numpy.array data: data set
+        Sample sizes below 3 are never tested and get an infinite score.
+
+        :param int n_max: largest sample size
         :param float alpha: significance level
-        :return: G_test score
+        :return: numpy.array of G_test scores, indexed by sample size
         """
-        n = len(data)
-        significance_level = self._get_t_significance_level(alpha, n)
-        t = stats.t.isf(significance_level, n-2)
-        return ((n-1) / sqrt(n)) * (sqrt(t**2 / (n-2 + t**2)))
-
-    def _test_once(self, data, alpha):
-        """Perform one iteration of the Smirnov-Grubbs test.
-
-        :param numpy.array data: data set
+        g_test = np.full(max(n_max + 1, 3), np.inf)
+        n = np.arange(3, n_max + 1)
+        t = stats.t.isf(self._get_t_significance_level(alpha, n), n-2)
+        g_test[3:] = ((n-1) / np.sqrt(n)) * np.sqrt(t**2 / (n-2 + t**2))
+        return g_test
+
+    def _removal_order(self, values, offsets, alpha):
+        """Run the Smirnov-Grubbs test on every group of values at once.
+
+        Groups are the slices values[offsets[i]:offsets[i+1]]. Each group is
+        sorted once, and its mean and sum of squared deviations are updated as
+        values are removed from either end, so each iteration is O(1) per group. Ties
+        are removed in order of appearance, as with argmax/argmin. The downdated
+        mean can drift by a few ULPs, so where the min and max value are about
+        equally far from it, the mean of the remaining values is recomputed to
+        break the tie. Both are recomputed after removing a value that held
+        most of the squared deviations.
+
+        :param numpy.array values: values of all groups, group after group
+        :param numpy.array offsets: start of every group and the end of the last
         :param float alpha: significance level
-        :return: the index of the outlier if one if found; None otherwise
+        :return: numpy.array with the iteration each value was removed in as
+        an outlier of its group, or -1 if it was kept
         """
-        target_index, value = self._target(data)
-
-        g = value / data.std()
-        g_test = self._get_g_test(data, alpha)
-        return target_index if g > g_test else None
+        values = np.asarray(values, dtype=np.float64)
+        order = np.full(values.shape[0], -1)
+        sizes = np.diff(offsets)
+        if sizes.shape[0] == 0:
+            return order
+
+        # positions of every group's values in ascending and in descending
+        # order, ties in order of appearance
+        group = np.repeat(np.arange(sizes.shape[0]), sizes)
+        asc = np.lexsort((values, group))
+        desc = np.lexsort((-values, group))
+
+        # mean and sum of squared deviations of every group, downdated as
+        # values are removed
+        nonempty = sizes > 0
+        starts = offsets[:-1][nonempty]
+        mean = np.zeros(sizes.shape[0])
+        mean[nonempty] = np.add.reduceat(values, starts) / sizes[nonempty]
+        sq_dev = np.zeros(sizes.shape[0])
+        sq_dev[nonempty] = np.add.reduceat(
+            (values - mean[group])**2, starts)
+
+        g_test = self._critical_values(sizes.max(), alpha)
+        n = sizes.copy()
+        n_min = np.zeros_like(sizes)
+        n_max = np.zeros_like(sizes)
+
+        active = np.flatnonzero(sizes >= 3)
+        iteration = 0
+        while active.shape[0] > 0:
+            m = n[active]
+            std = np.sqrt(np.maximum(sq_dev[active], 0) / m)
+
+            # smallest and largest remaining value of every group
+            lo = asc[offsets[active] + n_min[active]]
+            hi = desc[offsets[active] + n_max[active]]
+            lo_distance = mean[active] - values[lo]
+            hi_distance = values[hi] - mean[active]
+            near_tie = np.flatnonzero(
+                np.abs(hi_distance - lo_distance) <= 1e-9 * (
+                    np.abs(mean[active]) + hi_distance + lo_distance))
+            for i in near_tie:
+                start, end = offsets[active[i]], offsets[active[i] + 1]
+                exact_mean = values[start:end][order[start:end] < 0].mean()
+                lo_distance[i] = exact_mean - values[lo[i]]
+                hi_distance[i] = values[hi[i]] - exact_mean
+            is_max = self._take_max(lo_distance, hi_distance, lo, hi)
+            target = np.where(is_max, hi, lo)
+
+            # groups whose remaining values are all equal have no outlier
+            with np.errstate(divide='ignore', invalid='ignore'):
+                g = np.where(is_max, hi_distance, lo_distance) / std
+            found = (g > g_test[m]) & (values[hi] > values[lo])
+
+            active, target, is_max = active[found], target[found], is_max[found]
+            m = n[active]
+            order[target] = iteration
+            delta = values[target] - mean[active]
+            prev_sq_dev = sq_dev[active]
+            mean[active] -= delta / (m-1)
+            sq_dev[active] -= delta * (values[target] - mean[active])
+            n[active] -= 1
+            n_max[active] += is_max
+            n_min[active] += ~is_max
+
+            # removing a far outlier cancels most of the sum of squared
+            # deviations, so recompute it, and the mean, from the remaining values
+            for i in active[sq_dev[active] < 1e-3 * prev_sq_dev]:
+                start, end = offsets[i], offsets[i + 1]
+                remaining = values[start:end][order[start:end] < 0]
+                mean[i] = remaining.mean()
+                sq_dev[i] = ((remaining - mean[i])**2).sum()
+
+            active = active[n[active] >= 3]
+            iteration += 1
+
+        return order
 
     def run(self, alpha=DEFAULT_ALPHA, output_type=OutputType.DATA):
         """Run the Smirnov-Grubbs test to remove outliers in the given data set.
@@ -116,73 +193,55 @@ class GrubbsTest(object):
         the outliers in the original data set (INDICES)
         """
         data = self._copy_data()
-        outliers = list()
-
-        while True:
-            outlier_index = self._test_once(data, alpha)
-            if outlier_index is None:
-                break
-            outlier = data[outlier_index]
-            outliers.append(outlier)
-            data = self._delete_item(data, outlier_index)
+        order = self._removal_order(
+            np.asarray(data), np.array([0, len(data)]), alpha)
+        indices = np.flatnonzero(order >= 0)
+        indices = indices[np.argsort(order[indices])].tolist()
 
-        return_value = data
         if output_type == OutputType.OUTLIERS:
-            return_value = outliers
+            return list(np.asarray(data)[indices])
         elif output_type == OutputType.INDICES:
-            return_value = self._get_indices(outliers)
-        return return_value
+            return indices
+        return data[order < 0]
 
-    def _target(self, data):
+    def _take_max(self, lo_distance, hi_distance, lo, hi):
         raise NotImplementedError
 
-    def _get_t_significance_level(self, alpha):
+    def _get_t_significance_level(self, alpha, n):
         raise NotImplementedError
 
 
 class TwoSidedGrubbsTest(GrubbsTest):
-    def _target(self, data):
-        """Compute the index of the farthest value from the sample mean and its
-        distance.
-
-        :param numpy.array data: data set
-        :return int, float: the index of the element and its distance to the
-        mean
+    def _take_max(self, lo_distance, hi_distance, lo, hi):
+        """Choose the farthest of the min and max value from the sample mean,
+        the first of them in the data set if they are equally far.
+
+        :param numpy.array lo_distance: distances of the min values to the mean
+        :param numpy.array hi_distance: distances of the max values to the mean
+        :param numpy.array lo: indices of the min values
+        :param numpy.array hi: indices of the max values
+        :return numpy.array: True where the max value is the target
         """
-        relative_values = abs(data - data.mean())
-        index = relative_values.argmax()
-        value = relative_values[index]
-        return index, value
+        return (hi_distance > lo_distance) | (
+            (hi_distance == lo_distance) & (hi < lo))
 
     def _get_t_significance_level(self, alpha, n):
         return alpha / (2*n)
 
 
 class OneSidedGrubbsTest(GrubbsTest):
-    def _target(self, data):
-        """Compute the index of the min/max value and its distance from the
-        sample mean.
-
-        :param numpy.array data: data set
-        :return int, float: the index of the min/max value and its distance to
-        the mean
-        """
-        index = self._get_index(data)
-        value = data[index]
-        return index, abs(value - data.mean())
-
     def _get_t_significance_level(self, alpha, n):
         return alpha / n
 
 
 class MinValueGrubbsTest(OneSidedGrubbsTest):
-    def _get_index(self, data):
-        return data.argmin()
+    def _take_max(self, lo_distance, hi_distance, lo, hi):
+        return np.zeros(lo.shape[0], dtype=bool)
 
 
 class MaxValueGrubbsTest(OneSidedGrubbsTest):
-    def _get_index(self, data):
-        return data.argmax()
+    def _take_max(self, lo_distance, hi_distance, lo, hi):
+        return np.ones(hi.shape[0], dtype=bool)
 
 
 # Convenience functions to run single Grubbs tests
@@ -241,3 +300,45 @@ def max_test_outliers(data, alpha=DEFAULT_ALPHA):
 
 def test(data, alpha=DEFAULT_ALPHA):
     return two_sided_test(data, alpha)
+
+
+# Grubbs tests of every group of a data frame in one call
+
+def grouped_test(df, group_col, value_col, alpha=DEFAULT_ALPHA,
+                 test_class=TwoSidedGrubbsTest, flag_col='outlier'):
+    """Run a Smirnov-Grubbs test on the values of every group of a polars
+    DataFrame at once, i.e. per relation and year.
+
+    :param polars.DataFrame df: data frame with a group and a value column
+    :param group_col: name or list of names of the columns defining the groups
+    :param str value_col: name of the column to test
+    :param float alpha: significance level
+    :param test_class: TwoSidedGrubbsTest, MinValueGrubbsTest or
+    MaxValueGrubbsTest
+    :param str flag_col: name of the added column
+    :return: df, in the same row order, with a boolean column flag_col that is
+    True for the outliers of each group. Null values are never outliers.
+    """
+    if pl is None:
+        raise ImportError('grouped_test requires polars')
+
+    group_cols = [group_col] if isinstance(group_col, str) else list(group_col)
+    grouped = (
+        df.select(group_cols + [value_col])
+        .with_row_index('_row')
+        .drop_nulls(value_col)
+        .sort(group_cols + ['_row'])
+    )
+    sizes = (
+        grouped.group_by(group_cols, maintain_order=True)
+        .len()['len']
+        .to_numpy()
+    )
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+    order = test_class(None)._removal_order(
+        grouped[value_col].to_numpy(), offsets, alpha)
+    flags = np.zeros(df.shape[0], dtype=bool)
+    flags[grouped['_row'].to_numpy()[order >= 0]] = True
+
+    return df.with_columns(pl.Series(flag_col, flags))
@@ -0,0 +1,240 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple, Union
+
+import polars as pl
+
+### Time-indexed graph store
+#
+# Instead of writing a full copy of the cumulative network for every year, the store keeps
+# one table per entity, each sorted by the year it enters the network:
+#
+#   <store_dir>/edges.parquet         edges sorted by 'first_pub'
+#   <store_dir>/nodes.parquet         nodes sorted by 'first_seen_year'
+#   <store_dir>/indications.parquet   indications sorted by 'first_seen_year'
+#   <store_dir>/store.json            years covered by the store and the 'year_cat' breaks
+#
+# Every table is written with row-group statistics, so `snapshot(year)` only reads the
+# row groups that can contain rows on or before `year`.
+#
+# Nodes and indications keep their row in the source tables as 'source_row', and every snapshot
+# is returned in that order, so seeded samples of a snapshot (i.e. the splits in 07) do not depend
+# on how the store was sorted.
+
+STORE_FILES = ["edges.parquet", "nodes.parquet", "indications.parquet", "store.json"]
+
+# row of each node and indication in the source tables
+ROW_INDEX = "source_row"
+
+# edges of the 'year_cat' buckets of approval year minus network year, ex. [-20, -15) -> '15-20 Before'
+YEAR_CAT_BREAKS = [-20, -15, -10, -5, 0, 5, 10, 15, 20]
+
+
+def year_category_labels(breaks: List[int] = YEAR_CAT_BREAKS) -> List[str]:
+    """
+    Returns the year category label of each bucket defined by `breaks`, from the lowest to the highest bucket.
+    Buckets below zero are years 'Before' approval and buckets at or above zero are years 'After' approval.
+
+    Example
+    ------------
+    year_category_labels([-5, 0, 5]) -> ["5+ Before", "0-5 Before", "0-5 After", "5+ After"]
+    """
+    assert breaks == sorted(breaks), "breaks must be sorted in ascending order"
+    assert breaks[0] <= 0 <= breaks[-1], "breaks must span 0, the year of approval"
+
+    def side(lo: int, hi: int) -> str:
+        if hi <= 0:
+            return f"{-hi}-{-lo} Before"
+        elif lo >= 0:
+            return f"{lo}-{hi} After"
+        return f"{-lo} Before-{hi} After"
+
+    labels = [f"{-breaks[0]}+ Before"]
+    labels += [side(lo, hi) for lo, hi in zip(breaks[:-1], breaks[1:])]
+    labels += [f"{breaks[-1]}+ After"]
+
+    return labels
+
+
+def year_category(
+    year_diff: Union[str, pl.Expr] = "year_diff",
+    breaks: List[int] = YEAR_CAT_BREAKS,
+) -> pl.Expr:
+    """
+    Returns an expression bucketing the difference between approval year and network year into year categories.
+    Buckets are closed on the left, i.e. with the default breaks a difference of 0 is '0-5 After' and -5 is '0-5 Before'.
+    Year categories can be recomputed from 'year_diff' with different breaks at any time.
+
+    :year_diff:     column name or expression of approval year minus network year
+    :breaks:        bucket edges, in ascending order
+
+    Example
+    ------------
+    indications.with_columns(year_cat=year_category("year_diff", breaks=[-10, 0, 10]))
+    """
+    if isinstance(year_diff, str):
+        year_diff = pl.col(year_diff)
+
+    return year_diff.cut(
+        breaks, labels=year_category_labels(breaks), left_closed=True
+    ).cast(pl.Utf8)
+
+
+def indication_year_categories(
+    indications: pl.DataFrame,
+    years: List[int],
+    breaks: List[int] = YEAR_CAT_BREAKS,
+) -> pl.DataFrame:
+    """
+    Computes 'year_diff' and 'year_cat' of every indication for every year in one pass, and adds the snapshot year as 'year'.
+    Indications with a 'first_seen_year' are only kept for the years on or after they appear in the network.
+    Rows are sorted by 'year', so each year's indications can be taken with `partition_by("year")`, and within a year
+    by 'source_row' if the indications have one.
+    """
+    ind_years = indications.lazy().join(
+        pl.LazyFrame({"year": list(years)}, schema={"year": pl.Int64}), how="cross"
+    )
+    if "first_seen_year" in indications.columns:
+        ind_years = ind_years.filter(pl.col("first_seen_year") <= pl.col("year")).drop(
+            "first_seen_year"
+        )
+
+    return (
+        ind_years.with_columns(
+            (pl.col("approval_year").cast(int) - pl.col("year")).alias("year_diff")
+        )
+        .with_columns(year_category("year_diff", breaks).alias("year_cat"))
+        .sort(["year", ROW_INDEX] if ROW_INDEX in indications.columns else "year")
+        .collect()
+    )
+
+
+def is_time_store(store_dir: str) -> bool:
+    """
+    Returns True if `store_dir` contains a time-indexed store written by `write_time_store`
+    """
+    return all(os.path.exists(os.path.join(store_dir, f)) for f in STORE_FILES)
+
+
+def write_time_store(
+    edges: pl.DataFrame,
+    nodes: pl.DataFrame,
+    indications: pl.DataFrame,
+    years: List[int],
+    store_dir: str,
+    breaks: List[int] = YEAR_CAT_BREAKS,
+    row_group_size: int = 250_000,
+) -> Dict[str, str]:
+    """
+    Writes edges, nodes and indications to a time-indexed store in `store_dir`.
+    Edges must have a 'first_pub' column, and nodes and indications a 'first_seen_year' column.
+    Each table is sorted by its year column before writing, unless it already is. Returns the paths of the written files.
+
+    :edges:             edges with their first publication year, 'first_pub'
+    :nodes:             nodes with the year of their first edge, 'first_seen_year'
+    :indications:       indications with the year both compound and disease exist, 'first_seen_year'
+    :years:             years a snapshot can be requested for. Ex. range(1950, 2024)
+    :store_dir:         directory to write the store to
+    :breaks:            default 'year_cat' bucket edges of snapshots read from the store
+    :row_group_size:    number of rows per parquet row group
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    paths = {f.split(".")[0]: os.path.join(store_dir, f) for f in STORE_FILES}
+
+    for df, year_col, name in [
+        (edges, "first_pub", "edges"),
+        (nodes, "first_seen_year", "nodes"),
+        (indications, "first_seen_year", "indications"),
+    ]:
+        if not df[year_col].is_sorted():
+            df = df.sort(year_col)
+        df.write_parquet(
+            file=paths[name], statistics=True, row_group_size=row_group_size
+        )
+
+    with open(paths["store"], "w") as f:
+        json.dump({"years": list(years), "year_cat_breaks": list(breaks)}, f)
+
+    return paths
+
+
+def read_store_info(store_dir: str) -> Dict[str, List[int]]:
+    """
+    Returns the years and 'year_cat' breaks recorded in the store at `store_dir`
+    """
+    with open(os.path.join(store_dir, "store.json")) as f:
+        return json.load(f)
+
+
+def snapshot_years(store_dir: str) -> List[int]:
+    """
+    Returns the years a snapshot can be requested for in the store at `store_dir`
+    """
+    return read_store_info(store_dir)["years"]
+
+
+def snapshot(
+    year: int, store_dir: str, breaks: Optional[List[int]] = None
+) -> Tuple[pl.LazyFrame, pl.LazyFrame, pl.LazyFrame]:
+    """
+    Returns lazy nodes, edges and indications of the network as it existed in `year`.
+    The year filters are pushed down to the parquet scan, so only the row groups on or before `year` are read.
+    Indications carry 'year_diff' (approval year minus `year`) and 'year_cat', bucketed by `breaks`, as in the per-year directories.
+    If `breaks` is None, the breaks the store was written with are used.
+    Nodes and indications are in the row order of the source tables, as in the per-year directories.
+
+    Example
+    ------------
+    nodes, edges, indications = snapshot(1987, "../data/time_store-6_metanode")
+    edges.select("h_id", "r", "t_id").collect()
+    """
+    if breaks is None:
+        breaks = read_store_info(store_dir).get("year_cat_breaks", YEAR_CAT_BREAKS)
+
+    nodes = (
+        pl.scan_parquet(os.path.join(store_dir, "nodes.parquet"))
+        .filter(pl.col("first_seen_year") <= year)
+        .drop("first_seen_year")
+    )
+    edges = pl.scan_parquet(os.path.join(store_dir, "edges.parquet")).filter(
+        pl.col("first_pub") <= year
+    )
+    indications = (
+        pl.scan_parquet(os.path.join(store_dir, "indications.parquet"))
+        .filter(pl.col("first_seen_year") <= year)
+        .drop("first_seen_year")
+        .with_columns((pl.col("approval_year").cast(int) - year).alias("year_diff"))
+        .with_columns(year_category("year_diff", breaks).alias("year_cat"))
+    )
+
+    return _source_order(nodes), edges, _source_order(indications)
+
+
+def _source_order(df: pl.LazyFrame) -> pl.LazyFrame:
+    # stores written before 'source_row' was kept are returned in store order
+    if ROW_INDEX in df.columns:
+        return df.sort(ROW_INDEX).drop(ROW_INDEX)
+    return df
+
+
+def read_year(file_dir: str) -> Tuple[pl.LazyFrame, pl.LazyFrame, pl.LazyFrame]:
+    """
+    Returns lazy nodes, edges and indications for a year directory, i.e. "<base_dir>/1987".
+    Reads the per-year parquet files if they exist, otherwise reads the snapshot of that year
+    from a time-indexed store in the parent directory.
+    """
+    files = [
+        os.path.join(file_dir, f)
+        for f in ["nodes.parquet", "edges.parquet", "indications.parquet"]
+    ]
+    if all(os.path.exists(f) for f in files):
+        return tuple(pl.scan_parquet(f) for f in files)
+
+    store_dir = os.path.dirname(os.path.abspath(file_dir))
+    assert is_time_store(
+        store_dir
+    ), f"{file_dir} has no network files and {store_dir} is not a time store"
+
+    return snapshot(
+        year=int(os.path.basename(os.path.normpath(file_dir))), store_dir=store_dir
+    )